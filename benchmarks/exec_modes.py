@@ -0,0 +1,48 @@
+"""Compares the two job execution paths in queuectl.executor.
+
+Runs the same tiny program N times through the shell path
+(execute_job_command, shell=True) and the direct argv path
+(execute_job_argv) and prints per-job latency for each.
+
+Usage: python benchmarks/exec_modes.py [--runs 500] [--program /bin/true]
+"""
+import argparse
+import statistics
+import time
+from queuectl import executor
+
+
+def _time_runs(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        exit_code = fn()
+        samples.append(time.perf_counter() - start)
+        if exit_code != 0:
+            raise SystemExit(f"Benchmark job failed with exit code {exit_code}")
+    return samples
+
+def _report(name, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1000
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1000
+    print(f"{name:<8} runs={len(samples):<6} p50={p50:7.3f}ms  p99={p99:7.3f}ms  "
+          f"jobs/s={len(samples) / sum(samples):8.1f}")
+    return p50
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=500)
+    parser.add_argument('--program', default='/bin/true')
+    args = parser.parse_args()
+
+    # An argument keeps the shell from treating the command as trivial.
+    command = f"{args.program} x"
+    argv = [args.program, 'x']
+
+    shell = _report('shell', _time_runs(lambda: executor.execute_job_command(command), args.runs))
+    direct = _report('argv', _time_runs(lambda: executor.execute_job_argv(argv), args.runs))
+    print(f"argv path is {shell / direct:.2f}x faster at p50")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""Reproducible performance benchmarks behind 'queuectl bench'.
+
+Every scenario runs against its own fresh queuectl directory inside a
+temporary folder (database.set_app_dir in this process, QUEUECTL_HOME for
+the worker processes it starts), so the real queue is never touched.
+Results are a JSON-serializable dict: latencies in milliseconds
+(p50/p99/max/mean) and throughput per second, plus enough environment
+details to compare runs across commits.
+"""
+import contextlib
+import math
+import os
+import platform
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from . import database
+from . import models
+from . import config
+
+SCENARIOS = (
+    'bulk_enqueue',
+    'single_enqueue',
+    'pickup_latency',
+    'contention',
+    'retry_heavy',
+    'list_status',
+)
+
+# How long any single wait (workers starting, a queue draining) may take.
+WAIT_TIMEOUT = 300
+
+
+def latency_stats(samples):
+    """Summarizes durations in seconds as p50/p99/max/mean milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+
+    return {
+        'count': len(ordered),
+        'p50_ms': round(percentile(50), 3),
+        'p99_ms': round(percentile(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+def _epoch(iso_timestamp):
+    return datetime.fromisoformat(iso_timestamp).timestamp()
+
+def _use_fresh_dir(root, name, shards=1):
+    """Switches this process to a new, initialized queuectl directory."""
+    database.set_app_dir(os.path.join(root, name))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        database.init_db(shards=shards)
+
+def _noop_jobs(prefix, count, **fields):
+    for i in range(count):
+        yield dict({'id': f"{prefix}-{i}", 'argv': ['true']}, **fields)
+
+def _wait_until(predicate, timeout=WAIT_TIMEOUT, interval=0.01):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Benchmark timed out waiting for workers")
+        time.sleep(interval)
+
+def _start_workers(count, concurrency=1):
+    """
+    Starts 'count' worker processes on the current directory and returns
+    once each one is listening for wakeups (i.e. idle and ready).
+    """
+    env = dict(os.environ, QUEUECTL_HOME=database.APP_DIR)
+    cmd = [sys.executable, '-m', 'queuectl.worker_launcher', '--concurrency', str(concurrency)]
+    procs = [
+        subprocess.Popen(cmd, env=env, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(count)
+    ]
+    wakeup_dir = os.path.join(database.APP_DIR, 'wakeup')
+
+    def ready():
+        if any(p.poll() is not None for p in procs):
+            raise RuntimeError(f"A benchmark worker exited early; see {database.LOG_FILE}")
+        try:
+            return len([n for n in os.listdir(wakeup_dir) if n.endswith('.sock')]) >= count
+        except OSError:
+            return False
+
+    try:
+        _wait_until(ready)
+    except Exception:
+        _stop_workers(procs)
+        raise
+    return procs
+
+def _stop_workers(procs):
+    for p in procs:
+        if p.poll() is None:
+            p.send_signal(signal.SIGTERM)
+    for p in procs:
+        try:
+            p.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+
+def _finished_count():
+    summary = models.get_job_summary()
+    return summary['completed'] + summary['dead']
+
+def _job_latencies(state):
+    """Seconds from enqueue to the last state change for jobs in 'state'."""
+    return [
+        _epoch(job['updated_at']) - _epoch(job['created_at'])
+        for job in models.iter_jobs(state=state)
+    ]
+
+
+def bench_bulk_enqueue(jobs, chunk_size=1000, **_):
+    """models.create_jobs in chunks: rows/s and per-chunk commit latency."""
+    chunk_latencies = []
+    started = time.perf_counter()
+    for chunk in models._chunks(_noop_jobs('bulk', jobs), chunk_size):
+        t = time.perf_counter()
+        models.create_jobs(chunk, chunk_size=chunk_size)
+        chunk_latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    return {
+        'jobs': jobs,
+        'chunk_size': chunk_size,
+        'seconds': round(elapsed, 3),
+        'jobs_per_sec': round(jobs / elapsed, 1),
+        'chunk_latency': latency_stats(chunk_latencies),
+    }
+
+def bench_single_enqueue(samples, **_):
+    """One models.create_job (one transaction + wakeup) per job."""
+    latencies = []
+    for i in range(samples):
+        t = time.perf_counter()
+        models.create_job({'id': f"single-{i}", 'argv': ['true']})
+        latencies.append(time.perf_counter() - t)
+    return {
+        'jobs': samples,
+        'jobs_per_sec': round(samples / sum(latencies), 1),
+        'latency': latency_stats(latencies),
+    }
+
+def bench_pickup_latency(samples, **_):
+    """
+    Time from the enqueue call to the claim by an idle worker, read from the
+    claim's own 'updated_at'. Each job sleeps briefly so its claim time can
+    be read before it completes.
+    """
+    procs = _start_workers(1)
+    latencies = []
+    try:
+        for i in range(samples):
+            job_id = f"pickup-{i}"
+            # Let the worker go back to waiting on its wakeup socket.
+            time.sleep(0.02)
+            enqueued_at = time.time()
+            models.create_job({'id': job_id, 'argv': ['sleep', '0.05']})
+            claimed = {}
+
+            def picked_up():
+                job = models.get_job(job_id)
+                if job['state'] != 'pending':
+                    claimed.update(job)
+                    return True
+                return False
+
+            _wait_until(picked_up, interval=0.001)
+            latencies.append(_epoch(claimed['updated_at']) - enqueued_at)
+            _wait_until(lambda: models.get_job(job_id)['state'] == 'completed')
+    finally:
+        _stop_workers(procs)
+    return {'jobs': samples, 'latency': latency_stats(latencies)}
+
+def bench_contention(jobs, workers, concurrency=1, shards=1, **_):
+    """
+    N workers draining no-op jobs at once: end-to-end jobs/s per worker
+    count, plus enqueue-to-completion latency per job.
+    """
+    results = []
+    root = os.path.dirname(database.APP_DIR)
+    for count in workers:
+        _use_fresh_dir(root, f"contention-{count}", shards)
+        procs = _start_workers(count, concurrency)
+        try:
+            started = time.perf_counter()
+            models.create_jobs(_noop_jobs('noop', jobs))
+            _wait_until(lambda: _finished_count() >= jobs, interval=0.02)
+            elapsed = time.perf_counter() - started
+        finally:
+            _stop_workers(procs)
+        results.append({
+            'workers': count,
+            'concurrency': concurrency,
+            'jobs': jobs,
+            'seconds': round(elapsed, 3),
+            'jobs_per_sec': round(jobs / elapsed, 1),
+            'job_latency': latency_stats(_job_latencies('completed')),
+        })
+    return {'runs': results}
+
+def bench_retry_heavy(jobs, workers, max_retries=3, **_):
+    """
+    Jobs that always fail, retried without backoff until they reach the
+    DLQ: exercises the failed -> retry -> dead path under contention.
+    """
+    jobs = max(1, jobs // max_retries)
+    count = max(workers)
+    config.set_config_value('backoff_base', '0')
+    procs = _start_workers(count)
+    try:
+        started = time.perf_counter()
+        models.create_jobs(
+            {'id': f"retry-{i}", 'argv': ['false'], 'max_retries': max_retries}
+            for i in range(jobs)
+        )
+        _wait_until(lambda: _finished_count() >= jobs, interval=0.02)
+        elapsed = time.perf_counter() - started
+    finally:
+        _stop_workers(procs)
+    attempts = jobs * max_retries
+    return {
+        'workers': count,
+        'jobs': jobs,
+        'attempts': attempts,
+        'seconds': round(elapsed, 3),
+        'attempts_per_sec': round(attempts / elapsed, 1),
+        'job_latency': latency_stats(_job_latencies('dead')),
+    }
+
+def bench_list_status(table_size, samples, page_size=100, **_):
+    """
+    'status' and 'list' against a large table: summary reads, first / deep
+    / per-state keyset pages, and a full streaming scan.
+    """
+    models.create_jobs(_noop_jobs('row', table_size), chunk_size=5000)
+    # Spread the rows over a few states, as on a long-lived queue.
+    for _, conn in models._shard_connections():
+        conn.execute("UPDATE jobs SET state = 'completed' WHERE rowid % 10 < 6")
+        conn.execute("UPDATE jobs SET state = 'dead' WHERE rowid % 10 = 6")
+        conn.commit()
+    for middle in models.iter_jobs(limit=max(1, table_size // 2)):
+        pass
+    deep_cursor = models.make_cursor(middle)
+
+    def timed(fn):
+        latencies = []
+        for _ in range(samples):
+            t = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - t)
+        return latency_stats(latencies)
+
+    def status():
+        models.get_job_summary()
+        models.count_stale_leases()
+
+    def page(**kwargs):
+        return lambda: sum(1 for _ in models.iter_jobs(limit=page_size, **kwargs))
+
+    started = time.perf_counter()
+    scanned = sum(1 for _ in models.iter_jobs())
+    scan_seconds = time.perf_counter() - started
+    return {
+        'table_size': table_size,
+        'status': timed(status),
+        'list_first_page': timed(page()),
+        'list_deep_page': timed(page(after=deep_cursor)),
+        'list_state_page': timed(page(state='dead')),
+        'list_full_scan': {
+            'rows': scanned,
+            'seconds': round(scan_seconds, 3),
+            'rows_per_sec': round(scanned / scan_seconds, 1),
+        },
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmarks(scenarios=None, jobs=5000, samples=200, workers=(1, 2, 4),
+                   table_size=100000, concurrency=1, shards=1, keep=False, progress=None):
+    """
+    Runs the selected scenarios (default: all, in SCENARIOS order) and
+    returns the report. 'progress' is an optional callback(message).
+    Diagnostics printed by queuectl itself go to stderr, so stdout stays
+    free for the JSON report.
+    """
+    scenarios = [name for name in SCENARIOS if not scenarios or name in scenarios]
+    params = {
+        'jobs': jobs,
+        'samples': samples,
+        'workers': list(workers),
+        'table_size': table_size,
+        'concurrency': concurrency,
+        'shards': shards,
+    }
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'scenarios': {},
+    }
+
+    original_dir = database.APP_DIR
+    root = tempfile.mkdtemp(prefix='queuectl-bench-')
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            for name in scenarios:
+                if progress:
+                    progress(f"Running {name}...")
+                _use_fresh_dir(root, name, shards)
+                started = time.perf_counter()
+                result = globals()[f"bench_{name}"](**params)
+                result['wall_seconds'] = round(time.perf_counter() - started, 3)
+                report['scenarios'][name] = result
+    finally:
+        database.set_app_dir(original_dir)
+        if keep:
+            report['bench_dir'] = root
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
@@ -0,0 +1,436 @@
+"""Local broker: one process that owns the job database.
+
+'queuectl broker start' runs it in the background, listening on
+~/.queuectl/broker.sock. Workers and CLI commands that find a broker send
+it their requests (see client.py) instead of opening SQLite themselves, so
+the broker is the only process taking the write lock and claims never
+wait for it. Without a broker everything keeps using SQLite directly.
+
+Protocol: one JSON array per line in each direction. A request is
+[op, args, kwargs]; the reply is [true, result] or [false, error type,
+message]. The ops are the models functions of the same name (see
+Broker.op_* and PASSTHROUGH_OPS), plus 'ping' and 'list_jobs' (one keyset
+page of iter_jobs). Each connection's requests are answered in order.
+Every op runs inline on the one thread, so only short ones are offered:
+gc and recounts run in the calling process instead (see client.py).
+
+The broker keeps a ReadyIndex in memory: pending jobs per queue and the
+next time a retry, scheduled job or schedule run comes due. A claim for
+queues with nothing ready is answered from it without touching SQLite,
+'next_due' needs no query, and when a due time passes the broker wakes
+the idle workers itself (enqueues already do), so workers never poll.
+The broker also listens for those wakeups like a worker: one sent by
+another process (a client that wrote SQLite directly) invalidates the
+index before the next claim is answered.
+
+The index holds counts, not jobs. A claim that may find work still runs
+models.claim_batch in a BEGIN IMMEDIATE transaction, and jobs are never
+pushed: idle workers are woken by a datagram and then send a claim.
+"""
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timezone
+from . import database
+from . import metrics
+from . import models
+from . import notify
+
+# Seconds between full reloads of the ready index from SQLite; this also
+# picks up writes made by processes that bypassed the broker.
+INDEX_REFRESH_INTERVAL = 5
+_RECV_SIZE = 64 * 1024
+# Name of the broker's snapshot in ~/.queuectl/metrics/.
+METRICS_NAME = 'broker'
+
+# Served by calling the models function of the same name unchanged.
+PASSTHROUGH_OPS = (
+    'get_job', 'get_job_summary', 'get_queue_summaries', 'count_stale_leases',
+    'renew_leases', 'set_tenant',
+)
+
+
+def socket_path():
+    return os.path.join(database.APP_DIR, 'broker.sock')
+
+
+class ReadyIndex:
+    """
+    What the broker knows about ready work without asking SQLite: pending
+    jobs per queue and the earliest due time of the jobs and schedules
+    that are waiting. Between reloads the pending counts may run high (an
+    enqueue that was a duplicate, a job whose tenant is at its cap), which
+    only costs a claim query that finds nothing; changes the broker cannot
+    account for exactly mark the index stale instead.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.next_due = None
+        self.stale = True
+        self.due_stale = True
+        self.loaded_at = 0
+
+    def reload(self):
+        summaries = models.get_queue_summaries()
+        self.pending = {name: summary['pending'] for name, summary in summaries.items() if summary['pending']}
+        self.next_due = models.next_due()
+        self.stale = self.due_stale = False
+        self.loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Reloads whatever is stale (everything every INDEX_REFRESH_INTERVAL)."""
+        if self.stale or time.monotonic() - self.loaded_at >= INDEX_REFRESH_INTERVAL:
+            self.reload()
+        elif self.due_stale:
+            self.next_due = models.next_due()
+            self.due_stale = False
+
+    def is_due(self, now):
+        return self.next_due is not None and self.next_due <= now
+
+    def may_have_work(self, queues, now):
+        """False only if no job in 'queues' (None = all) can be claimed now."""
+        self.refresh()
+        if self.is_due(now):
+            return True
+        names = self.pending if queues is None else queues
+        return any(self.pending.get(name, 0) > 0 for name in names)
+
+    def added(self, jobs):
+        """Accounts for enqueued job dicts (delayed ones move the due time)."""
+        for job_data in jobs:
+            if not isinstance(job_data, dict):
+                continue
+            if job_data.get('run_at') is not None or job_data.get('delay_seconds') is not None:
+                self.due_stale = True
+            else:
+                queue = job_data.get('queue') or models.DEFAULT_QUEUE
+                self.pending[queue] = self.pending.get(queue, 0) + 1
+
+    def claimed(self, jobs, due_before):
+        """
+        Accounts for claimed jobs. If something was already due, the claim
+        may have taken retries or promoted scheduled jobs rather than
+        pending ones, so the counts are reloaded instead.
+        """
+        if not jobs:
+            return
+        if due_before:
+            self.stale = True
+            return
+        for job in jobs:
+            left = self.pending.get(job['queue'], 0) - 1
+            if left > 0:
+                self.pending[job['queue']] = left
+            else:
+                self.pending.pop(job['queue'], None)
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+
+class Broker:
+    """Serves the job store to local clients from a single thread."""
+    def __init__(self):
+        self.path = socket_path()
+        self.selector = selectors.DefaultSelector()
+        self.index = ReadyIndex()
+        self.listener = None
+        self.wakeups = None
+        self.connections = set()
+        self.running = True
+        self.started_at = time.time()
+        self.requests = 0
+        self.woken_for = None
+        self.next_metrics_dump = 0
+        self.unblocked = metrics.counter('jobs_unblocked_total')
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+
+    def log(self, message):
+        print(f"[broker {os.getpid()}] {message}")
+
+    def handle_shutdown(self, signum, frame):
+        self.running = False
+
+    def listen(self):
+        """Binds the socket, replacing a stale one but never a live broker."""
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise RuntimeError(f"Another broker is already listening on {self.path}.")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # Signals interrupt select() through this pair.
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        signal.set_wakeup_fd(self._wakeup_w.fileno())
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+        # Work made available behind the broker's back (see check_wakeups).
+        self.wakeups = notify.WakeupListener(METRICS_NAME, own_wakeups=False)
+        if self.wakeups.sock is not None:
+            self.selector.register(self.wakeups.sock, selectors.EVENT_READ)
+
+    def check_wakeups(self):
+        """Marks the index stale if another process announced new work."""
+        if self.wakeups is not None and self.wakeups.drain():
+            self.index.stale = True
+
+    # --- operations -------------------------------------------------------
+
+    def op_ping(self):
+        return {
+            'pid': os.getpid(),
+            'path': self.path,
+            'started_at': self.started_at,
+            # Not counting the connection asking.
+            'clients': len(self.connections) - 1,
+            'requests': self.requests,
+            'ready': sum(self.index.pending.values()),
+            'next_due': self.index.next_due,
+        }
+
+    def op_create_job(self, job_data):
+        return self.op_enqueue_job(job_data)['id']
+
+    def op_enqueue_job(self, job_data):
+        job = models.enqueue_job(job_data)
+        self.index.added([job_data])
+        return job
+
+    def op_create_jobs(self, jobs, chunk_size=1000, on_duplicate='fail'):
+        """create_jobs, returning the rejected jobs instead of calling back."""
+        errors = []
+        stats = models.create_jobs(
+            jobs, chunk_size, on_duplicate,
+            on_error=lambda job_data, message: errors.append([job_data, message]),
+        )
+        self.index.added(jobs)
+        return {'stats': stats, 'errors': errors}
+
+    def op_list_jobs(self, state=None, limit=None, after=None, queue=None):
+        return models.list_jobs(state, limit=limit, after=after, queue=queue)
+
+    def op_claim_batch(self, worker_id, n, queues=None):
+        now = time.time()
+        # The wakeup that sent this worker here may not have been read yet.
+        self.check_wakeups()
+        if not self.index.may_have_work(queues, now):
+            return []
+        jobs = models.claim_batch(worker_id, n, queues)
+        self.index.claimed(jobs, self.index.is_due(now))
+        return jobs
+
+    def op_release_jobs(self, job_ids):
+        models.release_jobs(job_ids)
+        self.index.stale = True
+
+    def op_apply_job_transitions(self, transitions, worker_id=None):
+        unblocked = self.unblocked.value
+        ok = models.apply_job_transitions(transitions, worker_id=worker_id)
+        if self.unblocked.value != unblocked:
+            # Dependent jobs were released, to 'pending' or 'scheduled'.
+            self.index.stale = True
+        elif any(transition[1] == 'failed' for transition in transitions):
+            self.index.due_stale = True
+        return ok
+
+    def op_reap_expired_leases(self):
+        reaped = models.reap_expired_leases()
+        if reaped:
+            self.index.due_stale = True
+        return reaped
+
+    def op_next_due(self):
+        self.check_wakeups()
+        self.index.refresh()
+        return self.index.next_due
+
+    def op_retry_dead_job(self, job_id):
+        models.retry_dead_job(job_id)
+        self.index.stale = True
+
+    def op_add_schedule(self, name, cron_expression, job_data):
+        next_run_at = models.add_schedule(name, cron_expression, job_data)
+        self.index.due_stale = True
+        return next_run_at
+
+    def op_remove_schedule(self, name):
+        models.remove_schedule(name)
+        self.index.due_stale = True
+
+    def dispatch(self, line):
+        """Runs one request line and returns the reply line."""
+        self.requests += 1
+        try:
+            op, args, kwargs = json.loads(line)
+            handler = getattr(self, f"op_{op}", None)
+            if handler is None and op in PASSTHROUGH_OPS:
+                handler = getattr(models, op)
+            if handler is None:
+                raise ValueError(f"Unknown broker operation '{op}'.")
+            reply = [True, handler(*args, **kwargs)]
+        except Exception as e:
+            reply = [False, type(e).__name__, str(e)]
+        return json.dumps(reply, separators=(',', ':')).encode() + b'\n'
+
+    # --- connections ------------------------------------------------------
+
+    def accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        conn = _Connection(sock)
+        self.connections.add(conn)
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def drop(self, conn):
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        self.connections.discard(conn)
+
+    def read(self, conn):
+        try:
+            data = conn.sock.recv(_RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.drop(conn)
+            return
+        conn.inbuf += data
+        while True:
+            end = conn.inbuf.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(conn.inbuf[:end])
+            del conn.inbuf[:end + 1]
+            conn.outbuf += self.dispatch(line)
+        self.write(conn)
+
+    def write(self, conn):
+        """Sends what it can; waits for EVENT_WRITE if the client is slow."""
+        try:
+            sent = conn.sock.send(conn.outbuf) if conn.outbuf else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop(conn)
+            return
+        del conn.outbuf[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbuf else 0)
+        self.selector.modify(conn.sock, events, conn)
+
+    # --- main loop --------------------------------------------------------
+
+    def wake_if_due(self, now):
+        """Wakes idle workers once for each due time that passes."""
+        due = self.index.next_due
+        if self.index.is_due(now) and due != self.woken_for:
+            self.woken_for = due
+            notify.wake_workers()
+
+    def select_timeout(self, now):
+        timeout = INDEX_REFRESH_INTERVAL
+        if self.index.next_due is not None and self.index.next_due > now:
+            timeout = min(timeout, self.index.next_due - now)
+        return max(0, timeout)
+
+    def maybe_dump_metrics(self):
+        now = time.monotonic()
+        if now >= self.next_metrics_dump:
+            metrics.dump(METRICS_NAME)
+            self.next_metrics_dump = now + metrics.DUMP_INTERVAL
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_shutdown)
+        signal.signal(signal.SIGINT, self.handle_shutdown)
+        self.listen()
+        self.log(f"Listening on {self.path}.")
+        try:
+            while self.running:
+                now = time.time()
+                try:
+                    self.index.refresh()
+                    self.wake_if_due(now)
+                except Exception as e:
+                    self.log(f"Error refreshing the ready index: {e}")
+                self.maybe_dump_metrics()
+                for key, mask in self.selector.select(self.select_timeout(now)):
+                    if key.fileobj is self.listener:
+                        self.accept()
+                    elif self.wakeups is not None and key.fileobj is self.wakeups.sock:
+                        self.check_wakeups()
+                    elif key.fileobj is self._wakeup_r:
+                        try:
+                            while self._wakeup_r.recv(64):
+                                pass
+                        except OSError:
+                            pass
+                    elif mask & selectors.EVENT_READ:
+                        self.read(key.data)
+                    elif key.data in self.connections:
+                        self.write(key.data)
+        finally:
+            self.close()
+        self.log("Stopped.")
+
+    def close(self):
+        signal.set_wakeup_fd(-1)
+        for conn in list(self.connections):
+            self.drop(conn)
+        if self.listener is not None:
+            self.listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self.wakeups is not None:
+            self.wakeups.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        self.selector.close()
+        metrics.remove_dump(METRICS_NAME)
+
+
+def run_broker():
+    """Entry point of the detached broker process; logs to LOG_FILE."""
+    try:
+        os.makedirs(database.APP_DIR, exist_ok=True)
+        log_f = open(database.LOG_FILE, 'a', buffering=1)
+        sys.stdout = log_f
+        sys.stderr = log_f
+        print(f"\n--- Starting broker at {datetime.now(timezone.utc).isoformat()} ---")
+    except Exception as e:
+        print(f"Failed to open log file: {e}", file=sys.__stderr__)
+        return
+    try:
+        Broker().run()
+    except Exception as e:
+        print(f"[broker {os.getpid()}] FATAL ERROR: {e}")
+    finally:
+        database.close_db_connection()
+        log_f.close()
+
+
+if __name__ == '__main__':
+    run_broker()
@@ -1,4 +1,5 @@
 import click
+import csv
 import json
 import uuid
 import os
@@ -13,11 +14,24 @@ from . import database
 from . import models
 from . import worker as worker_module
 from . import config as config_module
+from . import bench as bench_module
+from . import metrics as metrics_module
+from . import profiling
+from . import supervisor as supervisor_module
+from . import broker as broker_module
+from . import client as client_module
 
-def start_worker_process():
+def start_worker_process(prefetch=1, concurrency=1, ack_batch=1, ack_flush_ms=50, queues=None,
+                         metrics_port=None, profile=False):
     """
     Target function for a new worker process.
     Instantiates and runs a worker.
+    'prefetch' is the number of jobs the worker claims per transaction,
+    'concurrency' the number of jobs it runs at once, and 'ack_batch' /
+    'ack_flush_ms' control group commit of job results. 'queues' lists the
+    queues to serve in order of precedence (None = all); 'metrics_port'
+    serves Prometheus metrics on localhost. 'profile' (or the 'profile'
+    config key) runs the sampling profiler for the life of the process.
     Includes robust logging for debugging crashes.
     """
     try:
@@ -32,9 +46,25 @@ def start_worker_process():
         return
 
     worker_id = f"worker-{uuid.uuid4().hex[:8]}"
+    sampler = None
     try:
         print(f"[{worker_id}] Process started (PID: {os.getpid()}).")
-        w = worker_module.Worker(worker_id)
+        if profile or config_module.get_config_value('profile'):
+            sampler = profiling.Sampler(
+                worker_id,
+                interval=config_module.get_config_value('profile_interval_ms') / 1000,
+                dump_interval=config_module.get_config_value('profile_dump_interval'),
+            )
+            sampler.start()
+        w = worker_module.Worker(
+            worker_id,
+            prefetch=prefetch,
+            concurrency=concurrency,
+            ack_batch=ack_batch,
+            ack_flush_ms=ack_flush_ms,
+            queues=queues,
+            metrics_port=metrics_port,
+        )
         print(f"[{worker_id}] Worker instantiated. Starting run loop...")
         w.run()
         print(f"[{worker_id}] Run loop exited cleanly.")
@@ -47,6 +77,9 @@ def start_worker_process():
         traceback.print_exc(file=sys.stderr)
         print("--- End of error ---")
     finally:
+        if sampler is not None:
+            sampler.stop()
+        database.close_db_connection()
         print(f"[{worker_id}] Process exiting.")
         log_f.close()
 
@@ -68,6 +101,14 @@ def clear_pid_file():
     if os.path.exists(database.PID_FILE):
         os.remove(database.PID_FILE)
 
+def get_broker_info():
+    """Returns the running broker's status (see Broker.op_ping), or None."""
+    broker_client = client_module.BrokerClient()
+    try:
+        return broker_client.ping()
+    finally:
+        broker_client.close()
+
 def is_process_running(pid):
     """Checks if a process with the given PID is running."""
     try:
@@ -85,28 +126,98 @@ def main():
     pass
 
 @main.command('init-db')
-def init_db_command():
+@click.option('--shards', default=None, type=click.IntRange(min=1),
+              help='Split a new job store over this many SQLite files.')
+def init_db_command(shards):
     """
     Initializes the job queue database.
     """
     try:
-        database.init_db()
+        database.init_db(shards=shards)
     except Exception as e:
         click.echo(f"Error initializing database: {e}", err=True)
 
+def iter_jsonl_jobs(fh, on_error):
+    """
+    Lazily parses a JSONL stream into job dicts, one per non-blank line.
+    Lines that are not valid JSON are passed to on_error(line_no, message)
+    and skipped.
+    """
+    for line_no, line in enumerate(fh, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            on_error(line_no, f"invalid JSON ({e.msg})")
+
 @main.command()
-@click.argument('job_json_string')
-def enqueue(job_json_string):
+@click.argument('job_json_string', required=False)
+@click.option('--file', 'jobs_file', type=click.File('r'), default=None,
+              help="Bulk-enqueue jobs from a JSONL file, one job per line ('-' for stdin).")
+@click.option('--chunk-size', default=1000, type=click.IntRange(min=1),
+              help='Jobs inserted per transaction with --file.')
+@click.option('--on-duplicate', type=click.Choice(['fail', 'ignore']), default='fail',
+              help="With --file: report duplicate IDs as errors ('fail') or skip them ('ignore').")
+def enqueue(job_json_string, jobs_file, chunk_size, on_duplicate):
     """
     Add a new job to the queue.
     
     JOB_JSON_STRING: A JSON string defining the job.
     Example: '{"id": "job1", "command": "sleep 10"}'
+
+    Add "run_at" (ISO 8601 or epoch seconds) or "delay_seconds" to run
+    the job later; recurring jobs are managed with 'queuectl schedule'.
+    Add "depends_on": ["id", ...] to run it only after those jobs complete.
+
+    Use --file jobs.jsonl (or --file - for stdin) to load many jobs at once.
     """
+    if (job_json_string is None) == (jobs_file is None):
+        click.echo("Error: Provide either JOB_JSON_STRING or --file.", err=True)
+        return
+
+    if jobs_file is not None:
+        parse_errors = 0
+
+        def report_line(line_no, message):
+            nonlocal parse_errors
+            parse_errors += 1
+            click.echo(f"Error: line {line_no}: {message}", err=True)
+
+        def report(job_data, message):
+            job_id = job_data.get('id') if isinstance(job_data, dict) else None
+            click.echo(f"Error: job {job_id!r}: {message}", err=True)
+
+        try:
+            stats = client_module.get_backend().create_jobs(
+                iter_jsonl_jobs(jobs_file, report_line),
+                chunk_size=chunk_size,
+                on_duplicate=on_duplicate,
+                on_error=report,
+            )
+            click.echo(
+                f"Enqueued {stats['inserted']} job(s); "
+                f"skipped {stats['skipped']} duplicate(s); "
+                f"{stats['errors'] + parse_errors} error(s)."
+            )
+        except Exception as e:
+            click.echo(f"An unexpected error occurred: {e}", err=True)
+        return
+
     try:
         job_data = json.loads(job_json_string)
-        job_id = models.create_job(job_data)
-        click.echo(f"Job '{job_id}' enqueued with state 'pending'.")
+        backend = client_module.get_backend()
+        job = backend.enqueue_job(job_data)
+        message = f"Job '{job['id']}' enqueued on queue '{job['queue']}' with state '{job['state']}'"
+        if job['state'] == 'scheduled':
+            due = datetime.fromtimestamp(job['next_run_at'], timezone.utc).isoformat()
+            message += f" (due {due})"
+        elif job['state'] == 'blocked':
+            message += f" (waiting for {job['pending_deps']} parent job(s))"
+        elif job['state'] == 'cancelled':
+            message += " (a parent job is in the DLQ)"
+        click.echo(message + ".")
     except json.JSONDecodeError:
         click.echo("Error: Invalid JSON string.", err=True)
     except ValueError as e:
@@ -114,35 +225,123 @@ def enqueue(job_json_string):
     except Exception as e:
         click.echo(f"An unexpected error occurred: {e}", err=True)
 
-def print_jobs(jobs):
-    """Helper function to print a list of jobs."""
-    if not jobs:
-        click.echo("No jobs found.")
-        return
-    
-    click.echo(f"{'ID':<20} {'COMMAND':<25} {'STATE':<12} {'ATTEMPTS':<10} {'LAST_UPDATED':<20}")
-    click.echo("-" * 87)
+def print_jobs(jobs, output_format='table'):
+    """
+    Helper function to print jobs from any iterable, one row at a time.
+    Returns the last job printed (None if there were none).
+    """
+    last = None
+    if output_format == 'jsonl':
+        for job in jobs:
+            click.echo(json.dumps(job))
+            last = job
+        return last
+
+    if output_format == 'csv':
+        writer = None
+        for job in jobs:
+            if writer is None:
+                writer = csv.DictWriter(sys.stdout, fieldnames=job.keys(), lineterminator='\n')
+                writer.writeheader()
+            writer.writerow(job)
+            last = job
+        return last
+
     for job in jobs:
+        if last is None:
+            click.echo(
+                f"{'ID':<20} {'COMMAND':<25} {'STATE':<12} {'QUEUE':<12} {'TENANT':<12} "
+                f"{'PRIO':>5} {'ATTEMPTS':<10} {'LAST_UPDATED':<20}"
+            )
+            click.echo("-" * 119)
         attempts = f"{job['attempts']}/{job['max_retries']}"
-        click.echo(f"{job['id']:<20} {job['command']:<25} {job['state']:<12} {attempts:<10} {job['updated_at']:<20}")
+        click.echo(
+            f"{job['id']:<20} {job['command']:<25} {job['state']:<12} {job['queue']:<12} "
+            f"{job['tenant']:<12} {job['priority']:>5} {attempts:<10} {job['updated_at']:<20}"
+        )
+        last = job
+    if last is None:
+        click.echo("No jobs found.")
+    return last
 
 @main.command()
 @click.option('--state', default=None, help='Filter jobs by state (e.g., pending, failed).')
-def list(state):
+@click.option('--queue', default=None, help='Filter jobs by queue.')
+@click.option('--group-by-queue', is_flag=True, help='Show jobs queue by queue.')
+@click.option('--limit', default=None, type=click.IntRange(min=1), help='Show at most N jobs.')
+@click.option('--after', default=None, help='Continue after this cursor (printed by a previous --limit page).')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'jsonl', 'csv']), default='table',
+              help='Output format; jsonl and csv stream one job per line.')
+def list(state, queue, group_by_queue, limit, after, output_format):
     """
-    List jobs in the queue.
+    List jobs in the queue, oldest first.
+
+    With --group-by-queue, jobs are listed one queue at a time (and --limit
+    applies to each queue).
     """
     try:
         if state:
             state = state.lower()
-            valid_states = ['pending', 'processing', 'completed', 'failed', 'dead']
+            valid_states = ['scheduled', 'blocked', 'pending', 'processing', 'completed', 'failed', 'dead', 'cancelled']
             if state not in valid_states:
                 click.echo(f"Error: Invalid state '{state}'. Must be one of {valid_states}", err=True)
                 return
 
-        jobs = models.list_jobs(state)
-        print_jobs(jobs)
+        shown = 0
+        def counted(jobs):
+            nonlocal shown
+            for job in jobs:
+                shown += 1
+                yield job
 
+        backend = client_module.get_backend()
+        if group_by_queue:
+            queues = [queue] if queue else sorted(backend.get_queue_summaries())
+            for name in queues:
+                if output_format == 'table':
+                    click.echo(f"\n=== Queue: {name} ===")
+                print_jobs(backend.iter_jobs(state, after=after, limit=limit, queue=name), output_format)
+            return
+
+        last = print_jobs(counted(backend.iter_jobs(state, after=after, limit=limit, queue=queue)), output_format)
+        if limit and last and shown == limit:
+            click.echo(f"Next page: --after {models.make_cursor(last)}", err=True)
+
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@main.command()
+@click.argument('job_id')
+@click.option('--stderr', 'stream', flag_value='stderr', help='Show stderr instead of stdout.')
+@click.option('--stdout', 'stream', flag_value='stdout', default=True, help='Show stdout (default).')
+def logs(job_id, stream):
+    """
+    Show the captured output of a job's latest run.
+
+    Output is stored under ~/.queuectl/output/<job_id>/; long output keeps
+    only its first and last 'output_head_bytes'/'output_tail_bytes'.
+    """
+    try:
+        job = client_module.get_backend().get_job(job_id)
+        if not job:
+            click.echo(f"Error: Job with ID '{job_id}' not found.", err=True)
+            return
+        path = job[f'{stream}_path']
+        if not path:
+            click.echo(f"No captured output for job '{job_id}'.", err=True)
+            return
+        click.echo(f"--- {stream} of {job_id} ({job[f'{stream}_bytes']} bytes written, {path}) ---", err=True)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                sys.stdout.buffer.write(chunk)
+        sys.stdout.flush()
+    except FileNotFoundError:
+        click.echo(f"Error: Output file for job '{job_id}' no longer exists.", err=True)
     except Exception as e:
         click.echo(f"An unexpected error occurred: {e}", err=True)
 
@@ -155,9 +354,32 @@ def worker():
 
 @worker.command()
 @click.option('--count', default=1, help='Number of workers to start.')
-def start(count):
+@click.option('--prefetch', default=1, type=click.IntRange(min=1),
+              help='Jobs each worker claims per transaction and buffers locally.')
+@click.option('--concurrency', default=1, type=click.IntRange(min=1),
+              help='Jobs each worker process runs at the same time.')
+@click.option('--ack-batch', default=1, type=click.IntRange(min=1),
+              help='Group-commit up to N job results per transaction (1 = commit each).')
+@click.option('--ack-flush-ms', default=50, type=click.IntRange(min=0),
+              help='Longest a job result waits in memory before it is committed.')
+@click.option('--queues', default=None,
+              help="Comma-separated queues to serve, highest precedence first (default: all queues).")
+@click.option('--metrics-port', default=None, type=click.IntRange(min=1, max=65535),
+              help='Serve Prometheus metrics on 127.0.0.1; worker N uses this port + N.')
+@click.option('--profile', is_flag=True,
+              help="Run the sampling profiler in each worker (see 'queuectl profile report').")
+@click.option('--min', 'min_workers', default=None, type=click.IntRange(min=0),
+              help='Supervised mode: never fewer than this many workers (default 1).')
+@click.option('--max', 'max_workers', default=None, type=click.IntRange(min=1),
+              help='Supervised mode: autoscale up to this many workers.')
+def start(count, prefetch, concurrency, ack_batch, ack_flush_ms, queues, metrics_port, profile,
+          min_workers, max_workers):
     """
     Start one or more workers in the background.
+
+    With --max (and optionally --min) a supervisor process owns the
+    workers instead: it restarts any that die and scales the pool with
+    the backlog. 'queuectl worker stop' drains the whole pool.
     """
     running_pids = get_running_pids()
     active_pids = [pid for pid in running_pids if is_process_running(pid)]
@@ -166,11 +388,51 @@ def start(count):
         click.echo(f"Workers are already running with PIDs: {active_pids}")
         click.echo("Please stop them first with 'queuectl worker stop'.")
         return
+    if queues is not None:
+        queues = ",".join(q.strip() for q in queues.split(',') if q.strip())
+        if not queues:
+            click.echo("Error: --queues needs at least one queue name.", err=True)
+            return
     processes = []
-    cmd = [sys.executable, '-m', 'queuectl.worker_launcher']
-    for _ in range(count):
+    cmd = [
+        sys.executable, '-m', 'queuectl.worker_launcher',
+        '--prefetch', str(prefetch),
+        '--concurrency', str(concurrency),
+        '--ack-batch', str(ack_batch),
+        '--ack-flush-ms', str(ack_flush_ms),
+    ]
+    if queues:
+        cmd += ['--queues', queues]
+    if profile:
+        cmd.append('--profile')
+
+    if min_workers is not None and max_workers is None:
+        max_workers = max(min_workers, count)
+    if max_workers is not None:
+        if min_workers is None:
+            min_workers = min(count, max_workers)
+        if min_workers > max_workers:
+            click.echo("Error: --min cannot be greater than --max.", err=True)
+            return
+        supervisor_cmd = [
+            sys.executable, '-m', 'queuectl.supervisor',
+            '--min', str(min_workers), '--max', str(max_workers),
+        ]
+        if metrics_port:
+            supervisor_cmd += ['--metrics-port', str(metrics_port)]
+        cmd = supervisor_cmd + ['--'] + cmd[3:]
+        count = 0
+        try:
+            processes.append(subprocess.Popen(cmd, close_fds=True, start_new_session=True))
+        except Exception as e:
+            click.echo(f"Error starting supervisor subprocess: {e}", err=True)
+
+    for index in range(count):
+        worker_cmd = cmd
+        if metrics_port:
+            worker_cmd = cmd + ['--metrics-port', str(metrics_port + index)]
         try:
-            p = subprocess.Popen(cmd, close_fds=True, start_new_session=True)
+            p = subprocess.Popen(worker_cmd, close_fds=True, start_new_session=True)
             processes.append(p)
         except Exception as e:
             click.echo(f"Error starting worker subprocess: {e}", err=True)
@@ -180,7 +442,10 @@ def start(count):
         with open(database.PID_FILE, 'w') as f:
             for pid in pids_to_save:
                 f.write(f"{pid}\n")
-        click.echo(f"Started {count} worker(s) in the background with PIDs: {pids_to_save}")
+        if max_workers is not None:
+            click.echo(f"Started supervisor (PID {pids_to_save[0]}) for {min_workers}-{max_workers} worker(s).")
+        else:
+            click.echo(f"Started {count} worker(s) in the background with PIDs: {pids_to_save}")
     except Exception as e:
         click.echo(f"Error writing PID file: {e}")
         click.echo("Workers started, but PID file not written. You may need to stop them manually.")
@@ -209,11 +474,35 @@ def stop():
     click.echo(f"Signal sent to {stopped_count} process(es).")
     clear_pid_file()
     
+def print_summary(summary, indent="  ", stale_leases=0):
+    """Prints the per-state counts of a job summary."""
+    click.echo(f"{indent}Total:      {summary['total']}")
+    click.echo(f"{indent}Scheduled:  {summary['scheduled']}")
+    click.echo(f"{indent}Blocked:    {summary['blocked']}")
+    click.echo(f"{indent}Pending:    {summary['pending']}")
+    click.echo(f"{indent}Processing: {summary['processing']}")
+    if stale_leases:
+        click.echo(f"{indent}  Stale leases: {stale_leases} (worker stopped heartbeating; will be reclaimed)")
+    click.echo(f"{indent}Completed:  {summary['completed']}")
+    click.echo(f"{indent}Failed:     {summary['failed']}")
+    click.echo(f"{indent}Dead (DLQ): {summary['dead']}")
+    click.echo(f"{indent}Cancelled:  {summary['cancelled']}")
+
 @main.command()
-def status():
+@click.option('--recount', is_flag=True, help='Rebuild the job counters from a full table scan first.')
+@click.option('--queue', default=None, help='Only show the counts for this queue.')
+def status(recount, queue):
     """
-    Show summary of all job states & active workers.
+    Show summary of all job states & active workers, per queue.
     """
+    backend = client_module.get_backend()
+    if recount:
+        try:
+            backend.recount_jobs()
+            click.echo("Job counters rebuilt.")
+        except Exception as e:
+            click.echo(f"Error rebuilding job counters: {e}", err=True)
+
     click.echo("--- Worker Status ---")
     running_pids = get_running_pids()
     active_pids = [pid for pid in running_pids if is_process_running(pid)]
@@ -224,17 +513,356 @@ def status():
             click.echo("Cleaning up stale PID file.")
             clear_pid_file()
     else:
-        click.echo(f"Found {len(active_pids)} active worker(s): {active_pids}")
+        state = supervisor_module.read_state()
+        if state and state['pid'] in active_pids:
+            click.echo(f"Supervisor PID {state['pid']}: {len(state['workers'])} worker(s) "
+                       f"(min {state['min']}, max {state['max']}), restarts: {state['restarts']}")
+            if state['workers']:
+                click.echo(f"  Workers: {state['workers']}")
+            if state['draining']:
+                click.echo(f"  Draining: {state['draining']}")
+        else:
+            click.echo(f"Found {len(active_pids)} active worker(s): {active_pids}")
+    if backend is not models:
+        info = backend.ping()
+        if info:
+            click.echo(f"Broker PID {info['pid']} serving {info['clients']} client(s) on {info['path']}")
+
+    if queue is not None:
+        click.echo(f"\n--- Job Summary (queue '{queue}') ---")
+        print_summary(backend.get_job_summary(queue))
+        return
 
     click.echo("\n--- Job Summary ---")
-    summary = models.get_job_summary()
-    click.echo(f"  Total:      {summary['total']}")
-    click.echo(f"  Pending:    {summary['pending']}")
-    click.echo(f"  Processing: {summary['processing']}")
-    click.echo(f"  Completed:  {summary['completed']}")
-    click.echo(f"  Failed:     {summary['failed']}")
-    click.echo(f"  Dead (DLQ): {summary['dead']}")
+    summaries = backend.get_queue_summaries()
+    print_summary(backend.get_job_summary(), stale_leases=backend.count_stale_leases())
+
+    # Broken down per queue once anything uses a non-default queue.
+    active_queues = [name for name, summary in summaries.items() if summary['total']]
+    if active_queues != [models.DEFAULT_QUEUE]:
+        for name in active_queues:
+            click.echo(f"\n  Queue '{name}':")
+            print_summary(summaries[name], indent="    ")
+
+
+@main.command()
+@click.option('--archive/--delete', default=None,
+              help='Move expired jobs to a dated archive DB, or delete them (default: gc_archive config).')
+@click.option('--batch-size', default=None, type=click.IntRange(min=1),
+              help='Jobs removed per transaction (default: gc_batch_size config).')
+def gc(archive, batch_size):
+    """
+    Remove finished jobs past their retention period.
+
+    Set the policy with 'queuectl config set completed_ttl <seconds>' and
+    'queuectl config set dead_ttl <seconds>' (0 keeps jobs forever).
+    """
+    try:
+        stats = client_module.get_backend().gc_finished_jobs(archive=archive, batch_size=batch_size)
+        verb = f"Archived to {stats['archive']}" if stats['archive'] else "Deleted"
+        click.echo(f"{verb}: {stats['completed']} completed, {stats['dead']} dead, {stats['cancelled']} cancelled job(s).")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@main.command()
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(bench_module.SCENARIOS),
+              help='Run only this scenario (repeatable; default: all).')
+@click.option('--jobs', default=5000, type=click.IntRange(min=1),
+              help='Jobs per bulk-enqueue, contention and retry run.')
+@click.option('--samples', default=200, type=click.IntRange(min=1),
+              help='Measurements per latency scenario.')
+@click.option('--workers', default='1,2,4', help='Comma-separated worker counts for the contention runs.')
+@click.option('--concurrency', default=1, type=click.IntRange(min=1), help='--concurrency of each benchmark worker.')
+@click.option('--shards', default=1, type=click.IntRange(min=1), help='Shard count of the benchmark queues.')
+@click.option('--table-size', default=100000, type=click.IntRange(min=1),
+              help='Rows in the table used for the list/status scenario.')
+@click.option('--output', 'output_path', type=click.Path(dir_okay=False), default=None,
+              help='Also write the JSON report to this file.')
+@click.option('--keep', is_flag=True, help='Keep the temporary queuectl directories for inspection.')
+def bench(scenarios, jobs, samples, workers, concurrency, shards, table_size, output_path, keep):
+    """
+    Benchmark queuectl and print a JSON report.
+
+    Runs against throwaway queuectl directories (your queue is not touched)
+    and reports p50/p99/max latencies and throughput for enqueue, pickup,
+    N-worker contention, retries and list/status on a large table.
+    """
+    try:
+        worker_counts = [int(w) for w in workers.split(',') if w.strip()]
+        if not worker_counts or min(worker_counts) < 1:
+            raise ValueError
+    except ValueError:
+        click.echo("Error: --workers must be a comma-separated list of positive integers.", err=True)
+        return
+
+    try:
+        report = bench_module.run_benchmarks(
+            scenarios=scenarios,
+            jobs=jobs,
+            samples=samples,
+            workers=worker_counts,
+            table_size=table_size,
+            concurrency=concurrency,
+            shards=shards,
+            keep=keep,
+            progress=lambda message: click.echo(message, err=True),
+        )
+        output = json.dumps(report, indent=2)
+        click.echo(output)
+        if output_path:
+            with open(output_path, 'w') as f:
+                f.write(output + "\n")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@main.command()
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json', 'prometheus']), default='table',
+              help='table: percentiles per metric; json/prometheus: raw histograms.')
+@click.option('--per-worker', is_flag=True, help='Show each worker separately instead of merged.')
+def metrics(output_format, per_worker):
+    """
+    Show hot-path latency histograms and counters from running workers.
+
+    Workers write a snapshot every few seconds; values cover each worker's
+    lifetime. Latencies in the table are estimated from the histogram
+    buckets (max is exact).
+    """
+    try:
+        dumps = metrics_module.load_dumps()
+        if not dumps:
+            click.echo("No metrics found (are workers running?).")
+            return
+        if per_worker:
+            groups = [(d['worker_id'], d['metrics']) for d in dumps]
+        else:
+            groups = [(f"{len(dumps)} worker(s)", metrics_module.merge(d['metrics'] for d in dumps))]
+
+        if output_format == 'json':
+            click.echo(json.dumps({name: snap for name, snap in groups}, indent=2))
+            return
+        for name, snap in groups:
+            if output_format == 'prometheus':
+                click.echo(metrics_module.render_prometheus(snap), nl=False)
+                continue
+            click.echo(f"--- {name} ---")
+            click.echo(f"{'METRIC':<28} {'COUNT':>10} {'P50_MS':>10} {'P99_MS':>10} {'MAX_MS':>10}")
+            click.echo("-" * 72)
+            for metric, data in snap.items():
+                if data['type'] == 'counter':
+                    click.echo(f"{metric:<28} {data['value']:>10}")
+                    continue
+                values = (metrics_module.quantile(data, 0.5), metrics_module.quantile(data, 0.99),
+                          data['max'] if data['count'] else None)
+                cells = ['-' if value is None else f"{value * 1000:.3f}" for value in values]
+                click.echo(f"{metric:<28} {data['count']:>10} {cells[0]:>10} {cells[1]:>10} {cells[2]:>10}")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+def _short_frame(label):
+    """Trims a profiler frame label to its last two path components."""
+    path, sep, rest = label.rpartition(':')
+    if not sep:
+        return label
+    return f"{os.sep.join(path.split(os.sep)[-2:])}:{rest}"
+
+@main.group()
+def profile():
+    """
+    Inspect worker profiles (see 'worker start --profile').
+    """
+    pass
+
+@profile.command('report')
+@click.option('--top', default=30, type=click.IntRange(min=1), help='Number of functions to show.')
+@click.option('--thread', default=None,
+              help="Only samples from one thread: 'MainThread' (claims, acks), 'job' (job threads), ...")
+@click.option('--worker', 'worker_id', default=None, help='Only this worker\'s dump.')
+@click.option('--include-idle', is_flag=True,
+              help='Rank samples of threads waiting for work too.')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'folded']), default='table',
+              help='folded: merged stacks for flame graph tools.')
+def profile_report(top, thread, worker_id, include_idle, output_format):
+    """
+    Merge worker profile dumps into a ranked hot-path summary.
+
+    SELF is the share of busy samples where a function was running itself;
+    TOTAL includes the functions it called. Samples of threads waiting for
+    work (idle job threads, the main loop's wakeup wait) are left out
+    unless --include-idle is given.
+    """
+    try:
+        profiles = profiling.load_profiles(worker_id)
+        if not profiles:
+            click.echo(f"No profiles found in {profiling.profiles_dir()}.")
+            return
+        stacks = profiling.merge_stacks(profiles)
+        if output_format == 'folded':
+            for stack, count in sorted(stacks.items()):
+                click.echo(f"{stack} {count}")
+            return
+
+        samples = sum(p['samples'] for p in profiles)
+        click.echo(f"{len(profiles)} profile(s), {samples} samples "
+                   f"every {profiles[0]['interval'] * 1000:g}ms")
+        totals = profiling.thread_totals(stacks)
+        click.echo("Threads: " + ", ".join(
+            f"{name} {count}" for name, count in sorted(totals.items(), key=lambda item: -item[1])))
+        rows, total, idle = profiling.rank_functions(stacks, thread, include_idle)
+        if idle:
+            click.echo(f"Idle: {idle * 100 / (idle + total):.1f}% of thread samples (not ranked)")
+        if not total:
+            click.echo("No busy samples to rank.")
+            return
+        click.echo()
+        click.echo(f"{'SELF%':>6} {'TOTAL%':>7} {'SELF':>8} {'TOTAL':>8}  FUNCTION")
+        click.echo("-" * 100)
+        for label, self_count, cumulative in rows[:top]:
+            click.echo(f"{self_count * 100 / total:>6.1f} {cumulative * 100 / total:>7.1f} "
+                       f"{self_count:>8} {cumulative:>8}  {_short_frame(label)}")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@profile.command('clear')
+def profile_clear():
+    """
+    Delete all profile dumps.
+    """
+    try:
+        removed = profiling.clear_profiles()
+        click.echo(f"Removed {removed} profile(s).")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@main.group()
+def shard():
+    """
+    Inspect or change how the job store is split over SQLite files.
+    """
+    pass
+
+@shard.command('list')
+def shard_list():
+    """
+    Show every shard with its file, size and job count.
+    """
+    try:
+        click.echo(f"{'SHARD':<6} {'JOBS':>10} {'SIZE_MB':>9}  FILE")
+        for info in models.shard_stats():
+            click.echo(f"{info['shard']:<6} {info['jobs']:>10} {info['bytes'] / 1e6:>9.1f}  {info['path']}")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@shard.command('migrate')
+@click.option('--shards', required=True, type=click.IntRange(min=1), help='New number of shards.')
+def shard_migrate(shards):
+    """
+    Reshard the job store, moving jobs to their new files.
+
+    Jobs are placed by a hash of their ID. Stop all workers first; if the
+    migration is interrupted, run it again to finish it.
+    """
+    active_pids = [pid for pid in get_running_pids() if is_process_running(pid)]
+    if active_pids:
+        click.echo(f"Workers are running with PIDs: {active_pids}")
+        click.echo("Please stop them first with 'queuectl worker stop'.")
+        return
+    info = get_broker_info()
+    if info:
+        click.echo(f"The broker is running with PID {info['pid']}.")
+        click.echo("Please stop it first with 'queuectl broker stop'.")
+        return
+    try:
+        before = models.shard_count()
+        moved = models.migrate_shards(
+            shards, progress=lambda count: click.echo(f"  moved {count} job(s)...", err=True)
+        )
+        click.echo(f"Resharded from {before} to {shards} shard(s); moved {moved} job(s).")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@main.group()
+def broker():
+    """
+    Run the local broker that owns the job database.
+    """
+    pass
+
+@broker.command('start')
+@click.option('--foreground', is_flag=True, help='Run in this terminal instead of in the background.')
+def broker_start(foreground):
+    """
+    Start the broker in the background.
+
+    While it runs, workers and CLI commands send their requests to it over
+    ~/.queuectl/broker.sock instead of opening SQLite themselves; running
+    workers switch over within a few seconds. When it stops they go back
+    to using SQLite directly.
+    """
+    info = get_broker_info()
+    if info:
+        click.echo(f"Broker is already running with PID {info['pid']}.")
+        return
+    if foreground:
+        try:
+            broker_module.Broker().run()
+        except Exception as e:
+            click.echo(f"An unexpected error occurred: {e}", err=True)
+        finally:
+            database.close_db_connection()
+        return
+
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'queuectl.broker'],
+            stdin=subprocess.DEVNULL, close_fds=True, start_new_session=True,
+        )
+    except Exception as e:
+        click.echo(f"Error starting broker subprocess: {e}", err=True)
+        return
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and proc.poll() is None:
+        info = get_broker_info()
+        if info:
+            click.echo(f"Started broker (PID {info['pid']}) on {info['path']}.")
+            return
+        time.sleep(0.05)
+    click.echo(f"Error: the broker did not start; see {database.LOG_FILE}.", err=True)
+
+@broker.command('stop')
+def broker_stop():
+    """
+    Stop the broker; clients fall back to SQLite.
+    """
+    info = get_broker_info()
+    if not info:
+        click.echo("No broker running.")
+        return
+    try:
+        os.kill(info['pid'], signal.SIGTERM)
+        click.echo(f"Sent SIGTERM to broker PID {info['pid']}.")
+    except ProcessLookupError:
+        click.echo(f"Warning: Process {info['pid']} not found (may have already stopped).")
+    except Exception as e:
+        click.echo(f"Error stopping broker {info['pid']}: {e}", err=True)
 
+@broker.command('status')
+def broker_status():
+    """
+    Show whether the broker is running and what it is serving.
+    """
+    info = get_broker_info()
+    if not info:
+        click.echo("No broker running.")
+        return
+    uptime = int(time.time() - info['started_at'])
+    click.echo(f"Broker PID {info['pid']} on {info['path']}")
+    click.echo(f"  Uptime:   {uptime}s")
+    click.echo(f"  Clients:  {info['clients']}")
+    click.echo(f"  Requests: {info['requests']}")
+    click.echo(f"  Ready:    {info['ready']} pending job(s) in the index")
+    if info['next_due'] is not None:
+        due = datetime.fromtimestamp(info['next_due'], timezone.utc).isoformat(timespec='seconds')
+        click.echo(f"  Next due: {due}")
 
 @main.group()
 def dlq():
@@ -249,8 +877,7 @@ def dlq_list():
     List all jobs in the DLQ.
     """
     try:
-        jobs = models.list_jobs(state='dead')
-        print_jobs(jobs)
+        print_jobs(client_module.get_backend().iter_jobs(state='dead'))
     except Exception as e:
         click.echo(f"An unexpected error occurred: {e}", err=True)
 
@@ -261,13 +888,128 @@ def dlq_retry(job_id):
     Retry a specific job from the DLQ.
     """
     try:
-        models.retry_dead_job(job_id)
+        client_module.get_backend().retry_dead_job(job_id)
         click.echo(f"Job '{job_id}' moved from DLQ to 'pending' state.")
     except ValueError as e:
         click.echo(f"Error: {e}", err=True)
     except Exception as e:
         click.echo(f"An unexpected error occurred: {e}", err=True)
 
+@main.group()
+def schedule():
+    """
+    Manage recurring (cron) jobs.
+    """
+    pass
+
+@schedule.command('add')
+@click.argument('name')
+@click.argument('cron_expression')
+@click.argument('job_json_string')
+def schedule_add(name, cron_expression, job_json_string):
+    """
+    Create or replace a recurring job.
+
+    CRON_EXPRESSION: 'minute hour day-of-month month day-of-week' in UTC,
+    or @hourly/@daily/@weekly/@monthly/@yearly.
+    JOB_JSON_STRING: the job to create on each run, without "id".
+
+    Example: queuectl schedule add nightly-report '0 2 * * *' '{"command": "./report.sh"}'
+    """
+    try:
+        job_data = json.loads(job_json_string)
+        next_run_at = client_module.get_backend().add_schedule(name, cron_expression, job_data)
+        due = datetime.fromtimestamp(next_run_at, timezone.utc).isoformat()
+        click.echo(f"Schedule '{name}' saved; next run at {due}.")
+    except json.JSONDecodeError:
+        click.echo("Error: Invalid JSON string.", err=True)
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@schedule.command('list')
+def schedule_list():
+    """
+    List recurring jobs and when they run next.
+    """
+    try:
+        schedules = models.list_schedules()
+        if not schedules:
+            click.echo("No schedules found.")
+            return
+        click.echo(f"{'NAME':<20} {'CRON':<18} {'NEXT_RUN':<27} {'JOB'}")
+        click.echo("-" * 87)
+        for s in schedules:
+            if s['next_run_at'] == float('inf'):
+                next_run = 'never (invalid)'
+            else:
+                next_run = datetime.fromtimestamp(s['next_run_at'], timezone.utc).isoformat(timespec='seconds')
+            click.echo(f"{s['name']:<20} {s['cron']:<18} {next_run:<27} {s['job']}")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@schedule.command('remove')
+@click.argument('name')
+def schedule_remove(name):
+    """
+    Delete a recurring job (jobs it already created are kept).
+    """
+    try:
+        client_module.get_backend().remove_schedule(name)
+        click.echo(f"Schedule '{name}' removed.")
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@main.group()
+def tenant():
+    """
+    Manage tenants' fair share of the workers.
+    """
+    pass
+
+@tenant.command('set')
+@click.argument('name')
+@click.option('--weight', default=None, type=float, help='Relative share of workers (default 1).')
+@click.option('--max-concurrency', default=None, type=click.IntRange(min=0),
+              help='Most jobs of this tenant processing at once (0 = no cap).')
+def tenant_set(name, weight, max_concurrency):
+    """
+    Set a tenant's weight and/or concurrency cap.
+
+    Example: queuectl tenant set acme --weight 3 --max-concurrency 10
+    """
+    if weight is None and max_concurrency is None:
+        click.echo("Error: Provide --weight and/or --max-concurrency.", err=True)
+        return
+    try:
+        client_module.get_backend().set_tenant(name, weight=weight, max_concurrency=max_concurrency)
+        click.echo(f"Tenant '{name}' updated.")
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
+@tenant.command('list')
+def tenant_list():
+    """
+    List tenants with their weight, cap and queued/running jobs.
+    """
+    try:
+        tenants = models.list_tenants()
+        if not tenants:
+            click.echo("No tenants found.")
+            return
+        click.echo(f"{'TENANT':<20} {'WEIGHT':>8} {'MAX_CONC':>9} {'WAITING':>9} {'PROCESSING':>11}")
+        click.echo("-" * 61)
+        for t in tenants:
+            cap = t['max_concurrency'] or '-'
+            click.echo(f"{t['name']:<20} {t['weight']:>8g} {cap:>9} {t['pending']:>9} {t['processing']:>11}")
+    except Exception as e:
+        click.echo(f"An unexpected error occurred: {e}", err=True)
+
 @main.group()
 def config():
     """
@@ -288,6 +1030,12 @@ def config_set(key, value):
       queuectl config set max-retries 4   # hyphenated keys accepted
       queuectl config set backoff-base 4  # hyphenated keys accepted
     """
+    if key.strip().lower() == 'shards':
+        click.echo("Error: use 'queuectl shard migrate --shards N' to change the shard count.", err=True)
+        return
+    if key.strip().lower().replace('-', '_') == 'on_parent_dead' and value not in ('cancel', 'hold'):
+        click.echo("Error: on_parent_dead must be 'cancel' or 'hold'.", err=True)
+        return
     try:
         config_module.set_config_value(key, value)
         click.echo(f"Config '{key}' set to '{value}'.")
@@ -0,0 +1,209 @@
+"""Client side of the local broker (see broker.py).
+
+BrokerClient offers the models functions that workers and the CLI use,
+with the same signatures. While a broker is listening they run there;
+otherwise, or once the broker goes away, they run against SQLite directly,
+and the client reconnects when a broker is back. Long maintenance passes
+(gc, recount) always run here, in short transactions of their own, so they
+never hold up the broker's single thread.
+"""
+import json
+import socket
+import sys
+import time
+from . import broker
+from . import models
+
+# Seconds between attempts to reach a broker while running without one.
+RECONNECT_INTERVAL = 5
+# Longest a single request may take.
+REQUEST_TIMEOUT = 300
+# Most jobs sent in one create_jobs request, so a bulk enqueue holds the
+# broker's loop for one short transaction at a time.
+BROKER_CHUNK_SIZE = 200
+# Operations that must not be run twice. If the connection fails after one
+# was sent the broker may already have run it, so it is not redone here.
+NOT_IDEMPOTENT = {
+    'claim_batch', 'create_job', 'enqueue_job', 'create_jobs', 'apply_job_transitions', 'retry_dead_job',
+}
+
+
+class BrokerError(Exception):
+    """An operation failed inside the broker for a reason other than bad input."""
+
+
+def _forward(name):
+    fallback = getattr(models, name)
+
+    def method(self, *args, **kwargs):
+        if self.available():
+            try:
+                return self.call(name, *args, **kwargs)
+            except OSError:
+                pass
+        return fallback(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = fallback.__doc__
+    return method
+
+
+class BrokerClient:
+    """A connection to the broker that falls back to models when it is down."""
+    def __init__(self, path=None):
+        self.path = path or broker.socket_path()
+        self.sock = None
+        self.reader = None
+        self.next_attempt = 0
+        self.busy = False
+
+    def connect(self):
+        """Connects if a broker is listening; returns True on success."""
+        self.next_attempt = time.monotonic() + RECONNECT_INTERVAL
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            return False
+        sock.settimeout(REQUEST_TIMEOUT)
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        return True
+
+    def available(self):
+        """
+        True if a request can be sent now: connected (reconnecting at most
+        every RECONNECT_INTERVAL) and not in the middle of another request,
+        as when a signal handler interrupts one.
+        """
+        if self.sock is None and time.monotonic() >= self.next_attempt and self.connect():
+            print(f"Connected to the broker at {self.path}.", file=sys.stderr)
+        return self.sock is not None and not self.busy
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def call(self, op, *args, **kwargs):
+        """
+        Runs one operation in the broker and returns its result. Raises
+        OSError (after closing the connection) if the broker cannot be
+        reached, and ValueError or BrokerError if the operation failed.
+        A request that times out, or a NOT_IDEMPOTENT one whose connection
+        fails after it was sent, raises BrokerError rather than OSError:
+        the broker may have run it, so it must not be redone here.
+        """
+        self.busy = True
+        sent = False
+        try:
+            self.sock.sendall(json.dumps([op, args, kwargs], separators=(',', ':')).encode() + b'\n')
+            # The broker only runs complete lines, so until here it has not
+            # seen the request.
+            sent = True
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionResetError("broker closed the connection")
+            reply = json.loads(line)
+        except TimeoutError as e:
+            self.close()
+            raise BrokerError(f"No reply from the broker to '{op}' within {REQUEST_TIMEOUT}s.") from e
+        except (OSError, ValueError) as e:
+            self.close()
+            if sent and op in NOT_IDEMPOTENT:
+                raise BrokerError(f"Lost connection to the broker after sending '{op}' ({e}); it may have run.") from e
+            print(f"Lost connection to the broker ({e}); using the database directly.", file=sys.stderr)
+            raise ConnectionError(str(e)) from e
+        finally:
+            self.busy = False
+        if reply[0]:
+            return reply[1]
+        _, error_type, message = reply
+        if error_type == 'ValueError':
+            raise ValueError(message)
+        raise BrokerError(f"{error_type}: {message}")
+
+    def ping(self):
+        """The broker's status (see Broker.op_ping), or None without one."""
+        if self.sock is None and not self.connect():
+            return None
+        try:
+            return self.call('ping')
+        except OSError:
+            return None
+
+    claim_batch = _forward('claim_batch')
+    release_jobs = _forward('release_jobs')
+    apply_job_transitions = _forward('apply_job_transitions')
+    renew_leases = _forward('renew_leases')
+    reap_expired_leases = _forward('reap_expired_leases')
+    next_due = _forward('next_due')
+    create_job = _forward('create_job')
+    enqueue_job = _forward('enqueue_job')
+    get_job = _forward('get_job')
+    retry_dead_job = _forward('retry_dead_job')
+    get_job_summary = _forward('get_job_summary')
+    get_queue_summaries = _forward('get_queue_summaries')
+    count_stale_leases = _forward('count_stale_leases')
+    recount_jobs = staticmethod(models.recount_jobs)
+    gc_finished_jobs = staticmethod(models.gc_finished_jobs)
+    add_schedule = _forward('add_schedule')
+    remove_schedule = _forward('remove_schedule')
+    set_tenant = _forward('set_tenant')
+
+    def create_jobs(self, jobs, chunk_size: int = 1000, on_duplicate: str = 'fail', on_error=None):
+        """
+        models.create_jobs, sending the broker one chunk of at most
+        BROKER_CHUNK_SIZE jobs per request.
+        """
+        stats = {'inserted': 0, 'skipped': 0, 'errors': 0}
+        for chunk in models._chunks(jobs, max(1, min(chunk_size, BROKER_CHUNK_SIZE))):
+            result = None
+            if self.available():
+                try:
+                    result = self.call('create_jobs', chunk, chunk_size, on_duplicate)
+                except OSError:
+                    pass
+            if result is None:
+                chunk_stats = models.create_jobs(chunk, chunk_size, on_duplicate, on_error)
+            else:
+                chunk_stats = result['stats']
+                if on_error:
+                    for job_data, message in result['errors']:
+                        on_error(job_data, message)
+            for key in stats:
+                stats[key] += chunk_stats[key]
+        return stats
+
+    def iter_jobs(self, state: str = None, after: str = None, limit: int = None, page_size: int = 1000,
+                  queue: str = None):
+        """models.iter_jobs, fetching one keyset page per request."""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            batch = page_size if remaining is None else min(page_size, remaining)
+            rows = None
+            if self.available():
+                try:
+                    rows = self.call('list_jobs', state, batch, after, queue)
+                except OSError:
+                    pass
+            if rows is None:
+                yield from models.iter_jobs(state, after=after, limit=remaining, page_size=page_size, queue=queue)
+                return
+            yield from rows
+            if len(rows) < batch:
+                return
+            after = models.make_cursor(rows[-1])
+            if remaining is not None:
+                remaining -= len(rows)
+
+
+def get_backend():
+    """
+    Returns a connected BrokerClient if a broker is running, otherwise the
+    models module itself.
+    """
+    client = BrokerClient()
+    return client if client.connect() else models
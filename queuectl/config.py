@@ -1,10 +1,51 @@
+import os
+import uuid
 from . import database
 
 DEFAULT_CONFIG = {
     'max_retries': 3,
     'backoff_base': 2,
+    'lease_seconds': 60,
+    'output_head_bytes': 65536,
+    'output_tail_bytes': 65536,
+    'callable_max_tasks_per_child': 100,
+    # Seconds a job may run before it is killed and counted as a failed
+    # attempt (0 = no limit).
+    'job_timeout': 3600,
+    # Retention: seconds a finished job is kept (0 = forever).
+    'completed_ttl': 0,
+    'dead_ttl': 0,
+    'gc_batch_size': 500,
+    # Seconds between opportunistic gc passes by each worker (0 = off).
+    'gc_interval': 300,
+    # 1 = move expired jobs to ~/.queuectl/archive/ instead of deleting.
+    'gc_archive': 0,
+    # 1 = every worker runs the sampling profiler (see 'queuectl profile').
+    'profile': 0,
+    'profile_interval_ms': 10,
+    # Seconds between profile dumps (0 = only on SIGUSR1 and at exit).
+    'profile_dump_interval': 60,
+    # Number of job store files; changed only by 'queuectl shard migrate'.
+    'shards': 1,
+    # What happens to the dependents of a job that reaches the DLQ:
+    # 'cancel' them (and their dependents) or 'hold' them blocked until
+    # the job is retried and completes.
+    'on_parent_dead': 'cancel',
 }
 
+# Keys whose values are returned as ints.
+INT_KEYS = {
+    'max_retries', 'backoff_base', 'lease_seconds',
+    'output_head_bytes', 'output_tail_bytes', 'callable_max_tasks_per_child',
+    'job_timeout', 'completed_ttl', 'dead_ttl', 'gc_batch_size', 'gc_interval', 'gc_archive',
+    'profile', 'profile_interval_ms', 'profile_dump_interval', 'shards',
+}
+
+# Per-process cache of the config table: (stamp, {normalized_key: raw value}).
+# set_config_value rewrites a small stamp file next to the database, so a
+# cached copy is revalidated with a single stat() instead of a query.
+_cache = None
+
 def _normalize_key(key: str) -> str:
     """Normalize config keys to a canonical form used in the DB.
     - lowercases
@@ -15,53 +56,101 @@ def _normalize_key(key: str) -> str:
         return key
     return key.strip().lower().replace('-', '_')
 
-def get_config_value(key: str):
+def _stamp_path():
+    return os.path.join(database.APP_DIR, 'config.stamp')
+
+def _config_stamp():
+    """Identifies the current config generation without touching the DB."""
+    try:
+        st = os.stat(_stamp_path())
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _bump_stamp():
+    """Marks the config as changed for every process that cached it."""
+    path = _stamp_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(database.APP_DIR, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        # A fresh inode per write, so the change is seen even on file
+        # systems with coarse mtimes.
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error updating config stamp: {e}")
+
+def _load_config() -> dict:
     """
-    Fetches a configuration value from the database.
-    Returns the default value if not found.
+    Reads the whole config table in one query, keyed by normalized key.
+    Legacy hyphenated keys are migrated to the underscore form on the way,
+    unless the caller is in the middle of a transaction.
     """
     conn = database.get_db_connection()
     cursor = conn.cursor()
+    cursor.execute("SELECT key, value FROM config")
+    values = {}
+    legacy = {}
+    for row in cursor.fetchall():
+        norm_key = _normalize_key(row['key'])
+        if row['key'] == norm_key:
+            values[norm_key] = row['value']
+        else:
+            legacy[row['key']] = (norm_key, row['value'])
+
+    for old_key, (norm_key, value) in legacy.items():
+        values.setdefault(norm_key, value)
+
+    if legacy and not conn.in_transaction:
+        try:
+            for old_key, (norm_key, _) in legacy.items():
+                cursor.execute(
+                    "INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
+                    (norm_key, values[norm_key])
+                )
+                cursor.execute("DELETE FROM config WHERE key = ?", (old_key,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+    return values
+
+def _cached_config() -> dict:
+    """
+    Returns the cached config values, reloading them if the stamp moved
+    (or the process switched to another database).
+    """
+    global _cache
+    stamp = (database.DB_PATH, _config_stamp())
+    if _cache is None or _cache[0] != stamp:
+        _cache = (stamp, _load_config())
+    return _cache[1]
+
+def get_config_value(key: str):
+    """
+    Fetches a configuration value, served from the per-process cache.
+    Returns the default value if not found.
+    """
     norm_key = _normalize_key(key)
-    alt_key = None
-    if norm_key and '_' in norm_key:
-        alt_key = norm_key.replace('_', '-')
-    
     try:
-        cursor.execute("SELECT value FROM config WHERE key = ?", (norm_key,))
-        row = cursor.fetchone()
-        if not row and alt_key:
-            cursor.execute("SELECT value FROM config WHERE key = ?", (alt_key,))
-            legacy_row = cursor.fetchone()
-            if legacy_row:
-                try:
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
-                        (norm_key, legacy_row['value'])
-                    )
-                    cursor.execute("DELETE FROM config WHERE key = ?", (alt_key,))
-                    conn.commit()
-                except Exception:
-                    conn.rollback()
-                row = legacy_row
-        
-        if row:
-            if norm_key in ['max_retries', 'backoff_base']:
-                return int(row['value'])
-            return row['value']
+        values = _cached_config()
+        if norm_key in values:
+            if norm_key in INT_KEYS:
+                return int(values[norm_key])
+            return values[norm_key]
         else:
             return DEFAULT_CONFIG.get(norm_key)
             
     except Exception as e:
         print(f"Error fetching config '{key}': {e}")
         return DEFAULT_CONFIG.get(norm_key)
-    finally:
-        conn.close()
 
 def set_config_value(key: str, value: str):
     """
-    Sets a configuration value in the database.
+    Sets a configuration value in the database and invalidates every
+    process's cached copy.
     """
+    global _cache
     conn = database.get_db_connection()
     cursor = conn.cursor()
     norm_key = _normalize_key(key)
@@ -76,27 +165,21 @@ def set_config_value(key: str, value: str):
         print(f"Error setting config '{key}': {e}")
         conn.rollback()
     finally:
-        conn.close()
+        _cache = None
+        _bump_stamp()
 
 def list_config() -> dict:
     """
     Returns a dictionary of effective configuration values, merging DB values
     (normalized) with defaults. Numeric config values are returned as ints.
     """
-    conn = database.get_db_connection()
-    cursor = conn.cursor()
     keys = set(DEFAULT_CONFIG.keys())
     try:
-        cursor.execute("SELECT key FROM config")
-        rows = cursor.fetchall()
-        for row in rows:
-            keys.add(_normalize_key(row['key']))
+        keys.update(_cached_config().keys())
     except Exception:
         pass
-    finally:
-        conn.close()
 
     result = {}
     for k in sorted(keys):
         result[k] = get_config_value(k)
-    return result
\ No newline at end of file
+    return result
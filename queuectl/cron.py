@@ -0,0 +1,101 @@
+"""Minimal cron expression support for recurring schedules.
+
+Accepts the classic five fields (minute hour day-of-month month
+day-of-week) with '*', lists ('1,15'), ranges ('1-5'), steps ('*/10',
+'0-30/5') and the aliases @yearly, @monthly, @weekly, @daily and @hourly.
+Day-of-week is 0-6 with 0 (or 7) = Sunday. As in Vixie cron, when both
+day fields are restricted a day matches if either one does. All times are
+UTC.
+"""
+from datetime import datetime, timedelta, timezone
+
+ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# (name, lowest, highest) for each field, in order.
+FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+)
+
+# Far enough ahead to find any valid date (e.g. Feb 29 in a leap year).
+_MAX_DAYS_AHEAD = 8 * 366
+
+
+def _parse_field(text, name, low, high):
+    """Returns the set of values one field matches."""
+    values = set()
+    for part in text.split(','):
+        spec, _, step = part.partition('/')
+        try:
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, _, end = spec.partition('-')
+                start, end = int(start), int(end)
+            else:
+                start = end = int(spec)
+            step = int(step) if step else 1
+        except ValueError:
+            raise ValueError(f"Invalid {name} field '{text}'") from None
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"Invalid {name} field '{text}' (allowed {low}-{high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """A parsed cron expression; use next_after() to find run times."""
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(
+                f"Invalid cron expression '{expression}': expected 5 fields "
+                "(minute hour day-of-month month day-of-week)"
+            )
+        parsed = [_parse_field(text, *spec) for text, spec in zip(fields, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # cron counts Sunday as 0 (or 7); Python's weekday() has Monday = 0.
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = day.weekday() in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return in_month or in_week
+        return in_month and in_week
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Returns the first matching minute strictly after 'moment' (UTC)."""
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        start = moment.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(_MAX_DAYS_AHEAD):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+    def next_timestamp(self, after: float) -> float:
+        """next_after() for epoch seconds."""
+        return self.next_after(datetime.fromtimestamp(after, timezone.utc)).timestamp()
@@ -1,28 +1,250 @@
 import sqlite3
 import os
-APP_DIR = os.path.join(os.path.expanduser('~'), '.queuectl')
+import math
+import threading
+# QUEUECTL_HOME relocates everything (e.g. for 'queuectl bench' or tests).
+APP_DIR = os.environ.get('QUEUECTL_HOME') or os.path.join(os.path.expanduser('~'), '.queuectl')
 DB_PATH = os.path.join(APP_DIR, 'queue.db')
 PID_FILE = os.path.join(APP_DIR, 'queuectl.pid')
 LOG_FILE = os.path.join(APP_DIR, 'worker.log')
+OUTPUT_DIR = os.path.join(APP_DIR, 'output')
+ARCHIVE_DIR = os.path.join(APP_DIR, 'archive')
 
+# How long a connection waits on a locked database before giving up.
+BUSY_TIMEOUT_MS = 5000
+# Size of each connection's prepared statement cache.
+STATEMENT_CACHE_SIZE = 256
 
-def get_db_connection():
+_local = threading.local()
+
+
+def set_app_dir(path):
+    """
+    Points this process at another queuectl directory, as if it had been
+    started with QUEUECTL_HOME=path, and drops the thread's connection to
+    the old database.
+    """
+    global APP_DIR, DB_PATH, PID_FILE, LOG_FILE, OUTPUT_DIR, ARCHIVE_DIR
+    close_db_connection()
+    APP_DIR = path
+    DB_PATH = os.path.join(APP_DIR, 'queue.db')
+    PID_FILE = os.path.join(APP_DIR, 'queuectl.pid')
+    LOG_FILE = os.path.join(APP_DIR, 'worker.log')
+    OUTPUT_DIR = os.path.join(APP_DIR, 'output')
+    ARCHIVE_DIR = os.path.join(APP_DIR, 'archive')
+
+def _open_connection(path):
     """
-    Creates the app directory if it doesn't exist and returns
-    a connection to the SQLite database.
+    Opens a new connection and applies the per-connection tuning:
+    WAL journaling (readers no longer block the writer), NORMAL sync
+    (fsync at checkpoints rather than on every commit) and a busy timeout
+    so short lock waits are retried inside SQLite instead of failing.
     """
     os.makedirs(APP_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    conn.create_function("POW", 2, math.pow, deterministic=True)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
     return conn
 
-def init_db():
+def shard_path(shard=0):
     """
-    Initializes the database schema and inserts default configuration.
+    Returns the file of one shard of the job store: shard 0 is queue.db
+    (which also holds config, tenants and schedules), shard N is
+    queue-N.db next to it.
+    """
+    if not shard:
+        return DB_PATH
+    return os.path.join(APP_DIR, f"queue-{shard}.db")
+
+def get_db_connection(shard=0):
+    """
+    Returns the calling thread's long-lived connection to the SQLite
+    database (or to one shard of it), opening it on first use.
+
+    The connection is reused for every call in the same process and thread,
+    so callers must finish their transaction (commit or rollback) and must
+    not close it. Use close_db_connection() on shutdown.
+    """
+    key = (os.getpid(), APP_DIR)
+    conns = getattr(_local, 'conns', None)
+    if conns is None or _local.key != key:
+        close_db_connection()
+        conns = _local.conns = {}
+        _local.key = key
+    conn = conns.get(shard)
+    if conn is None:
+        conn = conns[shard] = _open_connection(shard_path(shard))
+    return conn
+
+def close_db_connection():
+    """Closes the calling thread's cached connections, if any."""
+    conns = getattr(_local, 'conns', None)
+    if conns:
+        _local.conns = None
+        if _local.key[0] == os.getpid():
+            for conn in conns.values():
+                conn.close()
+
+def _column_names(cursor, table):
+    """Returns the set of column names currently defined on a table."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row['name'] for row in cursor.fetchall()}
+
+def _index_columns(cursor, index):
+    """Returns the column names of an index (empty if it does not exist)."""
+    cursor.execute(f"PRAGMA index_info({index})")
+    return [row['name'] for row in cursor.fetchall()]
+
+def _migrate_jobs_table(cursor):
+    """
+    Brings a 'jobs' table created by an older version up to date.
+    Safe to run repeatedly.
+    """
+    columns = _column_names(cursor, 'jobs')
+    if 'next_run_at' not in columns:
+        # Backfill the due time from the old timestamp-based backoff rule so
+        # failed jobs keep their retry schedule across the upgrade.
+        cursor.execute("ALTER TABLE jobs ADD COLUMN next_run_at REAL NOT NULL DEFAULT 0")
+        cursor.execute("SELECT value FROM config WHERE key = 'backoff_base'")
+        row = cursor.fetchone()
+        backoff_base = int(row['value']) if row else 2
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET next_run_at = CASE
+                WHEN state = 'failed'
+                    THEN (julianday(updated_at) - 2440587.5) * 86400.0 + POW(?, attempts)
+                ELSE (julianday(created_at) - 2440587.5) * 86400.0
+            END
+            """,
+            (backoff_base,)
+        )
+    if 'lease_expires_at' not in columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+        # Jobs already 'processing' have no heartbeat; give them the
+        # executor's one hour timeout before they are considered stuck.
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET lease_expires_at = (julianday(updated_at) - 2440587.5) * 86400.0 + 3600
+            WHERE state = 'processing'
+            """
+        )
+    if 'argv' not in columns:
+        # JSON-encoded argv list / env object for direct-exec jobs.
+        cursor.execute("ALTER TABLE jobs ADD COLUMN argv TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN env TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN cwd TEXT")
+    if 'stdout_path' not in columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN stdout_path TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN stderr_path TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN stdout_bytes INTEGER")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN stderr_bytes INTEGER")
+    if 'callable' not in columns:
+        # 'pkg.mod:func' plus JSON args/kwargs for in-process Python jobs.
+        cursor.execute("ALTER TABLE jobs ADD COLUMN callable TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN args TEXT")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN kwargs TEXT")
+    if 'queue' not in columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN queue TEXT NOT NULL DEFAULT 'default'")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+    if 'tenant' not in columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'")
+    if 'pending_deps' not in columns:
+        # Parents a 'blocked' job is still waiting for (see job_deps).
+        cursor.execute("ALTER TABLE jobs ADD COLUMN pending_deps INTEGER NOT NULL DEFAULT 0")
+
+def _create_job_count_triggers(cursor):
+    """
+    Keeps job_counts in step with 'jobs' inside the same transaction as
+    every insert, delete and state, queue or tenant change.
+    """
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_jobs_count_insert AFTER INSERT ON jobs
+    BEGIN
+        INSERT INTO job_counts (state, queue, tenant, count)
+        VALUES (NEW.state, NEW.queue, NEW.tenant, 1)
+        ON CONFLICT (state, queue, tenant) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_jobs_count_delete AFTER DELETE ON jobs
+    BEGIN
+        UPDATE job_counts SET count = count - 1
+        WHERE state = OLD.state AND queue = OLD.queue AND tenant = OLD.tenant;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_jobs_count_update AFTER UPDATE OF state, queue, tenant ON jobs
+    WHEN OLD.state IS NOT NEW.state OR OLD.queue IS NOT NEW.queue OR OLD.tenant IS NOT NEW.tenant
+    BEGIN
+        UPDATE job_counts SET count = count - 1
+        WHERE state = OLD.state AND queue = OLD.queue AND tenant = OLD.tenant;
+        INSERT INTO job_counts (state, queue, tenant, count)
+        VALUES (NEW.state, NEW.queue, NEW.tenant, 1)
+        ON CONFLICT (state, queue, tenant) DO UPDATE SET count = count + 1;
+    END
+    ''')
+
+def _create_job_counts_table(cursor):
+    """
+    Creates job_counts (one row per state, queue and tenant), replacing the
+    coarser tables of older versions, and fills it if it is new.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_counts'")
+    had_job_counts = cursor.fetchone() is not None
+    if had_job_counts and 'tenant' not in _column_names(cursor, 'job_counts'):
+        for trigger in ('trg_jobs_count_insert', 'trg_jobs_count_delete', 'trg_jobs_count_update'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute("DROP TABLE job_counts")
+        had_job_counts = False
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS job_counts (
+        state TEXT NOT NULL,
+        queue TEXT NOT NULL,
+        tenant TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (state, queue, tenant)
+    )
+    ''')
+    if not had_job_counts:
+        rebuild_job_counts(cursor)
+    _create_job_count_triggers(cursor)
+
+def rebuild_job_counts(cursor):
+    """Recomputes job_counts from a full scan of 'jobs'."""
+    cursor.execute("DELETE FROM job_counts")
+    cursor.execute(
+        """
+        INSERT INTO job_counts (state, queue, tenant, count)
+        SELECT state, queue, tenant, COUNT(*) FROM jobs GROUP BY state, queue, tenant
+        """
+    )
+
+def _create_schema(conn):
+    """
+    Creates (or migrates) the tables and indexes of one database file.
+    Every shard gets the full schema; config and schedules are only used
+    in shard 0. Returns True if the file still needs a VACUUM to switch
+    to incremental auto-vacuum.
     """
-    os.makedirs(APP_DIR, exist_ok=True)
-    conn = get_db_connection()
     cursor = conn.cursor()
+    # Lets 'queuectl gc' hand freed pages back to the file system. The
+    # setting is only applied by a VACUUM once the file exists (switching to
+    # WAL already creates it), which is instant on a new database and a
+    # one-time rewrite for older ones.
+    cursor.execute("PRAGMA auto_vacuum")
+    needs_vacuum = cursor.fetchone()[0] != 2
+    if needs_vacuum:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS jobs (
         id TEXT PRIMARY KEY,
@@ -31,7 +253,24 @@ def init_db():
         attempts INTEGER NOT NULL DEFAULT 0,
         max_retries INTEGER NOT NULL DEFAULT 3,
         created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL
+        updated_at TEXT NOT NULL,
+        next_run_at REAL NOT NULL DEFAULT 0,
+        worker_id TEXT,
+        lease_expires_at REAL,
+        argv TEXT,
+        env TEXT,
+        cwd TEXT,
+        stdout_path TEXT,
+        stderr_path TEXT,
+        stdout_bytes INTEGER,
+        stderr_bytes INTEGER,
+        callable TEXT,
+        args TEXT,
+        kwargs TEXT,
+        queue TEXT NOT NULL DEFAULT 'default',
+        priority INTEGER NOT NULL DEFAULT 0,
+        tenant TEXT NOT NULL DEFAULT 'default',
+        pending_deps INTEGER NOT NULL DEFAULT 0
     )
     ''')
     cursor.execute('''
@@ -40,9 +279,134 @@ def init_db():
         value TEXT NOT NULL
     )
     ''')
+    _migrate_jobs_table(cursor)
+    # Fair-share state per tenant: weight, optional concurrency cap and the
+    # stride scheduler's pass value.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tenants (
+        name TEXT PRIMARY KEY,
+        weight REAL NOT NULL DEFAULT 1,
+        max_concurrency INTEGER NOT NULL DEFAULT 0,
+        pass REAL NOT NULL DEFAULT 0
+    )
+    ''')
+    _create_job_counts_table(cursor)
+    # Serves the claim query: one probe of 'pending' per (queue, tenant),
+    # already in claim order (highest priority first, then due time, then age).
+    claim_columns = _index_columns(cursor, 'idx_jobs_claim')
+    if claim_columns and 'tenant' not in claim_columns:
+        cursor.execute("DROP INDEX idx_jobs_claim")
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_claim
+    ON jobs (state, queue, tenant, priority DESC, next_run_at, created_at)
+    ''')
+    # Due-time index: promotes 'scheduled' jobs and backed-off 'failed' jobs
+    # to 'pending' once they are due and finds the earliest retry or
+    # scheduled job for idle workers' wakeup timer, all as range lookups
+    # however many jobs are dated in the future.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_ready
+    ON jobs (state, next_run_at, created_at)
+    ''')
+    # Recurring job definitions: a cron expression, the job template
+    # (JSON, without 'id') and when it fires next.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schedules (
+        name TEXT PRIMARY KEY,
+        cron TEXT NOT NULL,
+        job TEXT NOT NULL,
+        next_run_at REAL NOT NULL,
+        last_run_at REAL,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_schedules_due
+    ON schedules (next_run_at)
+    ''')
+    # Keyset pagination for 'queuectl list', with and without --state.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_state_created
+    ON jobs (state, created_at, id)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_created
+    ON jobs (created_at, id)
+    ''')
+    # Keyset pagination for 'queuectl list --queue'.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_queue_created
+    ON jobs (queue, created_at, id)
+    ''')
+    # Finds finished jobs past their retention TTL for 'queuectl gc'.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_finished
+    ON jobs (state, updated_at)
+    ''')
+    # Serves the lease reaper and the stale lease count.
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_jobs_lease
+    ON jobs (state, lease_expires_at)
+    ''')
+    # Dependency edges of job DAGs, one per parent that has not completed
+    # yet, kept in the parent's shard so its ack finds the children with
+    # one primary key range scan.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS job_deps (
+        parent_id TEXT NOT NULL,
+        child_id TEXT NOT NULL,
+        PRIMARY KEY (parent_id, child_id)
+    )
+    ''')
+    return needs_vacuum
+
+def init_shard(shard):
+    """Creates or migrates the schema of one shard file."""
+    conn = get_db_connection(shard)
+    needs_vacuum = _create_schema(conn)
+    conn.commit()
+    if needs_vacuum:
+        conn.execute("VACUUM")
+
+def read_shard_count(conn=None):
+    """Returns the number of shards recorded in shard 0's config (default 1)."""
+    conn = conn or get_db_connection()
+    row = conn.execute("SELECT value FROM config WHERE key = 'shards'").fetchone()
+    return max(1, int(row['value'])) if row else 1
+
+def _store_has_jobs(count):
+    """True if any existing shard file of the store holds a job."""
+    for shard in range(count):
+        if shard and not os.path.exists(shard_path(shard)):
+            continue
+        if get_db_connection(shard).execute("SELECT 1 FROM jobs LIMIT 1").fetchone():
+            return True
+    return False
+
+def init_db(shards=None):
+    """
+    Initializes the database schema and inserts default configuration.
+    With 'shards', a new (or still empty) store is split over that many
+    files; an existing store with jobs is resharded with
+    'queuectl shard migrate' instead.
+    """
+    os.makedirs(APP_DIR, exist_ok=True)
+    conn = get_db_connection()
+    needs_vacuum = _create_schema(conn)
+    cursor = conn.cursor()
     default_config = [
         ('max_retries', '3'),
-        ('backoff_base', '2')
+        ('backoff_base', '2'),
+        ('lease_seconds', '60'),
+        ('output_head_bytes', '65536'),
+        ('output_tail_bytes', '65536'),
+        ('callable_max_tasks_per_child', '100'),
+        ('job_timeout', '3600'),
+        ('completed_ttl', '0'),
+        ('dead_ttl', '0'),
+        ('gc_batch_size', '500'),
+        ('gc_interval', '300'),
+        ('gc_archive', '0')
     ]
     cursor.executemany(
         "INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
@@ -50,5 +414,23 @@ def init_db():
     )
 
     conn.commit()
-    conn.close()
-    print(f"Database and config initialized at: {APP_DIR}")
\ No newline at end of file
+    if needs_vacuum:
+        conn.execute("VACUUM")
+
+    count = read_shard_count(conn)
+    if shards is not None and shards != count:
+        if shards < 1:
+            raise ValueError("'shards' must be at least 1.")
+        if _store_has_jobs(count):
+            raise ValueError(
+                f"The store already holds jobs in {count} shard(s); "
+                f"use 'queuectl shard migrate --shards {shards}' to reshard it."
+            )
+        # Imported here: config itself depends on this module.
+        from . import config
+        config.set_config_value('shards', shards)
+        count = shards
+    for shard in range(1, count):
+        init_shard(shard)
+    shard_note = f" ({count} shards)" if count > 1 else ""
+    print(f"Database and config initialized at: {APP_DIR}{shard_note}")
\ No newline at end of file
@@ -1,30 +1,424 @@
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import signal
 import subprocess
+import threading
+import time
+import traceback
+import weakref
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote
+from . import metrics
 
-def execute_job_command(command: str):
+# Read size when draining a job's stdout/stderr pipes.
+_CHUNK_SIZE = 64 * 1024
+
+_job_spawn = metrics.histogram(
+    'job_spawn_seconds', 'Time to start a job process (fork/exec or posix_spawn).')
+_job_run = metrics.histogram(
+    'job_run_seconds', 'Time from starting a command/argv job to its exit and output drained.')
+_callable_run = metrics.histogram(
+    'callable_run_seconds', "Time to run a 'callable' job in the process pool.")
+
+
+def output_directory(output_root, job_id):
+    """Returns <output_root>/<quoted job_id>, the job's output directory."""
+    name = quote(job_id, safe='')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return os.path.join(output_root, name)
+
+
+class _HeadTailWriter(io.RawIOBase):
     """
-    Executes a shell command and returns its exit code.
-    
-    Returns 0 for success, non-zero for failure.
+    A binary sink that writes the first 'head_bytes' to 'out' as they
+    arrive and holds only the last 'tail_bytes' after that. finish()
+    writes the marker for anything dropped in between plus the tail, and
+    returns the total number of bytes written to the sink.
+    """
+    def __init__(self, out, head_bytes, tail_bytes):
+        self.out = out
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total = 0
+        self.tail = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        size = len(data)
+        chunk = memoryview(data)
+        if self.total < self.head_bytes:
+            head_part = chunk[:self.head_bytes - self.total]
+            self.out.write(head_part)
+            chunk = chunk[len(head_part):]
+            self.total += len(head_part)
+        if chunk:
+            self.total += len(chunk)
+            if self.tail_bytes:
+                self.tail += chunk
+                if len(self.tail) > self.tail_bytes:
+                    del self.tail[:len(self.tail) - self.tail_bytes]
+        return size
+
+    def finish(self):
+        omitted = self.total - self.head_bytes - len(self.tail)
+        if omitted > 0:
+            self.out.write(f"\n... [{omitted} bytes omitted] ...\n".encode())
+        self.out.write(self.tail)
+        self.tail = bytearray()
+        return self.total
+
+
+class OutputCapture:
+    """
+    Where a job's stdout and stderr are written, and how much of each to
+    keep: the first 'head_bytes' and the last 'tail_bytes'. Anything in
+    between is dropped and replaced by a marker line, so the worker never
+    holds more than 'tail_bytes' per stream in memory.
+
+    After the job has run, stdout_bytes/stderr_bytes hold the total number
+    of bytes the job wrote to each stream (before truncation).
+    """
+    def __init__(self, directory, head_bytes, tail_bytes):
+        self.directory = directory
+        self.head_bytes = max(0, head_bytes)
+        self.tail_bytes = max(0, tail_bytes)
+        self.stdout_path = os.path.join(directory, 'stdout')
+        self.stderr_path = os.path.join(directory, 'stderr')
+        self.stdout_bytes = 0
+        self.stderr_bytes = 0
+
+    @classmethod
+    def for_job(cls, output_root, job_id, head_bytes, tail_bytes):
+        """Builds the capture for <output_root>/<quoted job_id>/."""
+        return cls(output_directory(output_root, job_id), head_bytes, tail_bytes)
+
+    def as_dict(self):
+        return {
+            'stdout_path': self.stdout_path,
+            'stderr_path': self.stderr_path,
+            'stdout_bytes': self.stdout_bytes,
+            'stderr_bytes': self.stderr_bytes,
+        }
+
+    def _drain(self, pipe, path, attr):
+        """Copies a pipe to 'path', keeping only the head and tail."""
+        with open(path, 'wb') as out:
+            sink = _HeadTailWriter(out, self.head_bytes, self.tail_bytes)
+            while True:
+                chunk = pipe.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sink.write(chunk)
+            total = sink.finish()
+        pipe.close()
+        setattr(self, attr, total)
+
+    def run(self, popen_args, popen_kwargs, timeout):
+        """
+        Starts the process with both streams piped into the capture files
+        and waits for it. Returns the exit code.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        proc = _spawn(popen_args, popen_kwargs, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        readers = [
+            threading.Thread(target=self._drain, args=(proc.stdout, self.stdout_path, 'stdout_bytes')),
+            threading.Thread(target=self._drain, args=(proc.stderr, self.stderr_path, 'stderr_bytes')),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            return proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            for reader in readers:
+                reader.join()
+
+
+def _resolve_callable(target: str):
+    """Imports 'package.module:attr.path' and returns the object."""
+    module_name, _, attr_path = target.partition(':')
+    obj = importlib.import_module(module_name)
+    for attr in attr_path.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+def _call_in_child(target, args, kwargs, stdout_path, stderr_path, head_bytes, tail_bytes):
+    """
+    Runs inside a pool process: calls the job's function with its prints
+    going to the capture files through the same head/tail cap as command
+    output. Returns (stdout_bytes, stderr_bytes, error), where error
+    describes the exception the function raised, or is None.
+    """
+    with open(stdout_path, 'wb') as out_file, open(stderr_path, 'wb') as err_file:
+        sinks = [_HeadTailWriter(f, head_bytes, tail_bytes) for f in (out_file, err_file)]
+        out, err = (io.TextIOWrapper(sink, encoding='utf-8', errors='backslashreplace', write_through=True)
+                    for sink in sinks)
+        error = None
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                _resolve_callable(target)(*args, **kwargs)
+            except BaseException as e:
+                traceback.print_exc()
+                error = f"{type(e).__name__}: {e}"
+        out.flush()
+        err.flush()
+        return sinks[0].finish(), sinks[1].finish(), error
+
+
+def _report_pid(pids):
+    """
+    Pool initializer: puts (pid, True) on 'pids' when a child starts and
+    (pid, False) when it exits after 'max_tasks_per_child' jobs, so the
+    worker knows which processes to kill without reading pool internals.
+    """
+    pid = os.getpid()
+    pids.put((pid, True))
+    multiprocessing.util.Finalize(None, pids.put, args=((pid, False),), exitpriority=0)
+
+
+class CallableRunner:
+    """
+    A warm pool of Python processes for 'callable' jobs. Children keep
+    their imported modules between jobs and are replaced after
+    'max_tasks_per_child' jobs (None = never) to bound leaks. If a child
+    dies abruptly, the jobs running in the pool at that moment fail (and
+    are retried as usual) and the pool is rebuilt for the next job.
+
+    A job that times out has no way to be stopped inside a shared pool,
+    so every child of that pool is killed. Only the timed-out job fails;
+    the others caught in the kill are run again in the new pool.
     """
+    def __init__(self, max_workers, max_tasks_per_child=None):
+        self.max_workers = max(1, max_workers)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._pool = None
+        self._lock = threading.Lock()
+        # Per pool: the queue its children report to and their live pids.
+        self._pids = {}
+        # Pools killed on purpose after a timeout.
+        self._killed = weakref.WeakSet()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Recycling children needs a non-fork start method; forkserver
+                # also avoids forking this multi-threaded worker.
+                context = multiprocessing.get_context('forkserver')
+                pids = context.SimpleQueue()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_report_pid,
+                    initargs=(pids,),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+                self._pids[self._pool] = (pids, set())
+            return self._pool
+
+    def _live_pids(self, pool):
+        """Applies the start/exit reports queued by a pool's children."""
+        pids, live = self._pids[pool]
+        while not pids.empty():
+            pid, alive = pids.get()
+            if alive:
+                live.add(pid)
+            else:
+                live.discard(pid)
+        return live
+
+    def _discard_pool(self, pool, kill=False):
+        """
+        Stops using a pool. With kill, its children are killed first, which
+        fails every job still in it with BrokenProcessPool.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            if kill and pool in self._pids:
+                self._killed.add(pool)
+                # ProcessPoolExecutor offers no way to stop a running call.
+                for pid in self._live_pids(pool):
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+            self._pids.pop(pool, None)
+        pool.shutdown(wait=False)
+
+    def run(self, job: dict, capture, timeout=None):
+        """
+        Runs a callable job to completion and returns its exit code. After
+        'timeout' seconds (None = no limit) the job's pool is killed.
+        """
+        target = job['callable']
+        args = json.loads(job.get('args') or '[]')
+        kwargs = json.loads(job.get('kwargs') or '{}')
+        if capture is None:
+            stdout_path = stderr_path = os.devnull
+            head_bytes = tail_bytes = 0
+        else:
+            os.makedirs(capture.directory, exist_ok=True)
+            stdout_path, stderr_path = capture.stdout_path, capture.stderr_path
+            head_bytes, tail_bytes = capture.head_bytes, capture.tail_bytes
+
+        started = time.perf_counter()
+        while True:
+            pool = self._get_pool()
+            try:
+                future = pool.submit(_call_in_child, target, args, kwargs,
+                                     stdout_path, stderr_path, head_bytes, tail_bytes)
+                stdout_bytes, stderr_bytes, error = future.result(timeout=timeout)
+                if capture is not None:
+                    capture.stdout_bytes, capture.stderr_bytes = stdout_bytes, stderr_bytes
+                if error is None:
+                    returncode = 0
+                else:
+                    print(f"Callable '{target}' raised {error}")
+                    returncode = 1
+            except FutureTimeoutError:
+                print(f"Callable '{target}' timed out; killing its pool.")
+                self._discard_pool(pool, kill=True)
+                returncode = -1
+            except BrokenProcessPool as e:
+                if pool in self._killed:
+                    print(f"Callable '{target}' was interrupted by another job's timeout; running it again.")
+                    continue
+                print(f"Callable '{target}' crashed its pool process: {e}")
+                self._discard_pool(pool)
+                returncode = -1
+            except Exception as e:
+                print(f"Callable '{target}' raised {type(e).__name__}: {e}")
+                returncode = 1
+            break
+        _callable_run.observe(time.perf_counter() - started)
+
+        if capture is not None and returncode < 0:
+            # The child was killed before finish(); only its head made it out.
+            for path, attr in ((capture.stdout_path, 'stdout_bytes'), (capture.stderr_path, 'stderr_bytes')):
+                try:
+                    setattr(capture, attr, os.path.getsize(path))
+                except OSError:
+                    pass
+        return returncode
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+            self._pids.pop(pool, None)
+
+
+def _spawn(popen_args, popen_kwargs, **stdio):
+    """Starts a process, recording how long that took in job_spawn_seconds."""
+    started = time.perf_counter()
+    proc = subprocess.Popen(popen_args, **stdio, **popen_kwargs)
+    _job_spawn.observe(time.perf_counter() - started)
+    return proc
+
+def _run(popen_args, popen_kwargs, capture, description, timeout=None):
+    """
+    Runs a process to completion, streaming its output into 'capture'
+    (or discarding it when capture is None). Returns the exit code, or -1
+    if it ran longer than 'timeout' seconds or could not be started.
+    """
+    started = time.perf_counter()
     try:
-        result = subprocess.run(
-            command, 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            timeout=3600
-        )
-        
-        if result.returncode != 0:
-            print(f"Command failed with exit code {result.returncode}")
-            print(f"STDOUT: {result.stdout}")
-            print(f"STDERR: {result.stderr}")
-            
-        return result.returncode
-        
+        if capture is None:
+            proc = _spawn(popen_args, popen_kwargs, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                returncode = proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                raise
+        else:
+            returncode = capture.run(popen_args, popen_kwargs, timeout=timeout)
+
+        if returncode != 0:
+            print(f"Command failed with exit code {returncode}")
+            if capture is not None:
+                print(f"STDOUT: {capture.stdout_path} ({capture.stdout_bytes} bytes)")
+                print(f"STDERR: {capture.stderr_path} ({capture.stderr_bytes} bytes)")
+
+        return returncode
+
     except subprocess.TimeoutExpired:
-        print(f"Command '{command}' timed out.")
+        print(f"Command {description} timed out.")
         return -1
     except Exception as e:
-        print(f"Error executing command '{command}': {e}")
-        return -1
\ No newline at end of file
+        print(f"Error executing command {description}: {e}")
+        return -1
+    finally:
+        _job_run.observe(time.perf_counter() - started)
+
+def execute_job(job: dict, capture: OutputCapture = None, runner: CallableRunner = None, timeout=None):
+    """
+    Runs a claimed job and returns (exit_code, capture). A job still
+    running after 'timeout' seconds (None = no limit) is killed and fails.
+
+    'callable' jobs run in the warm process pool of 'runner'; any exception
+    they raise is a failure. Jobs with an 'argv' list are executed directly,
+    without a shell; all others run their 'command' string through /bin/sh.
+    Both honour the job's optional 'env' (merged over the worker's
+    environment) and 'cwd'.
+    """
+    if job.get('callable'):
+        if runner is None:
+            print(f"No callable runner available for job {job['id']}.")
+            return -1, capture
+        return runner.run(job, capture, timeout), capture
+
+    env = None
+    if job.get('env'):
+        env = dict(os.environ)
+        env.update(json.loads(job['env']))
+    cwd = job.get('cwd') or None
+
+    if job.get('argv'):
+        exit_code = execute_job_argv(json.loads(job['argv']), env=env, cwd=cwd, capture=capture, timeout=timeout)
+    else:
+        exit_code = execute_job_command(job['command'], env=env, cwd=cwd, capture=capture, timeout=timeout)
+    return exit_code, capture
+
+def execute_job_command(command: str, env=None, cwd=None, capture: OutputCapture = None, timeout=None):
+    """
+    Executes a shell command and returns its exit code.
+
+    Returns 0 for success, non-zero for failure.
+    """
+    return _run(command, {'shell': True, 'env': env, 'cwd': cwd}, capture, f"'{command}'", timeout)
+
+def execute_job_argv(argv: list, env=None, cwd=None, capture: OutputCapture = None, timeout=None):
+    """
+    Executes argv directly (no intermediate shell) and returns its exit code.
+
+    The program is resolved to an absolute path up front and file
+    descriptors are inherited as-is (Python's own are non-inheritable), so
+    without a 'cwd' subprocess can use posix_spawn; otherwise it falls back
+    to vfork/exec. A program that cannot be found returns 127, as a shell
+    would.
+    """
+    search_path = (env or os.environ).get('PATH', os.defpath)
+    program = argv[0]
+    if os.sep not in program:
+        program = shutil.which(program, path=search_path)
+        if program is None:
+            print(f"Command '{argv[0]}' not found.")
+            return 127
+
+    popen_kwargs = {'executable': program, 'env': env, 'cwd': cwd, 'close_fds': False}
+    return _run(argv, popen_kwargs, capture, repr(argv), timeout)
@@ -0,0 +1,247 @@
+"""In-process latency histograms and counters for the hot paths.
+
+Metrics live in a per-process registry and cost one bisect plus a few
+additions per observation. Workers dump a snapshot to
+~/.queuectl/metrics/<worker_id>.json every few seconds, which
+'queuectl metrics' merges across live workers, and can serve their own
+registry as Prometheus text on a localhost port (--metrics-port).
+
+Histograms use fixed, log-spaced buckets (50us doubling up to ~100s), so
+snapshots from different processes merge by adding bucket counts.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import database
+
+# Upper bounds (seconds) of the histogram buckets; a final +Inf is implied.
+BUCKETS = tuple(0.00005 * 2 ** i for i in range(22))
+
+# Seconds between a worker's snapshot dumps.
+DUMP_INTERVAL = 5.0
+
+_lock = threading.Lock()
+_registry = {}
+
+
+class Histogram:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        with _lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        """Observes the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with _lock:
+            return {
+                'type': 'histogram',
+                'help': self.help,
+                'counts': self.counts[:],
+                'sum': self.sum,
+                'count': self.count,
+                'max': self.max,
+            }
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'type': 'counter', 'help': self.help, 'value': self.value}
+
+
+def _get(cls, name, help_text):
+    metric = _registry.get(name)
+    if metric is None:
+        with _lock:
+            metric = _registry.setdefault(name, cls(name, help_text))
+    return metric
+
+def histogram(name, help_text=''):
+    """Returns the process-wide histogram 'name', creating it on first use."""
+    return _get(Histogram, name, help_text)
+
+def counter(name, help_text=''):
+    """Returns the process-wide counter 'name', creating it on first use."""
+    return _get(Counter, name, help_text)
+
+def snapshot():
+    """Returns {name: metric snapshot} for this process."""
+    return {name: metric.snapshot() for name, metric in sorted(_registry.items())}
+
+def merge(snapshots):
+    """Combines snapshots from several processes into one."""
+    merged = {}
+    for snap in snapshots:
+        for name, data in snap.items():
+            total = merged.get(name)
+            if total is None:
+                merged[name] = json.loads(json.dumps(data))
+            elif data['type'] == 'counter':
+                total['value'] += data['value']
+            else:
+                total['counts'] = [a + b for a, b in zip(total['counts'], data['counts'])]
+                total['sum'] += data['sum']
+                total['count'] += data['count']
+                total['max'] = max(total['max'], data['max'])
+    return merged
+
+def quantile(data, q):
+    """
+    Estimates the q-quantile (0..1) of a histogram snapshot by linear
+    interpolation inside its bucket, capped at the observed max.
+    """
+    if not data['count']:
+        return None
+    rank = q * data['count']
+    cumulative = 0
+    for index, count in enumerate(data['counts']):
+        if count and cumulative + count >= rank:
+            lower = BUCKETS[index - 1] if index > 0 else 0.0
+            upper = BUCKETS[index] if index < len(BUCKETS) else data['max']
+            estimate = lower + (upper - lower) * (rank - cumulative) / count
+            return min(estimate, data['max'])
+        cumulative += count
+    return data['max']
+
+def render_prometheus(snap, prefix='queuectl_'):
+    """Formats a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, data in snap.items():
+        full_name = prefix + name
+        lines.append(f"# HELP {full_name} {data['help']}")
+        if data['type'] == 'counter':
+            lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name} {data['value']}")
+            continue
+        lines.append(f"# TYPE {full_name} histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (None,), data['counts']):
+            cumulative += count
+            le = '+Inf' if bound is None else f"{bound:g}"
+            lines.append(f'{full_name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{full_name}_sum {data['sum']}")
+        lines.append(f"{full_name}_count {data['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _metrics_dir():
+    return os.path.join(database.APP_DIR, 'metrics')
+
+def dump(worker_id):
+    """Writes this process's snapshot to the metrics directory (atomically)."""
+    directory = _metrics_dir()
+    path = os.path.join(directory, f"{worker_id}.json")
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'worker_id': worker_id,
+                'pid': os.getpid(),
+                'updated_at': time.time(),
+                'metrics': snapshot(),
+            }, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing metrics for {worker_id}: {e}")
+
+def remove_dump(worker_id):
+    try:
+        os.unlink(os.path.join(_metrics_dir(), f"{worker_id}.json"))
+    except OSError:
+        pass
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def load_dumps():
+    """
+    Returns the dumps of every live worker. Dumps left behind by workers
+    that died without cleaning up are deleted.
+    """
+    dumps = []
+    try:
+        names = sorted(os.listdir(_metrics_dir()))
+    except OSError:
+        return dumps
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(_metrics_dir(), name)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if data.get('pid') and _pid_alive(data['pid']):
+            dumps.append(data)
+        else:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    return dumps
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_prometheus(snapshot()).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, host='127.0.0.1'):
+    """
+    Serves this process's metrics at http://host:port/metrics from a daemon
+    thread. Returns the server (call shutdown() to stop it).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
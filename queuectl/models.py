@@ -1,174 +1,1334 @@
+import base64
+import heapq
+import itertools
 import json
+import os
+import re
+import shlex
+import shutil
 import sqlite3
-import math
-from datetime import datetime, timezone
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
 from . import database
 from . import config
+from . import notify
+from . import cron
+from . import metrics
+from . import executor
 
-def create_job(job_data: dict):
+INSERT_JOB_COLUMNS = (
+    "id, command, state, max_retries, created_at, updated_at, next_run_at, "
+    "argv, env, cwd, callable, args, kwargs, queue, priority, tenant, pending_deps"
+)
+
+DEFAULT_QUEUE = 'default'
+DEFAULT_TENANT = 'default'
+
+_claim_lock_wait = metrics.histogram(
+    'claim_lock_wait_seconds', 'Time a claim waited for the database write lock.')
+_claim_query = metrics.histogram(
+    'claim_query_seconds', 'Time a claim spent selecting and marking jobs once it held the lock.')
+_queue_wait = metrics.histogram(
+    'queue_wait_seconds', 'Time from a job becoming due (enqueue, retry or run_at) to its claim.')
+_jobs_claimed = metrics.counter('jobs_claimed_total', 'Jobs claimed by workers.')
+_ack_duration = metrics.histogram(
+    'ack_seconds', 'Time to write a group of job state updates (one transaction).')
+_jobs_unblocked = metrics.counter(
+    'jobs_unblocked_total', 'Blocked jobs released because their last parent completed.')
+
+def shard_count():
+    """Number of files the job store is split over (see database.shard_path)."""
+    return max(1, config.get_config_value('shards') or 1)
+
+def shard_of(job_id, count: int = None) -> int:
+    """Returns the shard that holds a job: crc32 of its id modulo the shard count."""
+    count = count or shard_count()
+    if count == 1:
+        return 0
+    return zlib.crc32(str(job_id).encode()) % count
+
+def _group_by_shard(items, job_id=lambda item: item):
+    """Returns {shard: [items]}, placing each item by the job id it refers to."""
+    count = shard_count()
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_of(job_id(item), count), []).append(item)
+    return groups
+
+def _shard_connections():
+    """Yields (shard, connection) for every shard, shard 0 first."""
+    for shard in range(shard_count()):
+        yield shard, database.get_db_connection(shard)
+
+def _callable_fields(job_data: dict):
     """
-    Creates a new job in the database.
+    Validates an in-process Python job ({"callable": "pkg.mod:func",
+    "args": [...], "kwargs": {...}}) and returns (command, callable,
+    args_json, kwargs_json). The stored 'command' is the callable path.
     """
-    if 'id' not in job_data or 'command' not in job_data:
-        raise ValueError("Job data must include 'id' and 'command'")
+    target = job_data['callable']
+    module_name, _, attr = target.partition(':') if isinstance(target, str) else ('', '', '')
+    if not module_name or not attr:
+        raise ValueError("'callable' must look like 'package.module:function'")
+    if 'command' in job_data or 'argv' in job_data:
+        raise ValueError("A job has exactly one of 'command', 'argv' or 'callable'")
+    if job_data.get('env') is not None or job_data.get('cwd') is not None:
+        raise ValueError("'env' and 'cwd' are not supported for 'callable' jobs")
+
+    args = job_data.get('args', [])
+    kwargs = job_data.get('kwargs', {})
+    if not isinstance(args, list):
+        raise ValueError("'args' must be a list")
+    if not isinstance(kwargs, dict):
+        raise ValueError("'kwargs' must be an object")
+    try:
+        return target, target, json.dumps(args), json.dumps(kwargs)
+    except (TypeError, ValueError):
+        raise ValueError("'args' and 'kwargs' must be JSON-serializable")
+
+def _execution_fields(job_data: dict):
+    """
+    Validates how a job is run and returns (command, argv_json, env_json,
+    cwd, callable, args_json, kwargs_json). A job gives either a shell
+    'command' string, an 'argv' list that is executed directly, or a Python
+    'callable'; 'env' and 'cwd' are optional for the first two.
+    For argv jobs the stored 'command' is the shell-quoted argv, for display.
+    """
+    if job_data.get('callable') is not None:
+        command, target, args, kwargs = _callable_fields(job_data)
+        return (command, None, None, None, target, args, kwargs)
+
+    argv = job_data.get('argv')
+    if argv is not None:
+        if not isinstance(argv, list) or not argv or not all(isinstance(a, str) for a in argv):
+            raise ValueError("'argv' must be a non-empty list of strings")
+        command = job_data.get('command') or shlex.join(argv)
+    elif 'command' in job_data:
+        command = job_data['command']
+    else:
+        raise ValueError("Job data must include 'id' and 'command' (or 'argv' or 'callable')")
+
+    env = job_data.get('env')
+    if env is not None and (
+        not isinstance(env, dict)
+        or not all(isinstance(k, str) and isinstance(v, str) for k, v in env.items())
+    ):
+        raise ValueError("'env' must be an object of string values")
+
+    cwd = job_data.get('cwd')
+    if cwd is not None and not isinstance(cwd, str):
+        raise ValueError("'cwd' must be a string")
+
+    return (
+        command,
+        json.dumps(argv) if argv is not None else None,
+        json.dumps(env) if env is not None else None,
+        cwd,
+        None,
+        None,
+        None,
+    )
+
+def _due_time(job_data: dict, now_timestamp: float):
+    """
+    Returns the epoch at which a job becomes due: 'run_at' (epoch seconds
+    or an ISO 8601 timestamp, UTC if no offset is given), now plus
+    'delay_seconds', or now.
+    """
+    run_at = job_data.get('run_at')
+    delay_seconds = job_data.get('delay_seconds')
+    if run_at is not None and delay_seconds is not None:
+        raise ValueError("Give either 'run_at' or 'delay_seconds', not both")
+
+    if delay_seconds is not None:
+        if isinstance(delay_seconds, bool) or not isinstance(delay_seconds, (int, float)) or delay_seconds < 0:
+            raise ValueError("'delay_seconds' must be a non-negative number")
+        return now_timestamp + delay_seconds
+    if run_at is None:
+        return now_timestamp
+    if isinstance(run_at, (int, float)) and not isinstance(run_at, bool):
+        return float(run_at)
+    if isinstance(run_at, str):
+        try:
+            moment = datetime.fromisoformat(run_at.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError("'run_at' must be epoch seconds or an ISO 8601 timestamp")
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+    raise ValueError("'run_at' must be epoch seconds or an ISO 8601 timestamp")
+
+def _job_row(job_data: dict, default_max_retries: int):
+    """
+    Validates a job definition and returns the tuple of values for
+    INSERT_JOB_COLUMNS.
+    """
+    if not isinstance(job_data, dict):
+        raise ValueError("Job data must be a JSON object")
+    if 'id' not in job_data:
+        raise ValueError("Job data must include 'id' and 'command' (or 'argv' or 'callable')")
+    command, argv, env, cwd, target, args, kwargs = _execution_fields(job_data)
+
+    queue = job_data.get('queue', DEFAULT_QUEUE)
+    if not isinstance(queue, str) or not queue:
+        raise ValueError("'queue' must be a non-empty string")
+    priority = job_data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("'priority' must be an integer")
+    tenant = job_data.get('tenant', DEFAULT_TENANT)
+    if not isinstance(tenant, str) or not tenant:
+        raise ValueError("'tenant' must be a non-empty string")
 
-    conn = database.get_db_connection()
-    cursor = conn.cursor()
-    
     now = datetime.now(timezone.utc).isoformat()
-    
+    now_timestamp = time.time()
+    # Future jobs wait in 'scheduled', outside the claim index, until the
+    # claim path promotes them (see _promote_due_jobs).
+    next_run_at = _due_time(job_data, now_timestamp)
+    state = 'scheduled' if next_run_at > now_timestamp else 'pending'
+
     max_retries = job_data.get('max_retries')
     if max_retries is None:
-        max_retries = config.get_config_value('max_retries')
+        max_retries = default_max_retries
+
+    return (
+        job_data['id'],
+        command,
+        state,
+        max_retries,
+        now,
+        now,
+        next_run_at,
+        argv,
+        env,
+        cwd,
+        target,
+        args,
+        kwargs,
+        queue,
+        priority,
+        tenant,
+        0
+    )
+
+def _parent_ids(job_data: dict):
+    """Validates a job's 'depends_on' and returns its parent IDs, deduplicated."""
+    parents = job_data.get('depends_on')
+    if parents is None:
+        return []
+    if not isinstance(parents, list) or not all(isinstance(p, str) and p for p in parents):
+        raise ValueError("'depends_on' must be a list of job IDs")
+    if job_data['id'] in parents:
+        raise ValueError("A job cannot depend on itself")
+    return list(dict.fromkeys(parents))
+
+def _insert_sql(or_ignore: bool = False):
+    placeholders = ", ".join("?" for _ in INSERT_JOB_COLUMNS.split(","))
+    verb = "INSERT OR IGNORE" if or_ignore else "INSERT"
+    return f"{verb} INTO jobs ({INSERT_JOB_COLUMNS}) VALUES ({placeholders})"
+
+def create_job(job_data: dict):
+    """
+    Creates a new job in the database. A job with 'depends_on' waits in
+    'blocked' until those jobs have completed (see _insert_dependent_job).
+    """
+    return enqueue_job(job_data)['id']
+
+def enqueue_job(job_data: dict):
+    """
+    create_job, returning what was decided at insert rather than just the
+    ID: a dict with 'id', 'queue', 'state' ('pending', 'scheduled',
+    'blocked' or 'cancelled'), 'next_run_at' and 'pending_deps'. Unlike a
+    get_job afterwards, this cannot report a state a worker has since
+    moved the job to.
+    """
+    default_max_retries = None
+    if isinstance(job_data, dict) and job_data.get('max_retries') is None:
+        default_max_retries = config.get_config_value('max_retries')
+    row = _job_row(job_data, default_max_retries)
+    parents = _parent_ids(job_data)
+    job = {'id': row[0], 'queue': row[13], 'state': row[2], 'next_run_at': row[6], 'pending_deps': 0}
+
+    if parents:
+        try:
+            job['state'], job['pending_deps'] = _insert_dependent_job(row, parents)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Job with ID '{job_data['id']}' already exists.")
+        notify.wake_workers()
+        return job
+
+    conn = database.get_db_connection(shard_of(job_data['id']))
+    cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            """
-            INSERT INTO jobs (id, command, max_retries, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                job_data['id'],
-                job_data['command'],
-                max_retries,
-                now,
-                now
-            )
-        )
+        cursor.execute(_insert_sql(), row)
         conn.commit()
     except sqlite3.IntegrityError:
-        conn.close()
+        conn.rollback()
         raise ValueError(f"Job with ID '{job_data['id']}' already exists.")
     except Exception as e:
         conn.rollback()
-        conn.close()
         raise e
     
-    conn.close()
-    return job_data['id']
+    notify.wake_workers()
+    return job
+
+def _chunks(iterable, size):
+    """Yields successive lists of at most 'size' items from an iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-def list_jobs(state: str = None):
+def create_jobs(jobs, chunk_size: int = 1000, on_duplicate: str = 'fail', on_error=None):
     """
-    Lists all jobs, optionally filtering by state.
+    Bulk-inserts jobs from any iterable of job dicts, streaming it in
+    chunks of 'chunk_size' rows with one executemany() and one commit
+    per chunk.
+
+    on_duplicate: 'fail' reports an existing ID as an error for that job,
+    'ignore' skips it silently (INSERT OR IGNORE).
+    on_error: optional callback(job_data, message) for jobs that were not
+    inserted; the load carries on either way.
+
+    Returns a dict with 'inserted', 'skipped' and 'errors' counts.
+
+    In a sharded store each chunk is split by shard, with one transaction
+    per shard. Jobs with 'depends_on' are inserted one by one after the
+    rest of their chunk, so they may depend on any job before them.
     """
-    conn = database.get_db_connection()
+    if on_duplicate not in ('fail', 'ignore'):
+        raise ValueError(f"Invalid on_duplicate '{on_duplicate}'. Must be 'fail' or 'ignore'.")
+
+    default_max_retries = config.get_config_value('max_retries')
+    stats = {'inserted': 0, 'skipped': 0, 'errors': 0}
+
+    def report(job_data, message):
+        stats['errors'] += 1
+        if on_error:
+            on_error(job_data, message)
+
+    for chunk in _chunks(jobs, max(1, chunk_size)):
+        rows = []
+        dependent = []
+        for job_data in chunk:
+            try:
+                row = _job_row(job_data, default_max_retries)
+                parents = _parent_ids(job_data)
+            except ValueError as e:
+                report(job_data, str(e))
+                continue
+            if parents:
+                dependent.append((job_data, row, parents))
+            else:
+                rows.append((job_data, row))
+        if not rows and not dependent:
+            continue
+        for shard, shard_rows in _group_by_shard(rows, lambda item: item[1][0]).items():
+            _insert_rows(database.get_db_connection(shard), shard_rows, on_duplicate, stats, report)
+        for job_data, row, parents in dependent:
+            try:
+                _insert_dependent_job(row, parents)
+                stats['inserted'] += 1
+            except sqlite3.IntegrityError:
+                if on_duplicate == 'ignore':
+                    stats['skipped'] += 1
+                else:
+                    report(job_data, f"Job with ID '{job_data['id']}' already exists.")
+            except ValueError as e:
+                report(job_data, str(e))
+        notify.wake_workers()
+
+    return stats
+
+def _insert_rows(conn, rows, on_duplicate, stats, report):
+    """Inserts (job_data, row) pairs into one shard in a single transaction."""
     cursor = conn.cursor()
-    
-    query = "SELECT id, command, state, attempts, max_retries, updated_at FROM jobs"
-    params = []
+    try:
+        cursor.executemany(_insert_sql(on_duplicate == 'ignore'), [row for _, row in rows])
+        conn.commit()
+        stats['inserted'] += cursor.rowcount
+        stats['skipped'] += len(rows) - cursor.rowcount
+        return
+    except sqlite3.IntegrityError:
+        conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
 
-    if state:
-        query += " WHERE state = ?"
-        params.append(state)
-    
-    query += " ORDER BY created_at ASC"
+    # A duplicate ID aborted the chunk: redo it row by row, still in a
+    # single transaction, so only the offending jobs are rejected.
+    for job_data, row in rows:
+        try:
+            cursor.execute(_insert_sql(), row)
+            stats['inserted'] += 1
+        except sqlite3.IntegrityError:
+            report(job_data, f"Job with ID '{job_data['id']}' already exists.")
+    conn.commit()
 
-    cursor.execute(query, tuple(params))
-    jobs = cursor.fetchall()
-    conn.close()
-    
-    return [dict(job) for job in jobs]
+# Most IDs bound in one IN (...) list by the dependency helpers.
+DEPS_BATCH_SIZE = 500
 
-def atomically_get_next_job(worker_id: str):
+def _insert_dependent_job(row, parents):
     """
-    Atomically fetches the next 'pending' job OR a 'failed' job
-    that is ready to be retried based on exponential backoff.
+    Inserts a job (an INSERT_JOB_COLUMNS row) that depends on 'parents'.
+
+    Every parent must still exist: gc'd jobs cannot be depended on. The
+    job starts 'blocked' with pending_deps = its parents that have not
+    completed, and a job_deps edge is recorded in each such parent's
+    shard. _add_edges re-checks each parent's state as it adds the edge,
+    so a parent that completes meanwhile is counted down, and one that
+    reaches the DLQ meanwhile gets 'on_parent_dead' applied here, as its
+    own ack can no longer see the edge. A parent already in the DLQ (or
+    cancelled) makes the job 'cancelled' straight away unless
+    'on_parent_dead' is 'hold'.
+
+    Returns the job's (state, pending_deps) as inserted. Raises
+    ValueError for unknown parents and sqlite3.IntegrityError if the ID
+    already exists.
     """
-    conn = database.get_db_connection()
-    conn.execute("BEGIN IMMEDIATE TRANSACTION")
-    cursor = conn.cursor()
-    
+    job_id = row[0]
+    states = {}
+    for shard, shard_parents in _group_by_shard(parents).items():
+        placeholders = ", ".join("?" for _ in shard_parents)
+        states.update(
+            (r['id'], r['state']) for r in database.get_db_connection(shard).execute(
+                f"SELECT id, state FROM jobs WHERE id IN ({placeholders})", shard_parents
+            )
+        )
+    missing = [parent for parent in parents if parent not in states]
+    if missing:
+        raise ValueError(
+            f"Unknown parent job(s): {', '.join(missing)} (never enqueued, or already removed by gc)"
+        )
+
+    hold = config.get_config_value('on_parent_dead') == 'hold'
+    waiting = [parent for parent in parents if states[parent] != 'completed']
+    if not hold and any(states[parent] in ('dead', 'cancelled') for parent in waiting):
+        row = row[:2] + ('cancelled',) + row[3:]
+        waiting = []
+    elif waiting:
+        row = row[:2] + ('blocked',) + row[3:-1] + (len(waiting),)
+
+    shard = shard_of(job_id)
+    conn = database.get_db_connection(shard)
+    by_shard = _group_by_shard(waiting)
+    missed = []
     try:
-        backoff_base = config.get_config_value('backoff_base')
-        now_timestamp = datetime.now(timezone.utc).timestamp()
-        conn.create_function("POW", 2, math.pow)
-        query = f"""
-            SELECT id FROM jobs
-            WHERE state = 'pending'
-            OR (
-                state = 'failed' AND
-                {now_timestamp} > (CAST(strftime('%s', updated_at) AS INTEGER) + POW(?, attempts))
+        conn.execute(_insert_sql(), row)
+        if shard in by_shard:
+            missed += _add_edges(conn, by_shard.pop(shard), job_id, hold)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # Parents in other shards: one transaction each.
+    for parent_shard, shard_parents in by_shard.items():
+        parent_conn = database.get_db_connection(parent_shard)
+        try:
+            missed += _add_edges(parent_conn, shard_parents, job_id, hold)
+            parent_conn.commit()
+        except Exception:
+            parent_conn.rollback()
+            raise
+
+    # A parent gone since it was read was removed by gc: a completed one
+    # counts as done, one from the DLQ as dead (gc cancels what waits on it).
+    missed = [
+        state or ('dead' if states[parent] in ('dead', 'cancelled') else 'completed')
+        for parent, state in missed
+    ]
+    if any(state != 'completed' for state in missed):
+        _cancel_dependents([], [job_id])
+        return 'cancelled', 0
+    if missed:
+        try:
+            _count_down(conn, [job_id] * len(missed))
+            # Read back inside the transaction: no worker can have claimed it yet.
+            released = conn.execute(
+                "SELECT state, pending_deps FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return released['state'], released['pending_deps']
+    return row[2], row[-1]
+
+def _add_edges(conn, parents, child_id, hold=False):
+    """
+    Records child_id under each of 'parents' (all in conn's shard) that
+    is still waited for: not completed and, unless 'hold', not dead or
+    cancelled. Returns (parent, state) for the parents left without an
+    edge, with state None for a parent that no longer exists.
+    """
+    missed = []
+    for parent in parents:
+        added = conn.execute(
+            """
+            INSERT OR IGNORE INTO job_deps (parent_id, child_id)
+            SELECT id, ? FROM jobs
+            WHERE id = ? AND state != 'completed' AND (? OR state NOT IN ('dead', 'cancelled'))
+            """,
+            (child_id, parent, hold)
+        ).rowcount
+        if not added:
+            row = conn.execute("SELECT state FROM jobs WHERE id = ?", (parent,)).fetchone()
+            missed.append((parent, row['state'] if row else None))
+    return missed
+
+def _take_children(conn, parent_ids, states):
+    """
+    Deletes the job_deps edges of the given parents that are in one of
+    'states' and returns their children, once per edge.
+    """
+    children = []
+    state_placeholders = ", ".join("?" for _ in states)
+    for chunk in _chunks(parent_ids, DEPS_BATCH_SIZE):
+        placeholders = ", ".join("?" for _ in chunk)
+        rows = conn.execute(
+            f"""
+            DELETE FROM job_deps
+            WHERE parent_id IN (
+                SELECT id FROM jobs WHERE id IN ({placeholders}) AND state IN ({state_placeholders})
             )
-            ORDER BY created_at ASC
-            LIMIT 1
+            RETURNING child_id
+            """,
+            (*chunk, *states)
+        ).fetchall()
+        children.extend(row['child_id'] for row in rows)
+    return children
+
+def _count_down(conn, child_ids):
+    """
+    Decrements pending_deps once per occurrence of a child (all in conn's
+    shard) and releases the blocked children that reach zero to 'pending'
+    (or 'scheduled' if their own run_at is still ahead). Runs inside the
+    caller's transaction; returns the number released.
+    """
+    if not child_ids:
+        return 0
+    conn.executemany(
+        "UPDATE jobs SET pending_deps = pending_deps - 1 WHERE id = ? AND state = 'blocked'",
+        [(child_id,) for child_id in child_ids]
+    )
+    return _release_ready(conn, set(child_ids))
+
+def _release_ready(conn, job_ids):
+    """
+    Moves the given jobs that are 'blocked' with pending_deps at zero to
+    'pending', or 'scheduled' if their own run_at is still ahead.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    now_timestamp = time.time()
+    released = 0
+    for chunk in _chunks(job_ids, DEPS_BATCH_SIZE):
+        placeholders = ", ".join("?" for _ in chunk)
+        released += conn.execute(
+            f"""
+            UPDATE jobs
+            SET state = CASE WHEN next_run_at > ? THEN 'scheduled' ELSE 'pending' END,
+                next_run_at = MAX(next_run_at, ?), updated_at = ?
+            WHERE state = 'blocked' AND pending_deps <= 0 AND id IN ({placeholders})
+            """,
+            (now_timestamp, now_timestamp, now, *chunk)
+        ).rowcount
+    _jobs_unblocked.inc(released)
+    return released
+
+def _settle_children(shard, conn, transitions):
+    """
+    Part of an ack transaction on 'shard': takes the edges of the parents
+    that just completed and counts down their children in this shard.
+    Returns (released, children that live in other shards).
+    """
+    completed = [transition[0] for transition in transitions if transition[1] == 'completed']
+    if not completed:
+        return 0, []
+    children = _take_children(conn, completed, ('completed',))
+    count = shard_count()
+    local = [child for child in children if shard_of(child, count) == shard]
+    return _count_down(conn, local), [child for child in children if shard_of(child, count) != shard]
+
+def _count_down_elsewhere(child_ids):
+    """
+    Counts down children whose completed parent lives in another shard,
+    one transaction per shard after the parent's ack has committed.
+    Returns the number released.
+    """
+    released = 0
+    for shard, shard_children in _group_by_shard(child_ids).items():
+        conn = database.get_db_connection(shard)
+        try:
+            released += _count_down(conn, shard_children)
+            conn.commit()
+        except Exception as e:
+            print(f"Error releasing dependent jobs {shard_children}: {e}")
+            conn.rollback()
+    return released
+
+def _settle_dead_parents(job_ids):
+    """
+    Applies 'on_parent_dead' to the dependents of jobs that just reached
+    the DLQ: with 'cancel', every blocked descendant becomes 'cancelled'
+    and the edges are dropped; with 'hold' they stay blocked, and a
+    'dlq retry' of the parent that then completes releases them.
+    Returns the number of jobs cancelled.
+    """
+    if not job_ids or config.get_config_value('on_parent_dead') == 'hold':
+        return 0
+    return _cancel_dependents(job_ids)
+
+def _cancel_dependents(parents, children=()):
+    """
+    Cancels the blocked 'children' and the blocked dependents of the dead
+    or cancelled 'parents', then theirs, and so on, dropping the edges on
+    the way. Returns the number of jobs cancelled.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    cancelled = 0
+    parents = list(parents)
+    children = list(children)
+    while parents or children:
+        for shard, shard_parents in _group_by_shard(parents).items():
+            conn = database.get_db_connection(shard)
+            try:
+                children.extend(_take_children(conn, shard_parents, ('dead', 'cancelled')))
+                conn.commit()
+            except Exception as e:
+                print(f"Error reading dependents of {shard_parents}: {e}")
+                conn.rollback()
+        parents = []
+        for shard, shard_children in _group_by_shard(set(children)).items():
+            conn = database.get_db_connection(shard)
+            try:
+                for chunk in _chunks(shard_children, DEPS_BATCH_SIZE):
+                    placeholders = ", ".join("?" for _ in chunk)
+                    rows = conn.execute(
+                        f"""
+                        UPDATE jobs SET state = 'cancelled', updated_at = ?
+                        WHERE state = 'blocked' AND id IN ({placeholders})
+                        RETURNING id
+                        """,
+                        (now, *chunk)
+                    ).fetchall()
+                    parents.extend(row['id'] for row in rows)
+                conn.commit()
+            except Exception as e:
+                print(f"Error cancelling dependent jobs {shard_children}: {e}")
+                conn.rollback()
+        children = []
+        cancelled += len(parents)
+    return cancelled
+
+LIST_COLUMNS = "id, command, state, queue, tenant, priority, attempts, max_retries, created_at, updated_at"
+
+def make_cursor(job: dict) -> str:
+    """Returns an opaque keyset cursor pointing just after 'job'."""
+    raw = json.dumps([job['created_at'], job['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _parse_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, job_id = json.loads(raw)
+        return str(created_at), str(job_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'.")
+
+def iter_jobs(state: str = None, after: str = None, limit: int = None, page_size: int = 1000,
+              queue: str = None):
+    """
+    Yields jobs as dicts in (created_at, id) order, optionally filtered by
+    state and/or queue and starting after a cursor from make_cursor().
+
+    Rows are fetched in keyset pages of 'page_size' served by
+    idx_jobs_state_created / idx_jobs_queue_created / idx_jobs_created, so
+    memory stays flat and no read transaction is held open between pages.
+    In a sharded store every shard is paged this way and the streams are
+    merged, so the order and the cursors are the same as with one file.
+    """
+    position = _parse_cursor(after) if after else None
+    count = shard_count()
+    if count == 1:
+        yield from _iter_shard_jobs(database.get_db_connection(), state, position, limit, page_size, queue)
+        return
+    streams = [
+        _iter_shard_jobs(database.get_db_connection(shard), state, position, limit, page_size, queue)
+        for shard in range(count)
+    ]
+    merged = heapq.merge(*streams, key=lambda job: (job['created_at'], job['id']))
+    yield from itertools.islice(merged, limit)
+
+def _iter_shard_jobs(conn, state, position, limit, page_size, queue):
+    """iter_jobs for one shard."""
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        batch = page_size if remaining is None else min(page_size, remaining)
+        query = f"SELECT {LIST_COLUMNS} FROM jobs"
+        where = []
+        params = []
+        if state:
+            where.append("state = ?")
+            params.append(state)
+        if queue:
+            where.append("queue = ?")
+            params.append(queue)
+        if position:
+            where.append("(created_at, id) > (?, ?)")
+            params.extend(position)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY created_at, id LIMIT ?"
+        params.append(batch)
+
+        rows = conn.execute(query, tuple(params)).fetchall()
+        for row in rows:
+            yield dict(row)
+        if len(rows) < batch:
+            return
+        position = (rows[-1]['created_at'], rows[-1]['id'])
+        if remaining is not None:
+            remaining -= len(rows)
+
+def list_jobs(state: str = None, limit: int = None, after: str = None, queue: str = None):
+    """
+    Lists all jobs, optionally filtering by state and queue.
+    See iter_jobs for a streaming version.
+    """
+    return [job for job in iter_jobs(state, after=after, limit=limit, queue=queue)]
+
+def atomically_get_next_job(worker_id: str, queues=None):
+    """
+    Atomically fetches the next 'pending' job OR a 'failed' job
+    whose retry backoff has elapsed (see _promote_due_jobs).
+    """
+    jobs = claim_batch(worker_id, 1, queues)
+    return jobs[0] if jobs else None
+
+# One probe of idx_jobs_claim: the best pending jobs of one tenant in one
+# queue. Every 'pending' job is due (retries and scheduled jobs only get
+# there once they are, see _promote_due_jobs), so the probe stops after
+# LIMIT rows. Pinned to the index because the planner would otherwise
+# prefer the next_run_at range on idx_jobs_ready and sort the ready set.
+_CLAIM_PROBE_SQL = """
+    SELECT id, priority, next_run_at, created_at FROM jobs INDEXED BY idx_jobs_claim
+    WHERE state = 'pending' AND queue = ? AND tenant = ? AND next_run_at <= ?
+    ORDER BY priority DESC, next_run_at, created_at
+    LIMIT ?
+"""
+
+def _claimable_queues(cursor, queues=None):
+    """
+    Returns (groups, tenants_by_queue). 'groups' lists the queues to probe
+    grouped by precedence: with an explicit 'queues' list, one group per
+    queue in the given order; otherwise a single group of every queue.
+    Only queues with pending jobs (per job_counts) are included, and
+    tenants_by_queue maps each of them to the tenants that have some.
+    """
+    cursor.execute(
+        """
+        SELECT DISTINCT queue, tenant FROM job_counts
+        WHERE state = 'pending' AND count > 0
         """
+    )
+    tenants_by_queue = {}
+    for row in cursor.fetchall():
+        tenants_by_queue.setdefault(row['queue'], set()).add(row['tenant'])
+    if queues is None:
+        groups = [sorted(tenants_by_queue)] if tenants_by_queue else []
+    else:
+        groups = [[queue] for queue in queues if queue in tenants_by_queue]
+    return groups, tenants_by_queue
 
-        cursor.execute(query, (backoff_base,))
-        job_row = cursor.fetchone()
+_RUNNING_BY_TENANT_SQL = """
+    SELECT tenant, SUM(count) AS running FROM job_counts
+    WHERE state = 'processing' AND tenant IN ({placeholders})
+    GROUP BY tenant
+"""
 
-        if job_row:
-            job_id = job_row['id']
-            now_iso = datetime.now(timezone.utc).isoformat()
-            
-            cursor.execute(
+def _load_tenants(cursor, names, other_shards=()):
+    """
+    Returns {tenant: {'weight', 'max_concurrency', 'pass', 'running'}} for
+    the given tenants. Tenants without a row get weight 1 and no cap;
+    'running' counts their jobs currently in 'processing', including those
+    in 'other_shards' (connections, read without locking them).
+    """
+    tenants = {
+        name: {'weight': 1.0, 'max_concurrency': 0, 'pass': 0.0, 'running': 0}
+        for name in names
+    }
+    placeholders = ", ".join("?" for _ in tenants)
+    cursor.execute(
+        f"SELECT name, weight, max_concurrency, pass FROM tenants WHERE name IN ({placeholders})",
+        tuple(tenants)
+    )
+    for row in cursor.fetchall():
+        tenants[row['name']].update({
+            'weight': row['weight'],
+            'max_concurrency': row['max_concurrency'],
+            'pass': row['pass'],
+        })
+    running_sql = _RUNNING_BY_TENANT_SQL.format(placeholders=placeholders)
+    for source in (cursor, *other_shards):
+        for row in source.execute(running_sql, tuple(tenants)).fetchall():
+            tenants[row['tenant']]['running'] += row['running']
+    return tenants
+
+def _pick_fairly(cursor, group, tenants_by_queue, tenants, now, n):
+    """
+    Chooses up to n ready jobs from the queues in 'group' by stride
+    scheduling across tenants: each job taken advances its tenant's 'pass'
+    by 1 / weight, and the next job always comes from the eligible tenant
+    with the lowest pass, so tenants get jobs in proportion to their
+    weights however deep their backlogs are. A tenant returning from idle
+    (or new) is moved up to within one (largest) stride of the others
+    instead of replaying the share it did not use.
+
+    Tenants at their 'max_concurrency' are skipped. Each tenant's pending
+    jobs are fetched lazily with one LIMIT n probe per queue, so the cost
+    follows the number of tenants served, not the backlog (retries still
+    backing off are not 'pending' and never read here).
+    """
+    queues_by_tenant = {}
+    for queue in group:
+        for tenant in tenants_by_queue[queue]:
+            queues_by_tenant.setdefault(tenant, []).append(queue)
+    eligible = set(queues_by_tenant)
+    ready = {}
+    picked = []
+
+    while len(picked) < n and eligible:
+        ranked = sorted(eligible, key=lambda t: (tenants[t]['pass'], t))
+        lowest = tenants[ranked[0]]['pass']
+        runner_up = tenants[ranked[1]]['pass'] if len(ranked) > 1 else None
+        # Active tenants never trail each other by more than this.
+        max_stride = max(1 / tenants[t]['weight'] for t in ranked)
+
+        def effective_pass(tenant):
+            others = runner_up if tenant == ranked[0] else lowest
+            if others is None:
+                return tenants[tenant]['pass']
+            return max(tenants[tenant]['pass'], others - max_stride)
+
+        tenant = min(ranked, key=lambda t: (effective_pass(t), t))
+        info = tenants[tenant]
+        if info['max_concurrency'] and info['running'] >= info['max_concurrency']:
+            eligible.discard(tenant)
+            continue
+
+        if tenant not in ready:
+            rows = []
+            for queue in queues_by_tenant[tenant]:
+                cursor.execute(_CLAIM_PROBE_SQL, (queue, tenant, now, n))
+                rows.extend(cursor.fetchall())
+            rows.sort(key=lambda row: (-row['priority'], row['next_run_at'], row['created_at']), reverse=True)
+            ready[tenant] = rows
+        if not ready[tenant]:
+            eligible.discard(tenant)
+            continue
+
+        picked.append(ready[tenant].pop()['id'])
+        info['pass'] = effective_pass(tenant) + 1 / info['weight']
+        info['running'] += 1
+        info['served'] = True
+    return picked
+
+# Most 'scheduled' (and, separately, 'failed') jobs moved to 'pending'
+# per claim transaction.
+PROMOTE_BATCH_SIZE = 1000
+
+def _promote_due_jobs(cursor, now_timestamp):
+    """
+    Moves 'scheduled' jobs whose time has come and 'failed' jobs whose
+    retry backoff has elapsed to 'pending', the only state claims probe.
+    The due ones are found with a range lookup on idx_jobs_ready, so
+    millions of jobs dated (or backed off) further out cost nothing here.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    for state in ('scheduled', 'failed'):
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET state = 'pending', updated_at = ?
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE state = ? AND next_run_at <= ?
+                ORDER BY next_run_at
+                LIMIT ?
+            )
+            """,
+            (now, state, now_timestamp, PROMOTE_BATCH_SIZE)
+        )
+
+def _fire_due_schedules(cursor, now_timestamp, count=1):
+    """
+    Creates the job instance of every schedule that is due and moves the
+    schedule to its next run. Instances are named '<schedule>-<epoch>' and
+    inserted with INSERT OR IGNORE, so a run is never created twice. Runs
+    missed while no worker was claiming are coalesced into one.
+
+    Schedules live in shard 0 (the cursor's). An instance that belongs to
+    another shard is committed there first; if this transaction then rolls
+    back, the retry inserts the same id again and is ignored. Returns the
+    number of instances written to other shards.
+    """
+    cursor.execute(
+        "SELECT name, cron, job, next_run_at FROM schedules WHERE next_run_at <= ? ORDER BY next_run_at",
+        (now_timestamp,)
+    )
+    due = cursor.fetchall()
+    if not due:
+        return 0
+    default_max_retries = config.get_config_value('max_retries')
+    elsewhere = 0
+    for schedule in due:
+        run_at = schedule['next_run_at']
+        job_data = dict(json.loads(schedule['job']), id=f"{schedule['name']}-{int(run_at)}", run_at=run_at)
+        try:
+            row = _job_row(job_data, default_max_retries)
+            target = shard_of(job_data['id'], count)
+            if target == 0:
+                cursor.execute(_insert_sql(or_ignore=True), row)
+            else:
+                other = database.get_db_connection(target)
+                other.execute(_insert_sql(or_ignore=True), row)
+                other.commit()
+                elsewhere += 1
+            next_run_at = cron.CronExpression(schedule['cron']).next_timestamp(max(run_at, now_timestamp))
+        except ValueError as e:
+            print(f"Schedule '{schedule['name']}' is invalid and was not run: {e}")
+            next_run_at = float('inf')
+        cursor.execute(
+            "UPDATE schedules SET next_run_at = ?, last_run_at = ? WHERE name = ?",
+            (next_run_at, run_at, schedule['name'])
+        )
+    return elsewhere
+
+# Where each claim_batch call starts in a sharded store; offset by the PID
+# so workers started together begin on different shards.
+_claim_rotation = itertools.count(os.getpid())
+
+_SHARD_HAS_WORK_SQL = """
+    SELECT EXISTS (SELECT 1 FROM job_counts WHERE state = 'pending' AND count > 0)
+        OR EXISTS (SELECT 1 FROM jobs WHERE state IN ('failed', 'scheduled') AND next_run_at <= ?)
+        OR EXISTS (SELECT 1 FROM schedules WHERE next_run_at <= ?)
+"""
+
+def claim_batch(worker_id: str, n: int, queues=None):
+    """
+    Atomically marks up to n ready jobs as 'processing' in a single
+    transaction and returns them in claim order.
+
+    'queues' restricts the claim to those queues, drained in the given
+    order; by default every queue is eligible. Within that, tenants share
+    the work by weight (see _pick_fairly) and each tenant's jobs are taken
+    by highest 'priority', then earliest due time, then age. Tenant
+    concurrency caps are checked inside the same transaction, so they hold
+    across any number of workers.
+
+    Claimed jobs are leased to worker_id for 'lease_seconds'; the worker
+    must renew the lease (renew_leases) or reap_expired_leases will take
+    the jobs back.
+
+    Each job carries a precomputed 'next_run_at' epoch, so the lookup is a
+    LIMIT n probe on idx_jobs_claim per queue and tenant rather than a
+    scan. Due schedules, 'scheduled' jobs and 'failed' jobs past their
+    backoff are turned into pending jobs in the same transaction first,
+    each through a range lookup on the due time.
+
+    In a sharded store every shard is claimed in its own transaction. Each
+    call starts at the next shard in turn and moves on to the following
+    ones until n jobs are claimed, skipping shards that an unlocked read
+    shows to have nothing ready, so workers spread over the shard locks.
+    Queue precedence and tenant fairness then hold within each shard
+    (jobs are spread evenly by id); concurrency caps count the jobs
+    processing in every shard.
+    """
+    count = shard_count()
+    if count == 1:
+        return _claim_from_shard(0, worker_id, n, queues, count)
+    start = next(_claim_rotation) % count
+    jobs = []
+    for offset in range(count):
+        shard = (start + offset) % count
+        now_timestamp = time.time()
+        conn = database.get_db_connection(shard)
+        try:
+            has_work = conn.execute(_SHARD_HAS_WORK_SQL, (now_timestamp, now_timestamp)).fetchone()[0]
+        except sqlite3.OperationalError:
+            has_work = True
+        if has_work:
+            jobs.extend(_claim_from_shard(shard, worker_id, n - len(jobs), queues, count))
+            if len(jobs) >= n:
+                break
+    return jobs
+
+def _claim_from_shard(shard: int, worker_id: str, n: int, queues, count: int):
+    """
+    claim_batch within one shard, in one BEGIN IMMEDIATE transaction.
+    A shard still locked after busy_timeout counts as having nothing
+    ready, so the caller moves on to the other shards.
+    """
+    conn = database.get_db_connection(shard)
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    locked = None
+
+    try:
+        conn.execute("BEGIN IMMEDIATE TRANSACTION")
+        locked = time.perf_counter()
+        _claim_lock_wait.observe(locked - started)
+        now_timestamp = time.time()
+        fired_elsewhere = 0
+        if shard == 0:
+            fired_elsewhere = _fire_due_schedules(cursor, now_timestamp, count)
+        _promote_due_jobs(cursor, now_timestamp)
+        job_ids = []
+        groups, tenants_by_queue = _claimable_queues(cursor, queues)
+        if groups:
+            tenants = _load_tenants(
+                cursor, {tenant for group in groups for queue in group for tenant in tenants_by_queue[queue]},
+                [database.get_db_connection(other) for other in range(count) if other != shard]
+            )
+            for group in groups:
+                job_ids.extend(_pick_fairly(
+                    cursor, group, tenants_by_queue, tenants, now_timestamp, n - len(job_ids)
+                ))
+                if len(job_ids) >= n:
+                    break
+            cursor.executemany(
                 """
-                UPDATE jobs 
-                SET state = 'processing', updated_at = ?
-                WHERE id = ?
+                INSERT INTO tenants (name, pass) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET pass = excluded.pass
                 """,
-                (now_iso, job_id)
+                [(name, info['pass']) for name, info in tenants.items() if info.get('served')]
             )
-            
-            cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
-            full_job_data = cursor.fetchone()
-            
-            conn.commit()
-            return dict(full_job_data)
-        else:
+
+        if not job_ids:
             conn.commit()
-            return None
+            if fired_elsewhere:
+                notify.wake_workers()
+            return []
+
+        now_iso = datetime.now(timezone.utc).isoformat()
+        lease_expires_at = now_timestamp + config.get_config_value('lease_seconds')
+        placeholders = ", ".join("?" for _ in job_ids)
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET state = 'processing', updated_at = ?,
+                worker_id = ?, lease_expires_at = ?
+            WHERE id IN ({placeholders})
+            RETURNING *
+            """,
+            (now_iso, worker_id, lease_expires_at, *job_ids)
+        )
+        claimed = {row['id']: dict(row) for row in cursor.fetchall()}
+        conn.commit()
+        if fired_elsewhere:
+            notify.wake_workers()
+        _jobs_claimed.inc(len(claimed))
+        for job in claimed.values():
+            _queue_wait.observe(max(0.0, now_timestamp - job['next_run_at']))
+        return [claimed[job_id] for job_id in job_ids]
 
     except sqlite3.OperationalError as e:
         print(f"Worker {worker_id}: Database locked, rolling back. {e}")
         conn.rollback()
-        return None
+        return []
     except Exception as e:
         print(f"Worker {worker_id}: Error getting next job: {e}")
         conn.rollback()
-        return None
+        return []
     finally:
-        conn.close()
+        if locked is not None:
+            _claim_query.observe(time.perf_counter() - locked)
 
-def update_job_state(job_id: str, state: str, increment_attempts: bool = False):
+def release_jobs(job_ids):
     """
-    Updates the state and 'updated_at' timestamp of a job.
-    Optionally increments the attempt counter.
+    Hands claimed-but-unstarted jobs back to the queue.
+    A job returns to 'failed' if it has been attempted before, otherwise to
+    'pending'; its 'next_run_at' is kept so it resumes its place in line.
     """
-    conn = database.get_db_connection()
-    cursor = conn.cursor()
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
     now = datetime.now(timezone.utc).isoformat()
 
+    for shard, shard_job_ids in _group_by_shard(job_ids).items():
+        conn = database.get_db_connection(shard)
+        placeholders = ", ".join("?" for _ in shard_job_ids)
+        try:
+            conn.execute(
+                f"""
+                UPDATE jobs
+                SET state = CASE WHEN attempts > 0 THEN 'failed' ELSE 'pending' END,
+                    updated_at = ?, lease_expires_at = NULL
+                WHERE state = 'processing' AND id IN ({placeholders})
+                """,
+                (now, *shard_job_ids)
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"Error releasing jobs {shard_job_ids}: {e}")
+            conn.rollback()
+    notify.wake_workers()
+
+def next_due():
+    """
+    Returns the epoch at which the next job becomes claimable without any
+    new enqueue: the earliest 'failed' retry, 'scheduled' job or schedule
+    run. None if nothing is waiting, across all shards.
+    """
+    try:
+        due = []
+        for _, conn in _shard_connections():
+            row = conn.execute(
+                """
+                SELECT MIN(due) AS due FROM (
+                    SELECT MIN(next_run_at) AS due FROM jobs WHERE state = 'failed'
+                    UNION ALL
+                    SELECT MIN(next_run_at) FROM jobs WHERE state = 'scheduled'
+                    UNION ALL
+                    SELECT MIN(next_run_at) FROM schedules
+                )
+                """
+            ).fetchone()
+            if row and row['due'] is not None:
+                due.append(row['due'])
+        return min(due) if due else None
+    except Exception as e:
+        print(f"Error reading next due time: {e}")
+        return None
+
+_UPDATE_JOB_STATE_SQL = """
+    UPDATE jobs
+    SET state = ?, updated_at = ?, attempts = attempts + ?,
+        next_run_at = CASE WHEN ? = 'failed'
+            THEN ? + POW(?, attempts + ?) ELSE next_run_at END,
+        lease_expires_at = NULL,
+        stdout_path = COALESCE(?, stdout_path),
+        stderr_path = COALESCE(?, stderr_path),
+        stdout_bytes = COALESCE(?, stdout_bytes),
+        stderr_bytes = COALESCE(?, stderr_bytes)
+    WHERE id = ?
+"""
+
+# Same update, applied only while the job is still leased to the given
+# worker, so a late result cannot overwrite a job that was reaped and
+# claimed by someone else.
+_UPDATE_LEASED_JOB_STATE_SQL = _UPDATE_JOB_STATE_SQL.replace(
+    "WHERE id = ?", "WHERE id = ? AND state = 'processing' AND worker_id = ?"
+)
+
+def _transition_params(transitions, worker_id=None):
+    """
+    Builds _UPDATE_JOB_STATE_SQL (or, with worker_id,
+    _UPDATE_LEASED_JOB_STATE_SQL) parameters for (job_id, state,
+    increment_attempts[, output]) tuples, all stamped with the current time.
+    'output' is an optional dict with stdout/stderr paths and byte counts
+    from the run (see executor.OutputCapture.as_dict).
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    now_timestamp = time.time()
+    backoff_base = None
+    params = []
+    for job_id, state, increment_attempts, *rest in transitions:
+        if state == 'failed' and backoff_base is None:
+            backoff_base = config.get_config_value('backoff_base')
+        inc = 1 if increment_attempts else 0
+        output = (rest[0] if rest else None) or {}
+        row = (
+            state, now, inc, state, now_timestamp, backoff_base or 0, inc,
+            output.get('stdout_path'), output.get('stderr_path'),
+            output.get('stdout_bytes'), output.get('stderr_bytes'),
+            job_id
+        )
+        params.append(row + (worker_id,) if worker_id else row)
+    return params
+
+def _transition_sql(worker_id=None):
+    return _UPDATE_LEASED_JOB_STATE_SQL if worker_id else _UPDATE_JOB_STATE_SQL
+
+def update_job_state(job_id: str, state: str, increment_attempts: bool = False,
+                     worker_id: str = None, output: dict = None):
+    """
+    Updates the state and 'updated_at' timestamp of a job and ends its lease.
+    Optionally increments the attempt counter and records where the run's
+    output was captured. With worker_id, the update only applies if that
+    worker still holds the job's lease.
+
+    Moving a job to 'failed' also schedules its retry by setting
+    'next_run_at' to now + backoff_base ** attempts. Completing a job
+    counts down the jobs that depend on it (see _settle_children).
+    """
+    shard = shard_of(job_id)
+    conn = database.get_db_connection(shard)
+    cursor = conn.cursor()
+
     try:
-        if increment_attempts:
+        with _ack_duration.time():
             cursor.execute(
+                _transition_sql(worker_id),
+                _transition_params([(job_id, state, increment_attempts, output)], worker_id)[0]
+            )
+            released, elsewhere = _settle_children(shard, conn, [(job_id, state)])
+            conn.commit()
+    except Exception as e:
+        print(f"Error updating job {job_id}: {e}")
+        conn.rollback()
+        return
+    _finish_ack(released, elsewhere, [job_id] if state == 'dead' else [])
+
+def _finish_ack(released, elsewhere, dead_ids):
+    """
+    After an ack has committed: counts down dependents in other shards,
+    applies 'on_parent_dead' to the jobs that reached the DLQ and wakes
+    the workers if any blocked job was released.
+    """
+    released += _count_down_elsewhere(elsewhere)
+    _settle_dead_parents(dead_ids)
+    if released:
+        notify.wake_workers()
+
+def apply_job_transitions(transitions, worker_id: str = None):
+    """
+    Applies many (job_id, state, increment_attempts[, output]) updates, with the same
+    semantics as update_job_state, in a single transaction (one commit for
+    the whole group). Returns True on success; on failure nothing is
+    written and the caller may retry.
+
+    In a sharded store there is one transaction per shard, and a failure
+    in one shard does not undo the others. Retrying the whole group is
+    still safe with worker_id: the updates already written no longer match
+    a job 'processing' under that worker, so they are skipped.
+
+    The dependents of completed jobs are counted down in the same
+    transaction when they share the parent's shard, and right after it
+    otherwise; a dependent released this way becomes claimable at once.
+    """
+    transitions = list(transitions)
+    if not transitions:
+        return True
+    ok = True
+    released = 0
+    elsewhere = []
+    for shard, shard_transitions in _group_by_shard(transitions, lambda t: t[0]).items():
+        conn = database.get_db_connection(shard)
+        try:
+            with _ack_duration.time():
+                conn.executemany(_transition_sql(worker_id), _transition_params(shard_transitions, worker_id))
+                shard_released, shard_elsewhere = _settle_children(shard, conn, shard_transitions)
+                conn.commit()
+            released += shard_released
+            elsewhere.extend(shard_elsewhere)
+        except Exception as e:
+            print(f"Error applying {len(shard_transitions)} job update(s): {e}")
+            conn.rollback()
+            ok = False
+    _finish_ack(released, elsewhere, [t[0] for t in transitions if t[1] == 'dead'])
+    return ok
+
+def renew_leases(worker_id: str):
+    """
+    Heartbeat: extends the lease on every job currently held by worker_id
+    by 'lease_seconds' from now. Returns the number of leases renewed.
+    """
+    lease_expires_at = time.time() + config.get_config_value('lease_seconds')
+    renewed = 0
+    for _, conn in _shard_connections():
+        try:
+            cursor = conn.execute(
                 """
                 UPDATE jobs
-                SET state = ?, updated_at = ?, attempts = attempts + 1
-                WHERE id = ?
+                SET lease_expires_at = ?
+                WHERE state = 'processing' AND worker_id = ?
                 """,
-                (state, now, job_id)
+                (lease_expires_at, worker_id)
             )
-        else:
-            cursor.execute(
+            conn.commit()
+            renewed += cursor.rowcount
+        except Exception as e:
+            print(f"Worker {worker_id}: Error renewing leases: {e}")
+            conn.rollback()
+    return renewed
+
+def reap_expired_leases():
+    """
+    Takes back 'processing' jobs whose lease has expired, i.e. whose worker
+    stopped heartbeating (killed, OOM, lost host). The interrupted run
+    counts as a failed attempt, so each job goes to 'failed' with the usual
+    backoff, or to 'dead' if it has no retries left.
+    Returns the list of reaped job IDs.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    now_timestamp = time.time()
+    backoff_base = config.get_config_value('backoff_base')
+    reaped = []
+    dead = []
+
+    for _, conn in _shard_connections():
+        try:
+            cursor = conn.execute(
                 """
                 UPDATE jobs
-                SET state = ?, updated_at = ?
-                WHERE id = ?
+                SET state = CASE WHEN attempts + 1 >= max_retries THEN 'dead' ELSE 'failed' END,
+                    attempts = attempts + 1,
+                    updated_at = ?,
+                    next_run_at = ? + POW(?, attempts + 1),
+                    lease_expires_at = NULL
+                WHERE state = 'processing' AND lease_expires_at < ?
+                RETURNING id, state
                 """,
-                (state, now, job_id)
+                (now, now_timestamp, backoff_base, now_timestamp)
             )
-        conn.commit()
+            rows = cursor.fetchall()
+            conn.commit()
+            reaped.extend(row['id'] for row in rows)
+            dead.extend(row['id'] for row in rows if row['state'] == 'dead')
+        except Exception as e:
+            print(f"Error reaping expired leases: {e}")
+            conn.rollback()
+    _settle_dead_parents(dead)
+    if reaped:
+        notify.wake_workers()
+    return reaped
+
+def count_stale_leases():
+    """Returns the number of 'processing' jobs whose lease has expired."""
+    now_timestamp = time.time()
+    try:
+        return sum(
+            conn.execute(
+                "SELECT COUNT(*) AS n FROM jobs WHERE state = 'processing' AND lease_expires_at < ?",
+                (now_timestamp,)
+            ).fetchone()['n']
+            for _, conn in _shard_connections()
+        )
     except Exception as e:
-        print(f"Error updating job {job_id}: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        print(f"Error counting stale leases: {e}")
+        return 0
+
+def get_job(job_id: str):
+    """Returns a job as a dict, or None if it does not exist."""
+    conn = database.get_db_connection(shard_of(job_id))
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
 
 def retry_dead_job(job_id: str):
     """
     Moves a job from the 'dead' state back to 'pending' and resets its attempts.
     """
-    conn = database.get_db_connection()
+    conn = database.get_db_connection(shard_of(job_id))
     cursor = conn.cursor()
     now = datetime.now(timezone.utc).isoformat()
 
@@ -185,10 +1345,10 @@ def retry_dead_job(job_id: str):
         cursor.execute(
             """
             UPDATE jobs
-            SET state = 'pending', attempts = 0, updated_at = ?
+            SET state = 'pending', attempts = 0, updated_at = ?, next_run_at = ?
             WHERE id = ?
             """,
-            (now, job_id)
+            (now, time.time(), job_id)
         )
         conn.commit()
         
@@ -198,36 +1358,499 @@ def retry_dead_job(job_id: str):
     except Exception as e:
         conn.rollback()
         raise e
-    finally:
-        conn.close()
+
+    notify.wake_workers()
 
         
-def get_job_summary():
+# Freed pages handed back to the file system after each gc batch.
+GC_VACUUM_PAGES = 1000
+# Pause between gc batches so waiting workers can take the write lock.
+GC_BATCH_PAUSE = 0.01
+
+_gc_rotation = itertools.count(os.getpid())
+
+def _attach_archive(conn, now):
     """
-    Returns a dictionary with the count of jobs in each state.
+    Attaches today's archive file (~/.queuectl/archive/jobs-YYYY-MM-DD.db)
+    as 'archive', creating or widening its jobs table to match the main
+    one. Returns (path, quoted column list).
     """
-    conn = database.get_db_connection()
-    cursor = conn.cursor()
-    
-    summary = {
+    os.makedirs(database.ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(database.ARCHIVE_DIR, f"jobs-{now:%Y-%m-%d}.db")
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    columns = [row['name'] for row in conn.execute("PRAGMA main.table_info(jobs)")]
+    conn.execute("CREATE TABLE IF NOT EXISTS archive.jobs AS SELECT * FROM main.jobs WHERE 0")
+    existing = {row['name'] for row in conn.execute("PRAGMA archive.table_info(jobs)")}
+    for column in columns:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE archive.jobs ADD COLUMN "{column}"')
+    return path, ", ".join(f'"{column}"' for column in columns)
+
+def gc_finished_jobs(archive: bool = None, batch_size: int = None, max_batches: int = None):
+    """
+    Applies the retention policy: removes 'completed' jobs older than
+    'completed_ttl' seconds and 'dead' and 'cancelled' jobs older than
+    'dead_ttl' seconds (by last update; a TTL of 0 keeps them forever).
+    With archive (default: the 'gc_archive' config), rows are first copied
+    to a dated archive DB. Jobs still blocked on a removed job can never
+    run, so they are cancelled.
+
+    Each removed job's output directory is deleted with it, unless the
+    job was archived and its archived row still points at the files.
+
+    Work is done in short BEGIN IMMEDIATE transactions of 'batch_size' rows
+    found through idx_jobs_finished, each followed by an incremental vacuum
+    and a short pause, so workers are never stalled for long. 'max_batches'
+    bounds the whole pass (workers use 1 for opportunistic collection).
+    Shards are collected in turn, each call starting at the next one.
+
+    Returns a dict with the number of 'completed', 'dead' and 'cancelled'
+    jobs removed and the 'archive' path used, if any.
+    """
+    ttls = {
+        'completed': config.get_config_value('completed_ttl') or 0,
+        'dead': config.get_config_value('dead_ttl') or 0,
+        'cancelled': config.get_config_value('dead_ttl') or 0,
+    }
+    if archive is None:
+        archive = bool(config.get_config_value('gc_archive'))
+    batch_size = max(1, batch_size or config.get_config_value('gc_batch_size'))
+    stats = {'completed': 0, 'dead': 0, 'cancelled': 0, 'archive': None}
+    if all(ttl <= 0 for ttl in ttls.values()):
+        return stats
+
+    now = datetime.now(timezone.utc)
+    batches = 0
+    count = shard_count()
+    start = next(_gc_rotation) % count
+    for shard in [(start + offset) % count for offset in range(count)]:
+        if max_batches is not None and batches >= max_batches:
+            break
+        conn = database.get_db_connection(shard)
+        columns = None
+        try:
+            if archive:
+                stats['archive'], columns = _attach_archive(conn, now)
+
+            for state, ttl in ttls.items():
+                if ttl <= 0:
+                    continue
+                cutoff = (now - timedelta(seconds=ttl)).isoformat()
+                while max_batches is None or batches < max_batches:
+                    orphans = []
+                    conn.execute("BEGIN IMMEDIATE TRANSACTION")
+                    try:
+                        rows = conn.execute(
+                            """
+                            SELECT id, stdout_path, stderr_path FROM jobs
+                            WHERE state = ? AND updated_at < ?
+                            ORDER BY updated_at
+                            LIMIT ?
+                            """,
+                            (state, cutoff, batch_size)
+                        ).fetchall()
+                        job_ids = [row['id'] for row in rows]
+                        if job_ids:
+                            placeholders = ", ".join("?" for _ in job_ids)
+                            if archive:
+                                conn.execute(
+                                    f"INSERT INTO archive.jobs ({columns}) "
+                                    f"SELECT {columns} FROM main.jobs WHERE id IN ({placeholders})",
+                                    job_ids
+                                )
+                            conn.execute(f"DELETE FROM main.jobs WHERE id IN ({placeholders})", job_ids)
+                            # Completed jobs have no edges left (see _settle_children).
+                            if state != 'completed':
+                                orphans = [row['child_id'] for row in conn.execute(
+                                    f"DELETE FROM job_deps WHERE parent_id IN ({placeholders}) RETURNING child_id",
+                                    job_ids
+                                )]
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+
+                    if not job_ids:
+                        break
+                    for row in rows:
+                        if not (archive and (row['stdout_path'] or row['stderr_path'])):
+                            shutil.rmtree(
+                                executor.output_directory(database.OUTPUT_DIR, row['id']), ignore_errors=True
+                            )
+                    if orphans:
+                        _cancel_dependents([], orphans)
+                    stats[state] += len(job_ids)
+                    batches += 1
+                    # executescript steps the pragma to completion; execute() would
+                    # free a single page.
+                    conn.executescript(f"PRAGMA main.incremental_vacuum({GC_VACUUM_PAGES})")
+                    time.sleep(GC_BATCH_PAUSE)
+        finally:
+            if columns is not None:
+                conn.execute("DETACH DATABASE archive")
+    return stats
+
+def recount_jobs():
+    """
+    Rebuilds the job_counts table of every shard from a full scan of
+    'jobs'. Only needed if the counters were damaged, e.g. by edits made
+    with triggers disabled.
+
+    Also repairs job dependencies (see _repair_dependencies).
+    """
+    for _, conn in _shard_connections():
+        conn.execute("BEGIN IMMEDIATE TRANSACTION")
+        try:
+            database.rebuild_job_counts(conn.cursor())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _repair_dependencies()
+
+def _repair_dependencies():
+    """
+    Recomputes pending_deps of every 'blocked' job from the job_deps edges
+    left in all shards and releases the jobs that have none. This catches
+    up with a count-down lost when a process died between a parent's ack
+    and the update of a child in another shard. With 'on_parent_dead' set
+    to 'cancel', the dependents of dead jobs are cancelled first. Meant to
+    run with workers stopped, as the shards are read one after another.
+    """
+    if config.get_config_value('on_parent_dead') != 'hold':
+        dead = []
+        for _, conn in _shard_connections():
+            dead.extend(row['parent_id'] for row in conn.execute(
+                """
+                SELECT DISTINCT parent_id FROM job_deps
+                JOIN jobs ON jobs.id = job_deps.parent_id
+                WHERE jobs.state IN ('dead', 'cancelled')
+                """
+            ))
+        _cancel_dependents(dead)
+
+    remaining = {}
+    released = 0
+    for _, conn in _shard_connections():
+        for row in conn.execute("SELECT child_id, COUNT(*) AS edges FROM job_deps GROUP BY child_id"):
+            remaining[row['child_id']] = remaining.get(row['child_id'], 0) + row['edges']
+    for _, conn in _shard_connections():
+        conn.execute("BEGIN IMMEDIATE TRANSACTION")
+        try:
+            blocked = [(remaining.get(row['id'], 0), row['id']) for row in conn.execute(
+                "SELECT id FROM jobs WHERE state = 'blocked'"
+            )]
+            conn.executemany("UPDATE jobs SET pending_deps = ? WHERE id = ?", blocked)
+            released += _release_ready(conn, [job_id for edges, job_id in blocked if not edges])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if released:
+        notify.wake_workers()
+
+# Jobs read per step when moving jobs between shards.
+MIGRATE_BATCH_SIZE = 1000
+
+def _shard_files_on_disk():
+    """Returns the highest shard number + 1 among queue-N.db files present."""
+    try:
+        names = os.listdir(database.APP_DIR)
+    except OSError:
+        return 1
+    numbers = [int(match.group(1)) for match in map(re.compile(r'queue-(\d+)\.db').fullmatch, names) if match]
+    return max(numbers, default=0) + 1
+
+def migrate_shards(shards: int, progress=None):
+    """
+    Reshards the job store to 'shards' files: creates the missing shard
+    files, copies tenant settings to them and moves every job (and
+    dependency edge) whose shard changes, in batches (copied with INSERT
+    OR IGNORE and committed before the source rows are deleted). The new
+    count is recorded last, and files beyond it are then removed, so an
+    interrupted run is finished by running it again. Workers must be
+    stopped. 'progress' is an optional
+    callback(jobs moved so far).
+
+    Returns the number of jobs moved.
+    """
+    if shards < 1:
+        raise ValueError("'shards' must be at least 1.")
+    sources = max(shard_count(), shards, _shard_files_on_disk())
+    for shard in range(1, shards):
+        database.init_shard(shard)
+
+    settings = database.get_db_connection().execute(
+        "SELECT name, weight, max_concurrency FROM tenants"
+    ).fetchall()
+    for shard in range(1, shards):
+        conn = database.get_db_connection(shard)
+        conn.executemany(
+            """
+            INSERT INTO tenants (name, weight, max_concurrency) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                weight = excluded.weight, max_concurrency = excluded.max_concurrency
+            """,
+            [tuple(row) for row in settings]
+        )
+        conn.commit()
+
+    moved = 0
+    for source in range(sources):
+        if source and not os.path.exists(database.shard_path(source)):
+            continue
+        if source >= shards:
+            database.init_shard(source)
+        conn = database.get_db_connection(source)
+        last_rowid = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid AS _rowid, * FROM jobs WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, MIGRATE_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1]['_rowid']
+            by_target = {}
+            for row in rows:
+                target = shard_of(row['id'], shards)
+                if target != source:
+                    by_target.setdefault(target, []).append(row)
+            if not by_target:
+                continue
+
+            columns = [name for name in rows[0].keys() if name != '_rowid']
+            column_list = ", ".join(f'"{name}"' for name in columns)
+            placeholders = ", ".join("?" for _ in columns)
+            job_ids = []
+            for target, target_rows in by_target.items():
+                target_conn = database.get_db_connection(target)
+                target_conn.executemany(
+                    f"INSERT OR IGNORE INTO jobs ({column_list}) VALUES ({placeholders})",
+                    [tuple(row[name] for name in columns) for row in target_rows]
+                )
+                target_conn.commit()
+                job_ids.extend(row['id'] for row in target_rows)
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({', '.join('?' for _ in job_ids)})", job_ids)
+            conn.commit()
+            moved += len(job_ids)
+            if progress:
+                progress(moved)
+
+        # Dependency edges follow their parent.
+        last_rowid = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid AS _rowid, parent_id, child_id FROM job_deps WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, MIGRATE_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1]['_rowid']
+            by_target = {}
+            for row in rows:
+                target = shard_of(row['parent_id'], shards)
+                if target != source:
+                    by_target.setdefault(target, []).append((row['parent_id'], row['child_id']))
+            for target, edges in by_target.items():
+                target_conn = database.get_db_connection(target)
+                target_conn.executemany("INSERT OR IGNORE INTO job_deps (parent_id, child_id) VALUES (?, ?)", edges)
+                target_conn.commit()
+                conn.executemany("DELETE FROM job_deps WHERE parent_id = ? AND child_id = ?", edges)
+            conn.commit()
+
+    config.set_config_value('shards', shards)
+    # Everything past the new count has been moved out.
+    database.close_db_connection()
+    for shard in range(shards, sources):
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.unlink(database.shard_path(shard) + suffix)
+            except FileNotFoundError:
+                pass
+    return moved
+
+def shard_stats():
+    """Returns, per shard, its file, size in bytes and job count."""
+    stats = []
+    for shard, conn in _shard_connections():
+        path = database.shard_path(shard)
+        row = conn.execute("SELECT COALESCE(SUM(count), 0) AS jobs FROM job_counts").fetchone()
+        size = sum(
+            os.path.getsize(path + suffix)
+            for suffix in ('', '-wal') if os.path.exists(path + suffix)
+        )
+        stats.append({'shard': shard, 'path': path, 'bytes': size, 'jobs': row['jobs']})
+    return stats
+
+def _empty_summary():
+    return {
+        'scheduled': 0,
+        'blocked': 0,
         'pending': 0,
         'processing': 0,
         'completed': 0,
         'failed': 0,
         'dead': 0,
+        'cancelled': 0,
         'total': 0,
     }
+
+def get_job_summary(queue: str = None):
+    """
+    Returns a dictionary with the count of jobs in each state, across all
+    queues or for one queue.
+    """
+    summaries = get_queue_summaries()
+    if queue is not None:
+        return summaries.get(queue, _empty_summary())
+    summary = _empty_summary()
+    for queue_summary in summaries.values():
+        for key, count in queue_summary.items():
+            summary[key] += count
+    return summary
+
+def get_queue_summaries():
+    """
+    Returns {queue: summary} with the count of jobs in each state per queue,
+    for every queue that has (or had) jobs, summed over all shards.
+    """
+    summaries = {}
     
     try:
-        cursor.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
-        rows = cursor.fetchall()
-        for row in rows:
-            if row['state'] in summary:
-                summary[row['state']] = row['COUNT(*)']
-            summary['total'] += row['COUNT(*)']
-        return summary
+        for _, conn in _shard_connections():
+            # Maintained by triggers on 'jobs', so this reads a handful of rows.
+            rows = conn.execute(
+                "SELECT queue, state, SUM(count) AS count FROM job_counts GROUP BY queue, state ORDER BY queue"
+            ).fetchall()
+            for row in rows:
+                summary = summaries.setdefault(row['queue'], _empty_summary())
+                if row['state'] in summary:
+                    summary[row['state']] += row['count']
+                summary['total'] += row['count']
+        return dict(sorted(summaries.items()))
     except Exception as e:
         print(f"Error getting job summary: {e}")
-        return summary
-    finally:
-        conn.close()
\ No newline at end of file
+        return summaries
+
+def set_tenant(name: str, weight: float = None, max_concurrency: int = None):
+    """
+    Creates or updates a tenant's fair-share settings. 'weight' is its
+    relative share of workers (default 1); 'max_concurrency' caps how many
+    of its jobs may be 'processing' at once (0 = no cap).
+
+    Every shard claims with its own copy of the settings, so they are
+    written to all of them.
+    """
+    if weight is not None and weight <= 0:
+        raise ValueError("'weight' must be greater than 0.")
+    if max_concurrency is not None and max_concurrency < 0:
+        raise ValueError("'max_concurrency' must be 0 (no cap) or more.")
+
+    for _, conn in _shard_connections():
+        try:
+            conn.execute(
+                """
+                INSERT INTO tenants (name, weight, max_concurrency) VALUES (?, COALESCE(?, 1), COALESCE(?, 0))
+                ON CONFLICT (name) DO UPDATE SET
+                    weight = COALESCE(?, weight),
+                    max_concurrency = COALESCE(?, max_concurrency)
+                """,
+                (name, weight, max_concurrency, weight, max_concurrency)
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    notify.wake_workers()
+
+def list_tenants():
+    """
+    Returns every known tenant (configured or with jobs) as a dict with its
+    weight, max_concurrency and pending/processing job counts.
+    """
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    tenants = {}
+    cursor.execute("SELECT name, weight, max_concurrency FROM tenants")
+    for row in cursor.fetchall():
+        tenants[row['name']] = {
+            'name': row['name'],
+            'weight': row['weight'],
+            'max_concurrency': row['max_concurrency'],
+            'pending': 0,
+            'processing': 0,
+        }
+    rows = []
+    for _, shard_conn in _shard_connections():
+        rows.extend(shard_conn.execute(
+            """
+            SELECT tenant, state, SUM(count) AS count FROM job_counts
+            WHERE state IN ('pending', 'failed', 'processing')
+            GROUP BY tenant, state
+            """
+        ).fetchall())
+    for row in rows:
+        tenant = tenants.setdefault(row['tenant'], {
+            'name': row['tenant'],
+            'weight': 1.0,
+            'max_concurrency': 0,
+            'pending': 0,
+            'processing': 0,
+        })
+        tenant['processing' if row['state'] == 'processing' else 'pending'] += row['count']
+    return [tenants[name] for name in sorted(tenants)]
+
+def add_schedule(name: str, cron_expression: str, job_data: dict):
+    """
+    Creates or replaces a recurring schedule. 'job_data' is a job
+    definition without 'id' (each run gets '<name>-<epoch>'); it is
+    validated now, like an enqueued job. Returns the first run's epoch.
+    """
+    if not isinstance(job_data, dict):
+        raise ValueError("Job data must be a JSON object")
+    for key in ('id', 'run_at', 'delay_seconds'):
+        if key in job_data:
+            raise ValueError(f"A schedule's job must not set '{key}'")
+    expression = cron.CronExpression(cron_expression)
+    _job_row(dict(job_data, id=f"{name}-0"), config.get_config_value('max_retries'))
+    next_run_at = expression.next_timestamp(time.time())
+
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO schedules (name, cron, job, next_run_at, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                cron = excluded.cron, job = excluded.job, next_run_at = excluded.next_run_at
+            """,
+            (name, expression.expression, json.dumps(job_data), next_run_at,
+             datetime.now(timezone.utc).isoformat())
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    notify.wake_workers()
+    return next_run_at
+
+def list_schedules():
+    """Returns every schedule as a dict, soonest first."""
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM schedules ORDER BY next_run_at, name")
+    return [dict(row) for row in cursor.fetchall()]
+
+def remove_schedule(name: str):
+    """Deletes a schedule. Jobs it already created are left alone."""
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM schedules WHERE name = ?", (name,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    if cursor.rowcount == 0:
+        raise ValueError(f"Schedule '{name}' not found.")
@@ -0,0 +1,122 @@
+"""Wakeup notifications for idle workers.
+
+Each worker binds a Unix datagram socket under ~/.queuectl/wakeup/ while it
+runs. Anything that makes work available (enqueue, DLQ retry, released jobs)
+calls wake_workers(), which sends a one-byte datagram to every socket there,
+so idle workers pick up new jobs without waiting for their next poll.
+Delivery is best effort: workers still poll the database as a fallback.
+"""
+import os
+import select
+import socket
+from . import database
+
+
+# Listeners of this process that must not hear its own wake_workers() calls.
+_deaf_to_own = set()
+
+def _wakeup_dir():
+    return os.path.join(database.APP_DIR, 'wakeup')
+
+def wake_workers():
+    """
+    Nudges every listening worker. Never raises; stale sockets left behind
+    by dead workers are removed.
+    """
+    wakeup_dir = _wakeup_dir()
+    try:
+        names = os.listdir(wakeup_dir)
+    except OSError:
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for name in names:
+            if not name.endswith('.sock'):
+                continue
+            path = os.path.join(wakeup_dir, name)
+            if path in _deaf_to_own:
+                continue
+            try:
+                sock.sendto(b'1', path)
+            except BlockingIOError:
+                # Receiver already has wakeups queued.
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+    finally:
+        sock.close()
+
+
+class WakeupListener:
+    """
+    The receiving end used by a worker. wait() returns early when another
+    process calls wake_workers() or this process calls wake() (for example
+    from a thread that just finished a job). With own_wakeups=False the
+    wake_workers() calls of this process are not delivered to it.
+    """
+    def __init__(self, name, own_wakeups=True):
+        self.path = os.path.join(_wakeup_dir(), f"{name}.sock")
+        self._self_r, self._self_w = socket.socketpair()
+        self._self_r.setblocking(False)
+        self._self_w.setblocking(False)
+        self.sock = None
+        try:
+            os.makedirs(_wakeup_dir(), exist_ok=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind(self.path)
+            self.sock = sock
+            if not own_wakeups:
+                _deaf_to_own.add(self.path)
+        except OSError as e:
+            print(f"Wakeup socket unavailable ({e}); falling back to polling.")
+
+    def wake(self):
+        """Wakes this listener from within the same process. Thread-safe."""
+        try:
+            self._self_w.send(b'1')
+        except OSError:
+            pass
+
+    def wait(self, timeout):
+        """
+        Blocks for up to 'timeout' seconds. Returns True if woken by a
+        notification, False on timeout.
+        """
+        sockets = [s for s in (self.sock, self._self_r) if s is not None]
+        try:
+            readable, _, _ = select.select(sockets, [], [], max(0, timeout))
+        except InterruptedError:
+            return True
+        for s in readable:
+            # Coalesce everything queued so far into this one wakeup.
+            try:
+                while s.recv(64):
+                    pass
+            except OSError:
+                pass
+        return bool(readable)
+
+    def drain(self):
+        """Consumes queued notifications without blocking; True if there were any."""
+        return self.wait(0)
+
+    def close(self):
+        _deaf_to_own.discard(self.path)
+        for s in (self.sock, self._self_r, self._self_w):
+            if s is not None:
+                s.close()
+        if self.sock is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.sock = None
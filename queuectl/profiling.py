@@ -0,0 +1,220 @@
+"""Opt-in sampling profiler for worker processes.
+
+A daemon thread wakes every 'profile_interval_ms', walks the current stack
+of every other thread (sys._current_frames) and counts each distinct stack.
+This needs no tracing hooks, so jobs run at full speed between samples,
+and it covers the main loop (claims, acks, SQLite), the job threads
+(process spawning) and idle waiting alike.
+
+Each profiled worker rewrites ~/.queuectl/profiles/<worker_id>.json with
+its cumulative counts every 'profile_dump_interval' seconds, on SIGUSR1
+and at exit. 'queuectl profile report' merges the dumps.
+"""
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from . import database
+
+# Deepest stack recorded per sample; deeper frames are dropped at the root.
+MAX_DEPTH = 64
+
+# Leaf frames where a thread is just waiting for work: an idle job thread
+# and the main loop's wakeup wait. Samples ending in one count as idle.
+IDLE_FRAMES = (
+    ('concurrent/futures/thread.py', '_worker'),
+    ('queuectl/notify.py', 'wait'),
+)
+
+
+def profiles_dir():
+    return os.path.join(database.APP_DIR, 'profiles')
+
+def _frame_label(code):
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+class Sampler:
+    """
+    Samples every thread of this process. Stacks are stored root first as
+    ';'-joined frame labels under a '[thread]' root, the folded format
+    flame graph tools read.
+    """
+    def __init__(self, worker_id, interval=0.01, dump_interval=60):
+        self.worker_id = worker_id
+        self.interval = max(0.001, interval)
+        self.dump_interval = dump_interval
+        self.stacks = {}
+        self.samples = 0
+        self.started_at = None
+        self._stop = threading.Event()
+        self._dump_requested = threading.Event()
+        self._thread = None
+
+    def _thread_label(self, thread):
+        if thread is None:
+            return 'unknown'
+        # Job threads are named '<worker_id>_<n>'; fold them together.
+        if thread.name.startswith(self.worker_id):
+            return 'job'
+        # Unnamed helper threads, e.g. 'Thread-7 (_drain)': keep the target.
+        match = re.fullmatch(r'Thread-\d+(?: \((.*)\))?', thread.name)
+        if match:
+            return match.group(1) or 'thread'
+        return thread.name
+
+    def sample(self):
+        """Records the current stack of every thread except the sampler."""
+        own_id = threading.get_ident()
+        threads = {t.ident: t for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(f"[{self._thread_label(threads.get(thread_id))}]")
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def dump(self):
+        """Writes the counts so far to the profiles directory (atomically)."""
+        directory = profiles_dir()
+        path = os.path.join(directory, f"{self.worker_id}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'worker_id': self.worker_id,
+                    'pid': os.getpid(),
+                    'interval': self.interval,
+                    'started_at': self.started_at,
+                    'updated_at': time.time(),
+                    'samples': self.samples,
+                    'stacks': dict(self.stacks),
+                }, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing profile for {self.worker_id}: {e}")
+
+    def request_dump(self, signum=None, frame=None):
+        """Asks the sampler thread to dump on its next tick (signal-safe)."""
+        self._dump_requested.set()
+
+    def _run(self):
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if self._dump_requested.is_set() or (self.dump_interval and time.monotonic() >= next_dump):
+                self._dump_requested.clear()
+                self.dump()
+                next_dump = time.monotonic() + self.dump_interval
+
+    def start(self):
+        """
+        Starts sampling. Call from the main thread, which also installs the
+        SIGUSR1 handler for on-demand dumps.
+        """
+        self.started_at = time.time()
+        signal.signal(signal.SIGUSR1, self.request_dump)
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        print(f"Worker {self.worker_id} profiling every {self.interval * 1000:g}ms "
+              f"(send SIGUSR1 to PID {os.getpid()} to dump).")
+
+    def stop(self):
+        """Stops sampling and writes the final dump."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dump()
+
+
+def load_profiles(worker_id=None):
+    """Returns every profile dump (or just 'worker_id's), oldest first."""
+    profiles = []
+    try:
+        names = os.listdir(profiles_dir())
+    except OSError:
+        return profiles
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        if worker_id and name != f"{worker_id}.json":
+            continue
+        try:
+            with open(os.path.join(profiles_dir(), name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda p: p.get('started_at') or 0)
+    return profiles
+
+def merge_stacks(profiles):
+    """Adds up the stack counts of several dumps."""
+    merged = {}
+    for profile in profiles:
+        for stack, count in profile['stacks'].items():
+            merged[stack] = merged.get(stack, 0) + count
+    return merged
+
+def is_idle(stack):
+    """True if the stack's leaf frame is one of IDLE_FRAMES."""
+    path, _, rest = stack.rsplit(';', 1)[-1].rpartition(':')
+    function = rest.partition('(')[2].rstrip(')')
+    return any(path.endswith(suffix) and function == name for suffix, name in IDLE_FRAMES)
+
+def rank_functions(stacks, thread=None, include_idle=False):
+    """
+    Returns (rows, total, idle) where rows are (label, self, total) sample
+    counts per function, hottest self time first, and 'idle' the samples
+    left out as idle (unless include_idle). A function that appears
+    several times in one stack (recursion) counts once toward its total.
+    'thread' limits the ranking to one '[thread]' root.
+    """
+    self_counts = {}
+    total_counts = {}
+    total = 0
+    idle = 0
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        if thread and frames[0] != f"[{thread}]":
+            continue
+        if not include_idle and is_idle(stack):
+            idle += count
+            continue
+        total += count
+        frames = frames[1:]
+        if not frames:
+            continue
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        for label in set(frames):
+            total_counts[label] = total_counts.get(label, 0) + count
+    rows = [(label, self_counts.get(label, 0), cumulative) for label, cumulative in total_counts.items()]
+    rows.sort(key=lambda row: (row[1], row[2]), reverse=True)
+    return rows, total, idle
+
+def thread_totals(stacks):
+    """Returns {thread label: samples}."""
+    totals = {}
+    for stack, count in stacks.items():
+        thread = stack.split(';', 1)[0].strip('[]')
+        totals[thread] = totals.get(thread, 0) + count
+    return totals
+
+def clear_profiles():
+    """Deletes every dump; returns how many were removed."""
+    removed = 0
+    for profile in load_profiles():
+        try:
+            os.unlink(os.path.join(profiles_dir(), f"{profile['worker_id']}.json"))
+            removed += 1
+        except OSError:
+            pass
+    return removed
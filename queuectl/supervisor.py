@@ -0,0 +1,305 @@
+"""Supervisor for a pool of worker processes.
+
+Started by 'queuectl worker start --min N --max M' as
+'python -m queuectl.supervisor'. The supervisor owns its workers: it
+restarts the ones that die (backing off if they keep crashing), resizes
+the pool between --min and --max from the queue backlog and the recent
+claim (queue) wait, and on SIGTERM drains every worker before exiting.
+
+Scaling uses hysteresis so the pool does not flap: it grows only after
+SCALE_UP_CHECKS consecutive busy checks, by half its size at a time, and
+shrinks one worker at a time only after the backlog has been empty for
+SCALE_DOWN_IDLE seconds. Any resize starts a SCALE_COOLDOWN.
+"""
+import argparse
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from . import broker
+from . import database
+from . import metrics
+from . import models
+
+# Seconds between checks; workers refresh their metrics this often.
+CHECK_INTERVAL = metrics.DUMP_INTERVAL
+# Busy: more ready jobs than this per job slot, or a p90 queue wait above
+# SCALE_UP_WAIT seconds since the last check while jobs are still waiting
+# (a drained queue's past waits are no reason to add workers).
+SCALE_UP_BACKLOG = 2
+SCALE_UP_WAIT = 1.0
+SCALE_UP_CHECKS = 2
+SCALE_DOWN_IDLE = 60
+SCALE_COOLDOWN = 15
+# A worker that exits within CRASH_WINDOW seconds of starting doubles the
+# restart delay, up to MAX_RESTART_DELAY.
+CRASH_WINDOW = 10
+MAX_RESTART_DELAY = 60
+
+
+def state_path():
+    return os.path.join(database.APP_DIR, 'supervisor.json')
+
+def read_state():
+    """Returns the running supervisor's last published state, or None."""
+    try:
+        with open(state_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Child:
+    def __init__(self, proc, slot):
+        self.proc = proc
+        self.slot = slot
+        self.started = time.monotonic()
+        self.draining = False
+
+
+class Supervisor:
+    """
+    Keeps between 'min_workers' and 'max_workers' workers running, each
+    started as 'python -m queuectl.worker_launcher <worker_args>'. With a
+    'metrics_port', the worker in slot N serves metrics on that port + N.
+    """
+    def __init__(self, min_workers, max_workers, worker_args=(), concurrency=1, queues=None,
+                 metrics_port=None):
+        self.min_workers = max(0, min_workers)
+        self.max_workers = max(self.min_workers, max_workers, 1)
+        self.worker_args = list(worker_args)
+        self.concurrency = max(1, concurrency)
+        self.queues = queues
+        self.metrics_port = metrics_port
+        self.target = self.min_workers
+        self.children = []
+        self.running = True
+        self.restarts = 0
+        self.restart_delay = 0
+        self.restart_at = 0
+        self.busy_checks = 0
+        self.idle_since = None
+        self.last_scale = 0
+        self.wait_counts = {}
+
+    def log(self, message):
+        print(f"[supervisor {os.getpid()}] {message}")
+
+    def handle_shutdown(self, signum, frame):
+        if self.running:
+            self.log(f"Received signal {signum}. Draining workers...")
+        self.running = False
+
+    def active(self):
+        return [child for child in self.children if not child.draining]
+
+    def spawn(self):
+        used = {child.slot for child in self.children}
+        slot = next(n for n in range(len(used) + 1) if n not in used)
+        cmd = [sys.executable, '-m', 'queuectl.worker_launcher'] + self.worker_args
+        if self.metrics_port:
+            cmd += ['--metrics-port', str(self.metrics_port + slot)]
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, close_fds=True)
+        except OSError as e:
+            self.log(f"Error starting worker: {e}")
+            return
+        self.children.append(Child(proc, slot))
+        self.log(f"Started worker PID {proc.pid} (slot {slot}).")
+
+    def retire(self, child):
+        """Asks a worker to finish its in-flight jobs and exit."""
+        child.draining = True
+        try:
+            child.proc.send_signal(signal.SIGTERM)
+        except OSError:
+            pass
+
+    def reap(self):
+        """Forgets workers that exited; schedules restarts for crashed ones."""
+        now = time.monotonic()
+        for child in list(self.children):
+            code = child.proc.poll()
+            if code is None:
+                continue
+            self.children.remove(child)
+            if child.draining:
+                self.log(f"Worker PID {child.proc.pid} drained and exited.")
+                continue
+            self.restarts += 1
+            if now - child.started < CRASH_WINDOW:
+                self.restart_delay = min(max(1, self.restart_delay * 2), MAX_RESTART_DELAY)
+            else:
+                self.restart_delay = 0
+            self.restart_at = now + self.restart_delay
+            self.log(f"Worker PID {child.proc.pid} died (exit code {code}); "
+                     f"restarting in {self.restart_delay}s.")
+
+    def backlog(self):
+        """Ready jobs waiting in the queues this pool serves."""
+        if not self.queues:
+            return models.get_job_summary()['pending']
+        summaries = models.get_queue_summaries()
+        return sum(summaries[name]['pending'] for name in self.queues if name in summaries)
+
+    def recent_queue_wait(self):
+        """
+        p90 queue wait (seconds) over the claims since the last check. With
+        a broker running, claims (and their metrics) happen in the broker.
+        """
+        pids = {child.proc.pid for child in self.children}
+        window = None
+        counts = {}
+        for dump in metrics.load_dumps():
+            data = dump['metrics'].get('queue_wait_seconds')
+            if (dump['pid'] not in pids and dump['worker_id'] != broker.METRICS_NAME) or data is None:
+                continue
+            previous = self.wait_counts.get(dump['worker_id'], [0] * len(data['counts']))
+            counts[dump['worker_id']] = data['counts']
+            delta = [after - before for after, before in zip(data['counts'], previous)]
+            window = delta if window is None else [a + b for a, b in zip(window, delta)]
+        self.wait_counts = counts
+        if not window or not sum(window):
+            return 0.0
+        # quantile() caps at 'max'; the window has no max of its own.
+        return metrics.quantile({'counts': window, 'count': sum(window), 'max': math.inf}, 0.9)
+
+    def autoscale(self):
+        """Moves the target size toward the load, with hysteresis."""
+        now = time.monotonic()
+        try:
+            backlog = self.backlog()
+        except Exception as e:
+            self.log(f"Error reading backlog: {e}")
+            return
+        wait = self.recent_queue_wait()
+        slots = len(self.active()) * self.concurrency
+        if backlog > slots * SCALE_UP_BACKLOG or (backlog > 0 and wait > SCALE_UP_WAIT):
+            self.busy_checks += 1
+            self.idle_since = None
+        else:
+            self.busy_checks = 0
+            if backlog:
+                self.idle_since = None
+            elif self.idle_since is None:
+                self.idle_since = now
+
+        if now - self.last_scale < SCALE_COOLDOWN:
+            return
+        if self.busy_checks >= SCALE_UP_CHECKS and self.target < self.max_workers:
+            self.target = min(self.max_workers, self.target + max(1, self.target // 2))
+            self.log(f"Scaling up to {self.target} worker(s) (backlog {backlog}, p90 wait {wait:.3f}s).")
+        elif (self.idle_since is not None and now - self.idle_since >= SCALE_DOWN_IDLE
+              and self.target > self.min_workers):
+            self.target -= 1
+            self.idle_since = now
+            self.log(f"Scaling down to {self.target} worker(s) (queue idle).")
+        else:
+            return
+        self.busy_checks = 0
+        self.last_scale = now
+
+    def resize(self):
+        """Starts or retires workers until the pool matches the target."""
+        active = self.active()
+        if len(active) > self.target:
+            # Newest first: the oldest workers have warm callable pools.
+            for child in active[self.target:]:
+                self.retire(child)
+        elif len(active) < self.target and time.monotonic() >= self.restart_at:
+            for _ in range(self.target - len(active)):
+                self.spawn()
+
+    def write_state(self):
+        state = {
+            'pid': os.getpid(),
+            'min': self.min_workers,
+            'max': self.max_workers,
+            'target': self.target,
+            'workers': [child.proc.pid for child in self.active()],
+            'draining': [child.proc.pid for child in self.children if child.draining],
+            'restarts': self.restarts,
+            'updated_at': time.time(),
+        }
+        tmp_path = f"{state_path()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, state_path())
+        except OSError as e:
+            self.log(f"Error writing state: {e}")
+
+    def sleep(self, seconds):
+        """Sleeps in short steps so shutdown signals are acted on quickly."""
+        deadline = time.monotonic() + seconds
+        while self.running and time.monotonic() < deadline:
+            time.sleep(min(0.2, max(0, deadline - time.monotonic())))
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_shutdown)
+        signal.signal(signal.SIGINT, self.handle_shutdown)
+        self.log(f"Supervising {self.min_workers}-{self.max_workers} worker(s).")
+        next_check = time.monotonic() + CHECK_INTERVAL
+        while self.running:
+            self.reap()
+            if time.monotonic() >= next_check:
+                self.autoscale()
+                next_check = time.monotonic() + CHECK_INTERVAL
+            self.resize()
+            self.write_state()
+            self.sleep(1)
+
+        for child in self.active():
+            self.retire(child)
+        while self.children:
+            self.reap()
+            self.write_state()
+            time.sleep(0.2)
+        try:
+            os.unlink(state_path())
+        except OSError:
+            pass
+        self.log("All workers drained; exiting.")
+
+
+def run_supervisor(min_workers, max_workers, worker_args, concurrency=1, queues=None, metrics_port=None):
+    """Entry point of the detached supervisor process; logs to LOG_FILE."""
+    try:
+        os.makedirs(database.APP_DIR, exist_ok=True)
+        log_f = open(database.LOG_FILE, 'a', buffering=1)
+        sys.stdout = log_f
+        sys.stderr = log_f
+        print(f"\n--- Starting supervisor at {datetime.now(timezone.utc).isoformat()} ---")
+    except Exception as e:
+        print(f"Failed to open log file: {e}", file=sys.__stderr__)
+        return
+    try:
+        Supervisor(min_workers, max_workers, worker_args, concurrency, queues, metrics_port).run()
+    finally:
+        database.close_db_connection()
+        log_f.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='queuectl.supervisor')
+    parser.add_argument('--min', type=int, default=1)
+    parser.add_argument('--max', type=int, required=True)
+    parser.add_argument('--metrics-port', type=int, default=None)
+    # Everything after '--' is passed to each worker_launcher unchanged.
+    parser.add_argument('worker_args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    worker_args = args.worker_args[1:] if args.worker_args[:1] == ['--'] else args.worker_args
+    worker_parser = argparse.ArgumentParser(add_help=False)
+    worker_parser.add_argument('--concurrency', type=int, default=1)
+    worker_parser.add_argument('--queues', default=None)
+    known, _ = worker_parser.parse_known_args(worker_args)
+    run_supervisor(
+        args.min, args.max, worker_args,
+        concurrency=known.concurrency,
+        queues=known.queues.split(',') if known.queues else None,
+        metrics_port=args.metrics_port,
+    )
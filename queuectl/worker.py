@@ -1,15 +1,110 @@
 import time
 import signal
-from . import models
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import client
 from . import executor
+from . import notify
+from . import config
+from . import database
+from . import metrics
+
+# Fallback polling interval while idle: starts short and doubles on every
+# empty poll up to the max. Wakeup notifications cut the wait short.
+IDLE_POLL_MIN = 0.25
+IDLE_POLL_MAX = 5.0
+
+_jobs_finished = {
+    state: metrics.counter(f'jobs_{state}_total', f"Jobs that ended a run as '{state}'.")
+    for state in ('completed', 'failed', 'dead')
+}
+
+class AckBatcher:
+    """
+    Collects job state transitions (completed, failed, dead) and writes
+    them in one transaction once 'max_batch' are queued or the oldest has
+    waited 'max_delay_ms', whichever comes first. 'backend' is the models
+    module or a client.BrokerClient.
+
+    With max_batch=1 every ack is written immediately. Larger batches trade
+    durability for throughput: acks still in memory when the process dies
+    are lost, and those jobs stay 'processing' and may run again.
+    """
+    def __init__(self, worker_id, backend, max_batch=1, max_delay_ms=50):
+        self.worker_id = worker_id
+        self.backend = backend
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0, max_delay_ms) / 1000
+        self.pending = []
+        self.first_queued_at = None
+
+    def add(self, job_id, state, increment_attempts=False, output=None):
+        if not self.pending:
+            self.first_queued_at = time.monotonic()
+        self.pending.append((job_id, state, increment_attempts, output))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+
+    def time_until_flush(self):
+        """Seconds until the queued acks are due, or None if there are none."""
+        if not self.pending:
+            return None
+        return max(0, self.first_queued_at + self.max_delay - time.monotonic())
+
+    def flush_if_due(self):
+        if self.time_until_flush() == 0:
+            self.flush()
+
+    def flush(self):
+        """Writes every queued ack; they are kept for the next try on error."""
+        if self.pending and self.backend.apply_job_transitions(self.pending, worker_id=self.worker_id):
+            self.pending = []
+            self.first_queued_at = None
+
 
 class Worker:
     """
     A worker process that fetches and executes jobs.
     """
-    def __init__(self, worker_id):
+    def __init__(self, worker_id, prefetch=1, concurrency=1, ack_batch=1, ack_flush_ms=50,
+                 queues=None, metrics_port=None):
         self.worker_id = worker_id
         self.running = True 
+        # Queues to take jobs from, in order of precedence (None = all).
+        self.queues = queues
+        # Jobs claimed in one batch but not started yet.
+        self.prefetch = max(1, prefetch)
+        self.buffer = deque()
+        # Number of jobs this process runs at once, and the running ones.
+        self.concurrency = max(1, concurrency)
+        self.in_flight = {}
+        # The local broker if one is running, with SQLite as the fallback.
+        self.backend = client.BrokerClient()
+        if self.backend.connect():
+            print(f"Worker {self.worker_id} using the broker at {self.backend.path}")
+        self.acks = AckBatcher(worker_id, self.backend, ack_batch, ack_flush_ms)
+        # Lease heartbeat and reaper schedule (monotonic deadlines).
+        self.next_heartbeat = 0
+        self.next_reap = 0
+        self.next_gc = time.monotonic()
+        # Warm process pool for 'callable' jobs, one slot per thread slot.
+        self.runner = executor.CallableRunner(
+            self.concurrency,
+            config.get_config_value('callable_max_tasks_per_child'),
+        )
+        self.job_timeout = config.get_config_value('job_timeout') or None
+        self.listener = notify.WakeupListener(worker_id)
+        self.idle_poll = IDLE_POLL_MIN
+        # Metrics snapshot for 'queuectl metrics', plus an optional
+        # Prometheus endpoint on localhost.
+        self.next_metrics_dump = 0
+        self.metrics_server = None
+        if metrics_port:
+            try:
+                self.metrics_server = metrics.start_http_server(metrics_port)
+                print(f"Worker {self.worker_id} serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+            except OSError as e:
+                print(f"Worker {self.worker_id} could not serve metrics on port {metrics_port}: {e}")
         self.setup_signal_handlers()
         print(f"Worker {self.worker_id} starting...")
 
@@ -22,52 +117,214 @@ class Worker:
 
     def handle_shutdown(self, signum, frame):
         """
-        Signal handler to initiate a graceful shutdown.
+        Signal handler to initiate a graceful shutdown. It only flags the
+        loop and wakes it: the handler may interrupt a transaction or a
+        broker request, so prefetched jobs are released by run() instead.
         """
-        print(f"Worker {self.worker_id} received shutdown signal {signum}. Finishing current job...")
+        print(f"Worker {self.worker_id} received shutdown signal {signum}. Finishing in-flight jobs...")
         self.running = False
+        self.listener.wake()
 
-    def run(self):
-        """The main worker loop."""
-        while self.running:
-            job = None
+    def release_buffered_jobs(self):
+        """Returns prefetched jobs that were never started to the queue."""
+        job_ids = []
+        while self.buffer:
+            job_ids.append(self.buffer.popleft()['id'])
+        if job_ids:
+            self.backend.release_jobs(job_ids)
+            print(f"Worker {self.worker_id} released {len(job_ids)} prefetched job(s): {job_ids}")
+
+    def next_job(self):
+        """
+        Returns the next job to run, refilling the local buffer in one claim
+        transaction when it is empty. The refill covers every free slot, or
+        'prefetch' jobs if that is larger.
+        """
+        if not self.buffer:
+            free_slots = self.concurrency - len(self.in_flight)
+            self.buffer.extend(self.backend.claim_batch(
+                self.worker_id, max(self.prefetch, free_slots), self.queues
+            ))
+        return self.buffer.popleft() if self.buffer else None
+
+    def finish_job(self, job, exit_code, output=None):
+        """
+        Records the outcome of a job, applying the retry/DLQ rules.
+        'output' describes the captured stdout/stderr, if any.
+        """
+        if exit_code == 0:
+            _jobs_finished['completed'].inc()
+            self.acks.add(job['id'], 'completed', output=output)
+            print(f"Worker {self.worker_id} completed job {job['id']}")
+            return
+
+        current_attempts = job['attempts'] + 1
+        max_retries = job['max_retries']
+
+        if current_attempts >= max_retries:
+            _jobs_finished['dead'].inc()
+            self.acks.add(job['id'], 'dead', increment_attempts=True, output=output)
+            print(f"Worker {self.worker_id} moved job {job['id']} to DLQ (attempts: {current_attempts}/{max_retries})")
+        else:
+            _jobs_finished['failed'].inc()
+            self.acks.add(job['id'], 'failed', increment_attempts=True, output=output)
+            print(f"Worker {self.worker_id} failed job {job['id']}, will retry (attempts: {current_attempts}/{max_retries})")
+
+    def collect_finished(self):
+        """
+        Records the result of every in-flight job that has finished and
+        returns how many there were.
+        """
+        done = [future for future in self.in_flight if future.done()]
+        for future in done:
+            job = self.in_flight.pop(future)
+            output = None
+            try:
+                exit_code, capture = future.result()
+                output = capture.as_dict() if capture else None
+            except Exception as e:
+                # On unexpected error, treat as a failure/retry
+                print(f"Worker {self.worker_id} encountered an error running job {job['id']}: {e}")
+                exit_code = -1
             try:
-                # 1. Atomically fetch a job (now supports backoff)
-                job = models.atomically_get_next_job(self.worker_id)
-
-                if job:
-                    print(f"Worker {self.worker_id} picked up job {job['id']}: {job['command']}")
-                    exit_code = executor.execute_job_command(job['command'])
-                    if exit_code == 0:
-                        models.update_job_state(job['id'], 'completed')
-                        print(f"Worker {self.worker_id} completed job {job['id']}")
-                    else:
-                        current_attempts = job['attempts'] + 1
-                        max_retries = job['max_retries']
-                        
-                        if current_attempts >= max_retries:
-                            models.update_job_state(job['id'], 'dead', increment_attempts=True)
-                            print(f"Worker {self.worker_id} moved job {job['id']} to DLQ (attempts: {current_attempts}/{max_retries})")
+                self.finish_job(job, exit_code, output)
+            except Exception as db_e:
+                print(f"Worker {self.worker_id} failed to update job state: {db_e}")
+        return len(done)
+
+    def idle_timeout(self):
+        """
+        How long to wait for a wakeup before polling again: the adaptive
+        idle interval, cut short if a failed job's backoff, a scheduled job
+        or a schedule run comes due sooner.
+        """
+        timeout = self.idle_poll
+        self.idle_poll = min(self.idle_poll * 2, IDLE_POLL_MAX)
+        due = self.backend.next_due()
+        if due is not None:
+            timeout = min(timeout, max(0, due - time.time()))
+        return self.cap_wait(timeout)
+
+    def cap_wait(self, timeout):
+        """
+        Shortens a wait so queued acks are flushed and leases renewed on time.
+        """
+        timeout = min(timeout, max(0, self.next_heartbeat - time.monotonic()))
+        ack_due = self.acks.time_until_flush()
+        return timeout if ack_due is None else min(timeout, ack_due)
+
+    def output_capture(self, job):
+        """Where this run of the job writes its stdout/stderr."""
+        return executor.OutputCapture.for_job(
+            database.OUTPUT_DIR,
+            job['id'],
+            config.get_config_value('output_head_bytes'),
+            config.get_config_value('output_tail_bytes'),
+        )
+
+    def maybe_collect_garbage(self):
+        """
+        Every 'gc_interval' seconds, removes (or archives) one small batch of
+        finished jobs past their retention TTL.
+        """
+        gc_interval = config.get_config_value('gc_interval')
+        now = time.monotonic()
+        if gc_interval <= 0 or now < self.next_gc:
+            return
+        self.next_gc = now + gc_interval
+        try:
+            stats = self.backend.gc_finished_jobs(max_batches=1)
+            removed = stats['completed'] + stats['dead'] + stats['cancelled']
+            if removed:
+                print(f"Worker {self.worker_id} garbage-collected {removed} finished job(s).")
+        except Exception as e:
+            print(f"Worker {self.worker_id} gc pass failed: {e}")
+
+    def maybe_dump_metrics(self):
+        """Writes this worker's metrics snapshot every DUMP_INTERVAL seconds."""
+        now = time.monotonic()
+        if now >= self.next_metrics_dump:
+            metrics.dump(self.worker_id)
+            self.next_metrics_dump = now + metrics.DUMP_INTERVAL
+
+    def maintain_leases(self):
+        """
+        Renews this worker's leases every third of 'lease_seconds', and
+        about once per lease period sweeps expired leases left behind by
+        workers that died.
+        """
+        now = time.monotonic()
+        lease_seconds = config.get_config_value('lease_seconds')
+        if now >= self.next_heartbeat:
+            if self.in_flight or self.buffer or self.acks.pending:
+                self.backend.renew_leases(self.worker_id)
+            self.next_heartbeat = now + lease_seconds / 3
+        if now >= self.next_reap:
+            reaped = self.backend.reap_expired_leases()
+            if reaped:
+                print(f"Worker {self.worker_id} reclaimed {len(reaped)} job(s) with expired leases: {reaped}")
+            self.next_reap = now + lease_seconds
+
+    def run(self):
+        """
+        The main worker loop.
+
+        Jobs run on a pool of 'concurrency' threads; claiming and every
+        state update stay on this thread, so the process uses one DB
+        connection however many jobs are in flight.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                thread_name_prefix=self.worker_id) as pool:
+            while self.running:
+                try:
+                    self.maintain_leases()
+                    self.acks.flush_if_due()
+                    self.maybe_collect_garbage()
+                    self.maybe_dump_metrics()
+
+                    # 1. Fill free slots (claims honour retry backoff)
+                    while self.running and len(self.in_flight) < self.concurrency:
+                        job = self.next_job()
+                        if not job:
+                            break
+                        print(f"Worker {self.worker_id} picked up job {job['id']}: {job['command']}")
+                        future = pool.submit(executor.execute_job, job, self.output_capture(job), self.runner, self.job_timeout)
+                        future.add_done_callback(lambda _: self.listener.wake())
+                        self.in_flight[future] = job
+                        self.idle_poll = IDLE_POLL_MIN
+
+                    # 2. Record finished jobs; freed slots are refilled first
+                    if self.collect_finished():
+                        continue
+
+                    # 3. Sleep until a job finishes, new work is announced,
+                    #    a retry comes due or the fallback poll interval ends
+                    if self.running:
+                        if len(self.in_flight) >= self.concurrency:
+                            self.listener.wait(self.cap_wait(IDLE_POLL_MAX))
                         else:
-                            models.update_job_state(job['id'], 'failed', increment_attempts=True)
-                            print(f"Worker {self.worker_id} failed job {job['id']}, will retry (attempts: {current_attempts}/{max_retries})")
+                            self.listener.wait(self.idle_timeout())
 
-                else:
+                except Exception as e:
                     if self.running:
-                        time.sleep(1)
+                        print(f"Worker {self.worker_id} encountered an error: {e}")
+                        time.sleep(1) # Wait after an error
 
-            except Exception as e:
-                if self.running:
-                    print(f"Worker {self.worker_id} encountered an error: {e}")
-                    if job:
-                        try:
-                            # On unexpected error, treat as a failure/retry
-                            if (job['attempts'] + 1) >= job['max_retries']:
-                                models.update_job_state(job['id'], 'dead', increment_attempts=True)
-                            else:
-                                models.update_job_state(job['id'], 'failed', increment_attempts=True)
-                        except Exception as db_e:
-                            print(f"Worker {self.worker_id} failed to update job state: {db_e}")
-                    time.sleep(1) # Wait after an error
-
-        print(f"Worker {self.worker_id} shutting down.")
\ No newline at end of file
+            # Prefetched jobs that were never started.
+            self.release_buffered_jobs()
+            if self.in_flight:
+                print(f"Worker {self.worker_id} waiting for {len(self.in_flight)} in-flight job(s)...")
+            while self.in_flight:
+                self.listener.wait(self.cap_wait(IDLE_POLL_MAX))
+                self.collect_finished()
+                self.maintain_leases()
+                self.acks.flush_if_due()
+            self.acks.flush()
+
+        self.runner.shutdown()
+        self.listener.close()
+        self.backend.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        metrics.remove_dump(self.worker_id)
+        print(f"Worker {self.worker_id} shutting down.")
@@ -3,7 +3,25 @@ This is invoked via: python -m queuectl.worker_launcher
 It isolates worker startup from the CLI process so the CLI can exit
 immediately without waiting for multiprocessing joins.
 """
+import argparse
 from .cli import start_worker_process
 
 if __name__ == '__main__':
-    start_worker_process()
+    parser = argparse.ArgumentParser(prog='queuectl.worker_launcher')
+    parser.add_argument('--prefetch', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--ack-batch', type=int, default=1)
+    parser.add_argument('--ack-flush-ms', type=int, default=50)
+    parser.add_argument('--queues', default=None)
+    parser.add_argument('--metrics-port', type=int, default=None)
+    parser.add_argument('--profile', action='store_true')
+    args = parser.parse_args()
+    start_worker_process(
+        prefetch=args.prefetch,
+        concurrency=args.concurrency,
+        ack_batch=args.ack_batch,
+        ack_flush_ms=args.ack_flush_ms,
+        queues=args.queues.split(',') if args.queues else None,
+        metrics_port=args.metrics_port,
+        profile=args.profile,
+    )
@@ -4,6 +4,8 @@ setup(
     name='queuectl',
     version='0.1.0',
     packages=find_packages(),
+    # ProcessPoolExecutor(max_tasks_per_child=...) is new in 3.11.
+    python_requires='>=3.11',
     include_package_data=True,
     install_requires=[
         'click',
@@ -0,0 +1,26 @@
+import contextlib
+import os
+import pytest
+from queuectl import config
+from queuectl import database
+
+
+@pytest.fixture
+def queue_home(tmp_path, monkeypatch):
+    """Points queuectl at a new, initialized directory for one test."""
+    home = str(tmp_path / 'queuectl')
+    monkeypatch.setenv('QUEUECTL_HOME', home)
+    database.set_app_dir(home)
+    # The config cache is keyed by the stamp file, which a new directory
+    # does not have yet.
+    config._cache = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        database.init_db()
+    yield home
+    database.close_db_connection()
+    config._cache = None
+
+
+def job(job_id, **fields):
+    """A minimal job dict."""
+    return dict({'id': job_id, 'argv': ['true']}, **fields)
@@ -0,0 +1,64 @@
+import time
+from queuectl import models
+from queuectl.worker import AckBatcher
+from conftest import job
+
+
+def claim_all(worker_id, count):
+    claimed = models.claim_batch(worker_id, count)
+    assert len(claimed) == count
+    return [j['id'] for j in claimed]
+
+
+def test_acks_wait_for_a_full_batch(queue_home):
+    models.create_jobs(job(f"j{i}") for i in range(3))
+    ids = claim_all('w1', 3)
+    acks = AckBatcher('w1', models, max_batch=3, max_delay_ms=60000)
+
+    acks.add(ids[0], 'completed')
+    acks.add(ids[1], 'completed')
+    assert models.get_job(ids[0])['state'] == 'processing'
+    assert len(acks.pending) == 2
+
+    acks.add(ids[2], 'completed')
+    assert acks.pending == []
+    assert {models.get_job(i)['state'] for i in ids} == {'completed'}
+
+
+def test_acks_flush_once_the_oldest_is_due(queue_home):
+    models.create_job(job('a'))
+    [job_id] = claim_all('w1', 1)
+    acks = AckBatcher('w1', models, max_batch=100, max_delay_ms=20)
+
+    acks.add(job_id, 'failed', increment_attempts=True)
+    acks.flush_if_due()
+    assert models.get_job(job_id)['state'] == 'processing'
+
+    time.sleep(0.03)
+    assert acks.time_until_flush() == 0
+    acks.flush_if_due()
+    stored = models.get_job(job_id)
+    assert stored['state'] == 'failed'
+    assert stored['attempts'] == 1
+
+
+def test_failed_flush_keeps_the_acks(queue_home):
+    class Unavailable:
+        def apply_job_transitions(self, transitions, worker_id=None):
+            return False
+
+    acks = AckBatcher('w1', Unavailable(), max_batch=1)
+    acks.add('a', 'completed')
+    assert acks.pending == [('a', 'completed', False, None)]
+
+
+def test_acks_from_a_worker_that_lost_the_lease_are_ignored(queue_home):
+    models.create_job(job('a'))
+    [job_id] = claim_all('w1', 1)
+    models.release_jobs([job_id])
+    [job_id] = claim_all('w2', 1)
+
+    AckBatcher('w1', models).add(job_id, 'completed')
+    stored = models.get_job(job_id)
+    assert stored['state'] == 'processing'
+    assert stored['worker_id'] == 'w2'
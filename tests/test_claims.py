@@ -0,0 +1,78 @@
+import time
+from queuectl import models
+from conftest import job
+
+
+def add_backed_off_retries(prefix, count, tenant='default'):
+    """Inserts count 'failed' jobs whose backoff runs for another hour."""
+    future = time.time() + 3600
+    for _, conn in models._shard_connections():
+        conn.execute(
+            """
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO jobs (id, command, state, attempts, created_at, updated_at, next_run_at, tenant)
+            SELECT ? || '-' || i, 'true', 'failed', 1, '2026-01-01', '2026-01-01', ?, ? FROM n
+            """,
+            (count, prefix, future, tenant)
+        )
+        conn.commit()
+
+
+def claim_steps(worker_id):
+    """Claims one job and returns how many SQLite VM steps that took."""
+    steps = [0]
+
+    def count():
+        steps[0] += 1
+        return 0
+
+    conns = [conn for _, conn in models._shard_connections()]
+    for conn in conns:
+        conn.set_progress_handler(count, 1)
+    try:
+        [claimed] = models.claim_batch(worker_id, 1)
+    finally:
+        for conn in conns:
+            conn.set_progress_handler(None, 0)
+    return claimed, steps[0]
+
+
+def test_due_retry_is_promoted_and_claimed(queue_home):
+    models.create_job(job('a', max_retries=3))
+    models.claim_batch('w1', 1)
+    models.apply_job_transitions([('a', 'failed', True)], worker_id='w1')
+    assert models.claim_batch('w1', 1) == []
+
+    for _, conn in models._shard_connections():
+        conn.execute("UPDATE jobs SET next_run_at = ? WHERE id = 'a'", (time.time() - 1,))
+        conn.commit()
+    [claimed] = models.claim_batch('w1', 1)
+    assert claimed['id'] == 'a'
+    assert claimed['attempts'] == 1
+
+
+def test_claim_cost_does_not_grow_with_backed_off_retries(queue_home):
+    models.create_job(job('first'))
+    add_backed_off_retries('small', 100)
+    claimed, small = claim_steps('w1')
+    assert claimed['id'] == 'first'
+
+    models.create_job(job('second'))
+    add_backed_off_retries('large', 20000)
+    claimed, large = claim_steps('w1')
+    assert claimed['id'] == 'second'
+    assert large < small * 1.5
+
+
+def test_fair_share_skips_tenants_with_only_backed_off_retries(queue_home):
+    models.create_job(job('first', tenant='busy'))
+    add_backed_off_retries('small', 100, tenant='busy')
+    claimed, small = claim_steps('w1')
+    assert claimed['id'] == 'first'
+
+    models.create_job(job('second', tenant='busy'))
+    for t in range(200):
+        add_backed_off_retries(f't{t}', 100, tenant=f't{t}')
+    claimed, large = claim_steps('w1')
+    assert claimed['id'] == 'second'
+    assert large < small * 1.5
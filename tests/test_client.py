@@ -0,0 +1,45 @@
+import socket
+import threading
+import pytest
+from queuectl import client
+from queuectl import models
+from conftest import job
+
+
+@pytest.fixture
+def vanishing_broker(tmp_path):
+    """A broker that reads each request and hangs up without replying."""
+    path = str(tmp_path / 'broker.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn, conn.makefile('rb') as reader:
+                reader.readline()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield path
+    server.close()
+
+
+def test_claim_lost_after_sending_is_not_redone(queue_home, vanishing_broker):
+    models.create_job(job('a'))
+    backend = client.BrokerClient(vanishing_broker)
+    assert backend.connect()
+    with pytest.raises(client.BrokerError):
+        backend.claim_batch('w1', 1)
+    assert models.get_job('a')['state'] == 'pending'
+
+
+def test_read_lost_after_sending_falls_back(queue_home, vanishing_broker):
+    models.create_job(job('a'))
+    backend = client.BrokerClient(vanishing_broker)
+    assert backend.connect()
+    assert backend.get_job('a')['state'] == 'pending'
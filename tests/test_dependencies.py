@@ -0,0 +1,164 @@
+import time
+import pytest
+from queuectl import config
+from queuectl import database
+from queuectl import models
+from conftest import job
+
+
+def state(job_id):
+    return models.get_job(job_id)['state']
+
+
+def finish(job_id, new_state='completed'):
+    """Claims (if needed) and acks one job like a worker would."""
+    if state(job_id) != 'processing':
+        claimed = [j['id'] for j in models.claim_batch('w1', 100)]
+        assert job_id in claimed
+        models.release_jobs([other for other in claimed if other != job_id])
+    assert models.apply_job_transitions([(job_id, new_state, new_state != 'completed', None)], worker_id='w1')
+
+
+@pytest.fixture(params=[1, 3], ids=['one-file', 'three-shards'])
+def shards(request, queue_home):
+    models.migrate_shards(request.param)
+    return request.param
+
+
+def test_fan_in_waits_for_every_parent(shards):
+    models.create_jobs(job(f"p{i}") for i in range(5))
+    models.create_job(job('child', depends_on=[f"p{i}" for i in range(5)]))
+    assert state('child') == 'blocked'
+    assert models.get_job('child')['pending_deps'] == 5
+
+    for i in range(4):
+        finish(f"p{i}")
+        assert state('child') == 'blocked'
+    finish('p4')
+    assert state('child') == 'pending'
+    assert models.get_job_summary()['blocked'] == 0
+
+
+def test_fan_out_releases_every_child(shards):
+    models.create_job(job('root'))
+    models.create_jobs(job(f"c{i}", depends_on=['root']) for i in range(20))
+    finish('root')
+    assert {state(f"c{i}") for i in range(20)} == {'pending'}
+
+
+def test_completed_parent_does_not_block(shards):
+    models.create_job(job('p'))
+    finish('p')
+    models.create_job(job('c', depends_on=['p']))
+    assert state('c') == 'pending'
+
+
+def test_released_child_keeps_its_own_run_at(shards):
+    models.create_job(job('p'))
+    models.create_job(job('c', depends_on=['p'], delay_seconds=3600))
+    finish('p')
+    assert state('c') == 'scheduled'
+    assert models.get_job('c')['next_run_at'] > time.time() + 3000
+
+
+def test_failed_attempt_does_not_release(shards):
+    models.create_job(job('p', max_retries=3))
+    models.create_job(job('c', depends_on=['p']))
+    finish('p', 'failed')
+    assert state('c') == 'blocked'
+
+
+def test_dead_parent_cancels_the_descendants(shards):
+    models.create_job(job('p'))
+    models.create_job(job('c', depends_on=['p']))
+    models.create_job(job('g', depends_on=['c']))
+    finish('p', 'dead')
+    assert state('c') == 'cancelled'
+    assert state('g') == 'cancelled'
+
+    models.create_job(job('late', depends_on=['p']))
+    assert state('late') == 'cancelled'
+
+
+def test_hold_waits_for_a_retried_parent(shards):
+    config.set_config_value('on_parent_dead', 'hold')
+    models.create_job(job('p'))
+    models.create_job(job('c', depends_on=['p']))
+    finish('p', 'dead')
+    assert state('c') == 'blocked'
+
+    models.retry_dead_job('p')
+    finish('p')
+    assert state('c') == 'pending'
+
+
+def test_parent_failing_during_the_insert_cancels_the_child(shards, monkeypatch):
+    models.create_job(job('p'))
+    add_edges = models._add_edges
+
+    def parent_dies_first(conn, parents, child_id, hold=False):
+        # The parent reaches the DLQ after its state was read.
+        parent_conn = database.get_db_connection(models.shard_of('p'))
+        parent_conn.execute("UPDATE jobs SET state = 'dead' WHERE id = 'p'")
+        parent_conn.commit()
+        models._settle_dead_parents(['p'])
+        return add_edges(conn, parents, child_id, hold)
+
+    monkeypatch.setattr(models, '_add_edges', parent_dies_first)
+    models.create_job(job('c', depends_on=['p']))
+    assert state('c') == 'cancelled'
+
+
+def test_invalid_dependencies_are_rejected(shards):
+    models.create_job(job('p'))
+    for bad in (job('c', depends_on=['missing']), job('c', depends_on='p'), job('c', depends_on=['c'])):
+        with pytest.raises(ValueError):
+            models.create_job(bad)
+    assert models.get_job('c') is None
+
+    errors = []
+    stats = models.create_jobs(
+        [job('c', depends_on=['missing']), job('d', depends_on=['p'])],
+        on_error=lambda job_data, message: errors.append(job_data['id']),
+    )
+    assert stats['inserted'] == 1
+    assert errors == ['c']
+
+
+def test_recount_repairs_a_lost_count_down(shards):
+    models.create_jobs([job('p1'), job('p2')])
+    models.create_job(job('c', depends_on=['p1', 'p2']))
+    finish('p1')
+    # As if the count-down for p2's completion had been lost.
+    for _, conn in models._shard_connections():
+        conn.execute("DELETE FROM job_deps WHERE parent_id = 'p2'")
+        conn.commit()
+    assert state('c') == 'blocked'
+
+    models.recount_jobs()
+    assert state('c') == 'pending'
+
+
+def test_gc_cancels_jobs_blocked_on_a_collected_parent(shards):
+    config.set_config_value('on_parent_dead', 'hold')
+    config.set_config_value('dead_ttl', '1')
+    models.create_job(job('p'))
+    models.create_job(job('c', depends_on=['p']))
+    finish('p', 'dead')
+    conn = database.get_db_connection(models.shard_of('p'))
+    conn.execute("UPDATE jobs SET updated_at = '2000-01-01T00:00:00+00:00' WHERE id = 'p'")
+    conn.commit()
+
+    assert models.gc_finished_jobs(archive=False)['dead'] == 1
+    assert state('c') == 'cancelled'
+
+
+def test_enqueue_reports_the_state_decided_at_insert(shards):
+    assert models.enqueue_job(job('p'))['state'] == 'pending'
+    blocked = models.enqueue_job(job('child', depends_on=['p']))
+    assert (blocked['state'], blocked['pending_deps']) == ('blocked', 1)
+    later = models.enqueue_job(job('later', delay_seconds=60))
+    assert later['state'] == 'scheduled' and later['next_run_at'] > time.time()
+
+    finish('p')
+    assert models.enqueue_job(job('after', depends_on=['p']))['state'] == 'pending'
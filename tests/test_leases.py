@@ -0,0 +1,73 @@
+import time
+from queuectl import config
+from queuectl import models
+from conftest import job
+
+
+def expire_leases():
+    for _, conn in models._shard_connections():
+        conn.execute("UPDATE jobs SET lease_expires_at = ? WHERE state = 'processing'", (time.time() - 1,))
+        conn.commit()
+
+
+def test_claim_leases_the_job_to_the_worker(queue_home):
+    config.set_config_value('lease_seconds', '30')
+    models.create_job(job('a'))
+    before = time.time()
+    [claimed] = models.claim_batch('w1', 1)
+    assert claimed['worker_id'] == 'w1'
+    assert before + 30 <= claimed['lease_expires_at'] <= time.time() + 30
+
+
+def test_expired_lease_counts_as_a_failed_attempt(queue_home):
+    models.create_job(job('a', max_retries=3))
+    models.claim_batch('w1', 1)
+    assert models.reap_expired_leases() == []
+
+    expire_leases()
+    assert models.count_stale_leases() == 1
+    assert models.reap_expired_leases() == ['a']
+    stored = models.get_job('a')
+    assert stored['state'] == 'failed'
+    assert stored['attempts'] == 1
+    assert stored['lease_expires_at'] is None
+    assert stored['next_run_at'] > time.time()
+    assert models.count_stale_leases() == 0
+
+
+def test_expired_lease_without_retries_left_goes_to_the_dlq(queue_home):
+    models.create_job(job('a', max_retries=1))
+    models.claim_batch('w1', 1)
+    expire_leases()
+    assert models.reap_expired_leases() == ['a']
+    assert models.get_job('a')['state'] == 'dead'
+
+
+def test_heartbeat_keeps_the_lease(queue_home):
+    models.create_jobs([job('a'), job('b')])
+    models.claim_batch('w1', 1)
+    models.claim_batch('w2', 1)
+    expire_leases()
+
+    assert models.renew_leases('w1') == 1
+    reaped = models.reap_expired_leases()
+    assert len(reaped) == 1
+    assert models.get_job(reaped[0])['worker_id'] == 'w2'
+
+
+def test_reaped_job_rejects_the_late_ack(queue_home):
+    models.create_job(job('a'))
+    models.claim_batch('w1', 1)
+    expire_leases()
+    models.reap_expired_leases()
+
+    assert models.apply_job_transitions([('a', 'completed', False, None)], worker_id='w1')
+    assert models.get_job('a')['state'] == 'failed'
+
+
+def test_reaping_is_shared_by_every_shard(queue_home):
+    models.migrate_shards(3)
+    models.create_jobs(job(f"j{i}") for i in range(12))
+    assert len(models.claim_batch('w1', 12)) == 12
+    expire_leases()
+    assert sorted(models.reap_expired_leases()) == sorted(f"j{i}" for i in range(12))
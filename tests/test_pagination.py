@@ -0,0 +1,50 @@
+import pytest
+from queuectl import models
+from conftest import job
+
+
+def page_through(limit, **filters):
+    """Lists everything one list_jobs page at a time, as 'queuectl list' does."""
+    seen = []
+    after = None
+    while True:
+        page = models.list_jobs(limit=limit, after=after, **filters)
+        seen.extend(page)
+        if len(page) < limit:
+            return seen
+        after = models.make_cursor(page[-1])
+
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_pages_cover_every_job_once_in_order(queue_home, shards):
+    models.migrate_shards(shards)
+    models.create_jobs(job(f"j{i:03}") for i in range(250))
+
+    seen = page_through(40)
+    keys = [(j['created_at'], j['id']) for j in seen]
+    assert keys == sorted(keys)
+    assert sorted(j['id'] for j in seen) == [f"j{i:03}" for i in range(250)]
+
+
+def test_pages_filter_by_state_and_queue(queue_home):
+    models.create_jobs(job(f"a{i}", queue='a') for i in range(30))
+    models.create_jobs(job(f"b{i}", queue='b') for i in range(30))
+    models.claim_batch('w1', 10, queues=['a'])
+
+    pending_a = page_through(7, state='pending', queue='a')
+    assert len(pending_a) == 20
+    assert {j['queue'] for j in pending_a} == {'a'}
+    assert {j['state'] for j in pending_a} == {'pending'}
+
+
+def test_iter_jobs_resumes_after_a_cursor(queue_home):
+    models.create_jobs(job(f"j{i:02}") for i in range(50))
+    everything = list(models.iter_jobs(page_size=8))
+    cursor = models.make_cursor(everything[19])
+    assert list(models.iter_jobs(after=cursor, page_size=8)) == everything[20:]
+    assert list(models.iter_jobs(after=cursor, limit=5)) == everything[20:25]
+
+
+def test_invalid_cursor_is_rejected(queue_home):
+    with pytest.raises(ValueError):
+        list(models.iter_jobs(after='not-a-cursor'))
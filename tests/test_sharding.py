@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+from queuectl import database
+from queuectl import models
+from conftest import job
+
+
+def test_claim_batch_collects_jobs_from_every_shard(queue_home):
+    models.migrate_shards(3)
+    models.create_jobs(job(f"j{i}") for i in range(30))
+    assert {models.shard_of(f"j{i}") for i in range(30)} == {0, 1, 2}
+
+    claimed = models.claim_batch('w1', 30)
+    assert sorted(j['id'] for j in claimed) == sorted(f"j{i}" for i in range(30))
+    assert models.claim_batch('w1', 1) == []
+    assert models.get_job_summary()['processing'] == 30
+
+
+def test_concurrent_claims_never_share_a_job(queue_home):
+    models.migrate_shards(3)
+    models.create_jobs(job(f"j{i}") for i in range(200))
+    claimed = {}
+    errors = []
+
+    def claim(worker_id):
+        try:
+            while True:
+                jobs = models.claim_batch(worker_id, 7)
+                if not jobs:
+                    return
+                claimed.setdefault(worker_id, []).extend(j['id'] for j in jobs)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            database.close_db_connection()
+
+    threads = [threading.Thread(target=claim, args=(f"w{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    ids = [job_id for jobs in claimed.values() for job_id in jobs]
+    assert len(ids) == len(set(ids)) == 200
+
+
+def test_tenant_cap_holds_across_shards(queue_home):
+    models.migrate_shards(3)
+    models.set_tenant('acme', max_concurrency=4)
+    models.create_jobs(job(f"j{i}", tenant='acme') for i in range(30))
+    assert len(models.claim_batch('w1', 30)) == 4
+    assert models.claim_batch('w2', 30) == []
+
+
+def test_locked_shard_is_skipped(queue_home):
+    models.migrate_shards(2)
+    models.create_jobs(job(f"j{i}") for i in range(20))
+    blocker = sqlite3.connect(database.shard_path(0), isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        database.get_db_connection(0).execute("PRAGMA busy_timeout = 50")
+        claimed = models.claim_batch('w1', 20)
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert claimed
+    assert {models.shard_of(j['id']) for j in claimed} == {1}
+
+
+def snapshot():
+    jobs = {j['id']: (j['state'], j['queue'], j['attempts']) for j in models.iter_jobs()}
+    edges = set()
+    for _, conn in models._shard_connections():
+        edges.update(tuple(row) for row in conn.execute("SELECT parent_id, child_id FROM job_deps"))
+    return jobs, edges, models.get_job_summary()
+
+
+def test_migrate_shards_round_trip(queue_home):
+    models.set_tenant('acme', weight=3)
+    models.create_jobs(job(f"j{i}", queue='q' if i % 2 else 'default') for i in range(100))
+    models.create_jobs(job(f"c{i}", depends_on=[f"j{i}", f"j{i + 50}"]) for i in range(10))
+    models.claim_batch('w1', 10)
+    before = snapshot()
+
+    for shards in (3, 2, 1):
+        models.migrate_shards(shards)
+        assert models.shard_count() == shards
+        assert snapshot() == before
+        for _, conn in models._shard_connections():
+            assert conn.execute(
+                "SELECT weight FROM tenants WHERE name = 'acme'"
+            ).fetchone()['weight'] == 3
+        for shard in range(shards):
+            for job_id in [row['id'] for row in database.get_db_connection(shard).execute("SELECT id FROM jobs")]:
+                assert models.shard_of(job_id) == shard
+            for row in database.get_db_connection(shard).execute("SELECT parent_id FROM job_deps"):
+                assert models.shard_of(row['parent_id']) == shard
+
+    assert not os.path.exists(database.shard_path(1))
+    assert not os.path.exists(database.shard_path(2))